@@ -0,0 +1,251 @@
+"""
+Overview aggregation.
+
+Analytics endpoints are computed in two steps:
+
+1. an aggregation pass turns events into "count tables" (plain dicts of
+   group -> count, plus the set of session ids), and
+2. `build_overview` turns the current/previous count tables into the
+   response payload the dashboard expects.
+
+Splitting the two lets alternative engines (columnar segments, vectorized
+paths) produce the same count tables and share the response code.
+"""
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+COUNT_TABLES = ('page_counts', 'daily', 'browsers', 'referrers', 'continents', 'devices', 'countries')
+
+
+def classify_browser(ua: str) -> str:
+    if 'Chrome' in ua and 'Edg' not in ua:
+        return 'Chrome'
+    elif 'Safari' in ua and 'Chrome' not in ua:
+        return 'Safari'
+    elif 'Firefox' in ua:
+        return 'Firefox'
+    elif 'Edg' in ua:
+        return 'Edge'
+    return 'Other'
+
+
+def classify_device(ua: Optional[str]) -> str:
+    ua_lower = (ua or '').lower()
+    if any(k in ua_lower for k in ['mobile', 'iphone', 'android', 'ipod', 'opera mini']):
+        return 'Mobile'
+    elif any(k in ua_lower for k in ['ipad', 'tablet', 'kindle']):
+        return 'Tablet'
+    elif any(k in ua_lower for k in ['bot', 'spider', 'crawl']):
+        return 'Bot'
+    return 'Desktop'
+
+
+def provider_for_ref(ref: Optional[str]) -> str:
+    """Aggregate referrers into provider-friendly buckets (Gmail, Outlook, Yahoo, Google, Bing, Direct, etc.)"""
+    if not ref:
+        return 'Direct'
+    s = ref.lower()
+    # direct / empty
+    if s in ('direct', 'direct / none', ''):
+        return 'Direct'
+    # common mail providers
+    if 'mail.google' in s or 'gmail' in s:
+        return 'Gmail'
+    if 'outlook' in s or 'office' in s or 'live.com' in s or 'hotmail' in s:
+        return 'Outlook/Hotmail'
+    if 'yahoo' in s:
+        return 'Yahoo Mail'
+    # social / search
+    if 'facebook' in s:
+        return 'Facebook'
+    if 't.co' in s or 'twitter' in s:
+        return 'Twitter'
+    if 'linkedin' in s:
+        return 'LinkedIn'
+    if 'google' in s and 'mail' not in s:
+        return 'Google'
+    if 'bing' in s:
+        return 'Bing'
+    if 'duck' in s:
+        return 'DuckDuckGo'
+    # fallback: extract hostname
+    try:
+        host = re.sub(r'^https?://(www\.)?', '', ref).split('/')[0]
+        return host or ref
+    except Exception:
+        return ref
+
+
+def empty_counts() -> Dict[str, Any]:
+    counts = {table: {} for table in COUNT_TABLES}
+    counts.update(total_events=0, total_pageviews=0, sessions=set())
+    return counts
+
+
+def merge_counts(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine count tables of two disjoint event sets."""
+    merged = empty_counts()
+    merged['total_events'] = a['total_events'] + b['total_events']
+    merged['total_pageviews'] = a['total_pageviews'] + b['total_pageviews']
+    merged['sessions'] = a['sessions'] | b['sessions']
+    for table in COUNT_TABLES:
+        target = merged[table]
+        for source in (a[table], b[table]):
+            for key, cnt in source.items():
+                target[key] = target.get(key, 0) + cnt
+    return merged
+
+
+def merge_many(tables: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """merge_counts over any number of disjoint count tables, without intermediate copies."""
+    merged = empty_counts()
+    for source in tables:
+        merged['total_events'] += source['total_events']
+        merged['total_pageviews'] += source['total_pageviews']
+        merged['sessions'] |= source['sessions']
+        for table in COUNT_TABLES:
+            target = merged[table]
+            for key, cnt in source[table].items():
+                target[key] = target.get(key, 0) + cnt
+    return merged
+
+
+def aggregate_events(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reference (pure Python) aggregation pass over stored event documents."""
+    counts = empty_counts()
+    page_counts = counts['page_counts']
+    daily = counts['daily']
+    browsers = counts['browsers']
+    referrers = counts['referrers']
+    continents = counts['continents']
+    devices = counts['devices']
+    countries = counts['countries']
+    sessions = counts['sessions']
+    total_events = 0
+    total_pageviews = 0
+    # Pages are counted by interned page id where events carry one (URL otherwise)
+    page_names: Dict[Any, str] = {}
+
+    for e in events:
+        total_events += 1
+        sessions.add(e['session_id'])
+
+        # Traffic over time (daily)
+        date_str = e['timestamp'][:10]  # YYYY-MM-DD
+        daily[date_str] = daily.get(date_str, 0) + 1
+
+        ua = e.get('user_agent')
+        if ua:
+            browser = classify_browser(ua)
+            browsers[browser] = browsers.get(browser, 0) + 1
+
+        if e['event_type'] != 'pageview':
+            continue
+        total_pageviews += 1
+
+        url = e.get('page_url')
+        if url:
+            key = e.get('page_id') or url
+            cnt = page_counts.get(key)
+            if cnt is None:
+                page_names[key] = url
+                cnt = 0
+            page_counts[key] = cnt + 1
+
+        referrer = e.get('referrer') or 'Direct'
+        referrers[referrer] = referrers.get(referrer, 0) + 1
+
+        cont = e.get('continent')
+        if cont:
+            continents[cont] = continents.get(cont, 0) + 1
+
+        dev = classify_device(ua)
+        devices[dev] = devices.get(dev, 0) + 1
+
+        c = e.get('country') or 'Unknown'
+        countries[c] = countries.get(c, 0) + 1
+
+    counts['page_counts'] = {}
+    for key, cnt in page_counts.items():
+        url = page_names[key]
+        counts['page_counts'][url] = counts['page_counts'].get(url, 0) + cnt
+    counts['total_events'] = total_events
+    counts['total_pageviews'] = total_pageviews
+    return counts
+
+
+def aggregate_totals(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Only the totals `build_overview` needs from the comparison period."""
+    counts = empty_counts()
+    for e in events:
+        counts['total_events'] += 1
+        if e['event_type'] == 'pageview':
+            counts['total_pageviews'] += 1
+        counts['sessions'].add(e['session_id'])
+    return counts
+
+
+def percent_change(current: int, previous: int) -> float:
+    # If there's current data but no previous data, show 100% (first time)
+    # If there's no current data, show -100% (decreased to zero)
+    if previous > 0:
+        return round(((current - previous) / previous) * 100, 1)
+    elif current > 0:
+        return 100  # New data (first time)
+    return 0
+
+
+def top_items(counts: Dict[str, int], n: int) -> List:
+    return sorted(counts.items(), key=lambda x: x[1], reverse=True)[:n]
+
+
+def build_overview(cur: Dict[str, Any], prev: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the /overview response from current and previous period count tables."""
+    total_pageviews = cur['total_pageviews']
+    unique_sessions = len(cur['sessions'])
+    total_events = cur['total_events']
+
+    top_pages = top_items(cur['page_counts'], 5)
+
+    provider_counts: Dict[str, int] = {}
+    for raw_ref, cnt in cur['referrers'].items():
+        provider = provider_for_ref(raw_ref)
+        provider_counts[provider] = provider_counts.get(provider, 0) + cnt
+    top_referrers = top_items(provider_counts, 10)
+
+    # Build continent list sorted by count
+    continents_list = [
+        {"name": name, "count": count, "percentage": round((count / total_pageviews * 100), 1) if total_pageviews > 0 else 0}
+        for name, count in top_items(cur['continents'], len(cur['continents']))
+    ]
+
+    # Ensure at least empty keys for consistent UI
+    device_counts = dict(cur['devices'])
+    for key in ['Desktop', 'Mobile', 'Tablet', 'Bot']:
+        device_counts.setdefault(key, 0)
+
+    # Build countries list sorted by count (limit to top 10 for payload size)
+    countries_list = [
+        {"iso": name, "count": count, "percentage": round((count / total_pageviews * 100), 1) if total_pageviews > 0 else 0}
+        for name, count in top_items(cur['countries'], 10)
+    ]
+
+    # Average metrics
+    avg_events_per_session = round(total_events / unique_sessions, 2) if unique_sessions > 0 else 0
+
+    return {
+        "total_pageviews": total_pageviews,
+        "unique_sessions": unique_sessions,
+        "total_events": total_events,
+        "avg_events_per_session": avg_events_per_session,
+        "pageviews_change": percent_change(total_pageviews, prev['total_pageviews']),
+        "sessions_change": percent_change(unique_sessions, len(prev['sessions'])),
+        "events_change": percent_change(total_events, prev['total_events']),
+        "top_pages": [{"url": url, "views": count} for url, count in top_pages],
+        "daily_traffic": [{"date": date, "count": count} for date, count in sorted(cur['daily'].items())],
+        "browsers": dict(top_items(cur['browsers'], 5)),
+        "referrers": [{"source": ref, "count": count} for ref, count in top_referrers],
+        "continents": continents_list,
+        "devices": device_counts,
+        "countries": countries_list
+    }
@@ -0,0 +1,72 @@
+"""
+Build the offline IP -> country index (ip_ranges.bin) used when no GeoLite2
+database is installed.
+
+Sources (where ranges overlap, the one starting first wins):
+  --csv FILE         'first,last,country' rows, e.g. db-ip "IP to Country Lite"
+  --delegated FILE   RIR statistics files (delegated-*-extended-latest)
+  --download         fetch the five RIR statistics files (public, no license key)
+
+    python build_ip_ranges.py --download
+    python build_ip_ranges.py --csv dbip-country-lite.csv --output /srv/ip_ranges.bin
+"""
+import argparse
+import gzip
+import io
+import logging
+import urllib.request
+from pathlib import Path
+
+from iprange import IpRangeIndex, build_index, parse_csv, parse_delegated
+
+logger = logging.getLogger(__name__)
+
+RIR_STATISTICS = [
+    "https://ftp.arin.net/pub/stats/arin/delegated-arin-extended-latest",
+    "https://ftp.ripe.net/pub/stats/ripencc/delegated-ripencc-extended-latest",
+    "https://ftp.apnic.net/stats/apnic/delegated-apnic-extended-latest",
+    "https://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-extended-latest",
+    "https://ftp.afrinic.net/pub/stats/afrinic/delegated-afrinic-extended-latest",
+]
+
+
+def read_lines(source: str):
+    if source.startswith(('http://', 'https://')):
+        logger.info(f"📥 Downloading {source}")
+        with urllib.request.urlopen(source, timeout=60) as response:
+            data = response.read()
+    else:
+        data = Path(source).read_bytes()
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return io.StringIO(data.decode('utf-8', errors='replace'))
+
+
+def build_ip_ranges(output: Path, csv_files=(), delegated_files=(), download=False) -> bool:
+    ranges = []
+    for source in csv_files:
+        ranges.extend(parse_csv(read_lines(source)))
+    for source in list(delegated_files) + (RIR_STATISTICS if download else []):
+        ranges.extend(parse_delegated(read_lines(source)))
+    if not ranges:
+        logger.error("No ranges read; pass --csv, --delegated or --download")
+        return False
+
+    tmp = output.with_suffix('.tmp')
+    tmp.write_bytes(build_index(ranges))
+    tmp.replace(output)
+    index = IpRangeIndex.open(str(output))
+    logger.info(f"✓ IP range index written to {output}: {index.stats()}")
+    index.close()
+    return True
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', action='append', default=[])
+    parser.add_argument('--delegated', action='append', default=[])
+    parser.add_argument('--download', action='store_true')
+    parser.add_argument('--output', default=str(Path(__file__).parent / 'ip_ranges.bin'))
+    args = parser.parse_args()
+    raise SystemExit(0 if build_ip_ranges(Path(args.output), args.csv, args.delegated, args.download) else 1)
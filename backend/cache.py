@@ -0,0 +1,277 @@
+"""
+Response cache for analytics endpoints.
+
+Results are cached per (project, params, time bucket) and validated with a
+per-project version counter that `track_event` bumps whenever a new event
+lands. The same (version, bucket) pair also yields a stable ETag, so clients
+can revalidate with If-None-Match / If-Modified-Since and get a
+304 Not Modified without the server recomputing anything.
+
+Versions live in the `SharedState`, so every worker agrees on ETags; with a
+shared (Redis) state the computed payloads are shared between workers too.
+"""
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+
+class ResponseCache:
+    def __init__(self, state, max_entries: int = 1024, bucket_seconds: int = 60):
+        self.state = state
+        self.max_entries = max_entries
+        self.bucket_seconds = bucket_seconds
+        self.epoch = None
+        self._entries: "OrderedDict[Tuple, Tuple[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    async def start(self):
+        # Distinguishes ETags across restarts of an in-memory state, when version counters start over
+        await self.state.set('cache:epoch', uuid.uuid4().hex[:8], nx=True)
+        self.epoch = await self.state.get('cache:epoch')
+
+    # ---------- invalidation ----------
+
+    async def bump(self, project_id: str):
+        """Mark a project's data as changed (called for every tracked event)."""
+        await self.state.incr(f'cache:version:{project_id}')
+        await self.state.set(f'cache:modified:{project_id}', repr(time.time()))
+
+    async def drop_project(self, project_id: str):
+        await self.bump(project_id)
+        for key in [k for k in self._entries if k[0] == project_id]:
+            del self._entries[key]
+
+    # ---------- validators ----------
+
+    def bucket(self, now: Optional[float] = None) -> int:
+        return int((now or time.time()) // self.bucket_seconds)
+
+    async def validators(self, project_id: str, params: Tuple,
+                         sealed_at: Optional[datetime] = None) -> Tuple[Tuple, str, datetime]:
+        """
+        Cache key, ETag and Last-Modified for the current state of a project.
+
+        `sealed_at`: the params select a closed time range that stopped
+        changing at that time, so the validators do not depend on new events.
+        """
+        if sealed_at is not None:
+            digest = hashlib.sha1(f"sealed:{project_id}:{params}".encode()).hexdigest()[:20]
+            return (project_id, params, None), f'"{digest}"', sealed_at.replace(microsecond=0)
+        bucket = self.bucket()
+        version, modified = await self.state.mget([f'cache:version:{project_id}', f'cache:modified:{project_id}'])
+        key = (project_id, params, bucket)
+        digest = hashlib.sha1(f"{self.epoch}:{project_id}:{params}:{bucket}:{version or 0}".encode()).hexdigest()[:20]
+        # Results drift as the window slides, so data is "modified" at least at every bucket start
+        modified = max(float(modified or 0), bucket * self.bucket_seconds)
+        last_modified = datetime.fromtimestamp(int(modified), tz=timezone.utc)
+        return key, f'"{digest}"', last_modified
+
+    def is_not_modified(self, headers, etag: str, last_modified: datetime) -> bool:
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            matched = etag in tags or f"W/{etag}" in tags or '*' in tags
+        else:
+            matched = False
+            if_modified_since = headers.get('if-modified-since')
+            if if_modified_since:
+                try:
+                    matched = last_modified <= parsedate_to_datetime(if_modified_since)
+                except (TypeError, ValueError):
+                    matched = False
+        if matched:
+            self.not_modified += 1
+        return matched
+
+    @staticmethod
+    def headers(etag: str, last_modified: datetime, immutable: bool = False) -> Dict[str, str]:
+        return {
+            "ETag": etag,
+            "Last-Modified": format_datetime(last_modified, usegmt=True),
+            # Let browsers keep the body but always revalidate, unless it can never change
+            "Cache-Control": "private, max-age=31536000, immutable" if immutable else "private, no-cache",
+        }
+
+    # ---------- entries ----------
+
+    async def get(self, key: Tuple, etag: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == etag:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if self.max_entries and self.state.shared:
+            # Another worker may already have computed it
+            raw = await self.state.get(f'cache:payload:{etag}')
+            if raw is not None:
+                payload = json.loads(raw)
+                self._store(key, etag, payload)
+                self.hits += 1
+                return payload
+        self.misses += 1
+        return None
+
+    async def set(self, key: Tuple, etag: str, payload: Any):
+        if not self.max_entries:
+            return
+        self._store(key, etag, payload)
+        if self.state.shared:
+            await self.state.set(f'cache:payload:{etag}', json.dumps(payload), ttl=2 * self.bucket_seconds)
+
+    def _store(self, key: Tuple, etag: str, payload: Any):
+        self._entries[key] = (etag, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+class BucketCache:
+    """
+    Count tables of completed calendar buckets (see timebuckets.py), keyed by
+    (project, bucket start, bucket end). They never change, so entries only
+    leave by LRU eviction, project deletion or, in the shared state, `ttl`.
+    """
+
+    def __init__(self, state, max_entries: int = 4096, ttl: float = 7 * 86400):
+        self.state = state
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(project_id: str, start: datetime, end: datetime) -> Tuple[str, str, str]:
+        return (project_id, start.isoformat(), end.isoformat())
+
+    async def get(self, project_id: str, start: datetime, end: datetime) -> Optional[Dict[str, Any]]:
+        key = self._key(project_id, start, end)
+        counts = self._entries.get(key)
+        if counts is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return counts
+        if self.max_entries and self.state.shared:
+            raw = await self.state.get(f"buckets:{':'.join(key)}")
+            if raw is not None:
+                counts = json.loads(raw)
+                counts['sessions'] = set(counts['sessions'])
+                self._store(key, counts)
+                self.hits += 1
+                return counts
+        self.misses += 1
+        return None
+
+    async def set(self, project_id: str, start: datetime, end: datetime, counts: Dict[str, Any]):
+        if not self.max_entries:
+            return
+        key = self._key(project_id, start, end)
+        self._store(key, counts)
+        if self.state.shared:
+            await self.state.set(f"buckets:{':'.join(key)}", json.dumps({**counts, 'sessions': list(counts['sessions'])}),
+                                 ttl=self.ttl)
+
+    def _store(self, key: Tuple[str, str, str], counts: Dict[str, Any]):
+        self._entries[key] = counts
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def drop_project(self, project_id: str):
+        # Shared entries are keyed by project id, which is never reused
+        for key in [k for k in self._entries if k[0] == project_id]:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class ProjectDirectory:
+    """
+    Tenant -> projects map cached per worker, in front of the ProjectStore.
+
+    Each tenant's list is validated against a per-tenant version in the
+    `SharedState`, which `invalidate` bumps when a project is created or
+    deleted by any worker, so ownership checks and project lists cost one
+    version lookup instead of a database query. The cached list holds at
+    most `max_projects` projects (the first ones by id); `pages` walks all
+    of them for the rare tenant with more.
+
+    With several worker processes and a state that is not shared, another
+    worker's `invalidate` is never seen, so every call goes to the store.
+    """
+
+    def __init__(self, store, state, max_tenants: int = 10000, max_projects: int = 1000, workers: int = 1):
+        self.store = store
+        self.state = state
+        self.max_tenants = max_tenants
+        self.max_projects = max_projects
+        self.enabled = state.shared or workers <= 1
+        self._tenants: "OrderedDict[str, Tuple[Optional[str], List[Dict[str, Any]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def list(self, tenant_id: str) -> List[Dict[str, Any]]:
+        if not self.enabled:
+            self.misses += 1
+            return await self.store.list_for_tenant(tenant_id, limit=self.max_projects)
+        version = await self.state.get(f'tenant:version:{tenant_id}')
+        entry = self._tenants.get(tenant_id)
+        if entry is not None and entry[0] == version:
+            self._tenants.move_to_end(tenant_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        projects = await self.store.list_for_tenant(tenant_id, limit=self.max_projects)
+        self._tenants[tenant_id] = (version, projects)
+        self._tenants.move_to_end(tenant_id)
+        while len(self._tenants) > self.max_tenants:
+            self._tenants.popitem(last=False)
+        return projects
+
+    def _truncated(self, projects: List[Dict[str, Any]]) -> bool:
+        return len(projects) >= self.max_projects
+
+    async def pages(self, tenant_id: str) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Every project of the tenant, `max_projects` at a time: the cached list, then pages from the store."""
+        page = await self.list(tenant_id)
+        while page:
+            yield page
+            if not self._truncated(page):
+                return
+            page = await self.store.list_for_tenant(tenant_id, limit=self.max_projects, after=page[-1]['id'])
+
+    async def find(self, project_id: str, tenant_id: str) -> Optional[Dict[str, Any]]:
+        """The tenant's project with this id, or None (ownership check)."""
+        if not self.enabled:
+            self.misses += 1
+            return await self.store.find(project_id, tenant_id)
+        projects = await self.list(tenant_id)
+        for project in projects:
+            if project['id'] == project_id:
+                return project
+        if self._truncated(projects):
+            return await self.store.find(project_id, tenant_id)
+        return None
+
+    async def invalidate(self, tenant_id: str):
+        await self.state.incr(f'tenant:version:{tenant_id}')
+        self._tenants.pop(tenant_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "tenants": len(self._tenants), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,359 @@
+"""
+Retention cohorts over per-day visitor bitmaps.
+
+Each visitor (`ip_hash`, or the session id when there is no IP hash) gets a
+small integer id from the project's 'visitor' dictionary, and every
+completed day is sealed once into a compressed bitmap of the visitor ids
+seen that day (`BitmapStore`, bucket 'YYYY-MM-DD'). Days that may still
+receive events (today, within `seal_delay`, or while events acked before
+the day ended are still waiting to be stored) are built from the event
+store at query time and not stored.
+
+A retention matrix is then only bitmap algebra: the cohort of period N is
+the visitors active in N minus everyone seen before, and its retention in
+period N+k is the size of its intersection with the visitors active in
+N+k. Days are UTC.
+
+`Bitmap` is a roaring-style set of 32-bit ints: values are split by their
+high 16 bits into containers holding a sorted array of the low bits while
+there are at most 4096 of them, and a 65536-bit bitset beyond that.
+"""
+import asyncio
+import logging
+import struct
+import sys
+from array import array
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from compact import DictionaryCache
+
+logger = logging.getLogger(__name__)
+
+ARRAY_MAX = 4096
+BITSET_BYTES = 8192
+MAGIC = b'RBM1'
+_HEADER = struct.Struct('<4sI')
+_CONTAINER = struct.Struct('<HBI')
+
+# Dictionary kind mapping visitor keys to ids, also the bitmap kind of the sealed days
+VISITOR_KIND = 'visitor'
+PERIODS = ('day', 'week')
+
+Container = Union[array, int]
+
+
+def _from_lows(lows: Iterable[int]) -> int:
+    bits = bytearray(BITSET_BYTES)
+    for low in lows:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _to_lows(bitset: int) -> array:
+    out = array('H')
+    for i, byte in enumerate(bitset.to_bytes(BITSET_BYTES, 'little')):
+        if byte:
+            base = i << 3
+            out.extend(base + j for j in range(8) if byte >> j & 1)
+    return out
+
+
+def _container(lows: set) -> Optional[Container]:
+    if not lows:
+        return None
+    if len(lows) <= ARRAY_MAX:
+        return array('H', sorted(lows))
+    return _from_lows(lows)
+
+
+def _normalize(bitset: int) -> Optional[Container]:
+    count = bitset.bit_count()
+    if count == 0:
+        return None
+    return _to_lows(bitset) if count <= ARRAY_MAX else bitset
+
+
+def _members(values: array, bitset: int) -> List[bool]:
+    data = bitset.to_bytes(BITSET_BYTES, 'little')
+    return [bool(data[v >> 3] >> (v & 7) & 1) for v in values]
+
+
+def _and(a: Container, b: Container) -> Optional[Container]:
+    if isinstance(a, int) and isinstance(b, int):
+        return _normalize(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        kept = array('H', (v for v, member in zip(a, _members(a, b)) if member))
+    else:
+        kept = array('H', sorted(set(a).intersection(b)))
+    return kept or None
+
+
+def _and_count(a: Container, b: Container) -> int:
+    if isinstance(a, int) and isinstance(b, int):
+        return (a & b).bit_count()
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return sum(_members(a, b))
+    return len(set(a).intersection(b))
+
+
+def _or(a: Container, b: Container) -> Container:
+    if isinstance(a, int) or isinstance(b, int):
+        return (a if isinstance(a, int) else _from_lows(a)) | (b if isinstance(b, int) else _from_lows(b))
+    return _container(set(a).union(b))
+
+
+def _sub(a: Container, b: Container) -> Optional[Container]:
+    if isinstance(a, int):
+        return _normalize(a & ~(b if isinstance(b, int) else _from_lows(b)))
+    if isinstance(b, int):
+        kept = array('H', (v for v, member in zip(a, _members(a, b)) if not member))
+    else:
+        other = set(b)
+        kept = array('H', (v for v in a if v not in other))
+    return kept or None
+
+
+class Bitmap:
+    __slots__ = ('containers',)
+
+    def __init__(self, values: Iterable[int] = ()):
+        self.containers: Dict[int, Container] = {}
+        groups: Dict[int, set] = {}
+        for value in values:
+            groups.setdefault(value >> 16, set()).add(value & 0xFFFF)
+        for high, lows in groups.items():
+            self.containers[high] = _container(lows)
+
+    @classmethod
+    def _of(cls, containers: Dict[int, Optional[Container]]) -> 'Bitmap':
+        bitmap = cls()
+        bitmap.containers = {high: c for high, c in containers.items() if c is not None}
+        return bitmap
+
+    def __len__(self) -> int:
+        return sum(c.bit_count() if isinstance(c, int) else len(c) for c in self.containers.values())
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            c = self.containers[high]
+            base = high << 16
+            for low in (_to_lows(c) if isinstance(c, int) else c):
+                yield base + low
+
+    def __contains__(self, value: int) -> bool:
+        c = self.containers.get(value >> 16)
+        if c is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(c, int):
+            return bool(c >> low & 1)
+        return low in c
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Bitmap) and self.containers == other.containers
+
+    def __and__(self, other: 'Bitmap') -> 'Bitmap':
+        return Bitmap._of({high: _and(c, other.containers[high])
+                           for high, c in self.containers.items() if high in other.containers})
+
+    def __or__(self, other: 'Bitmap') -> 'Bitmap':
+        merged = dict(self.containers)
+        for high, c in other.containers.items():
+            merged[high] = _or(merged[high], c) if high in merged else c
+        return Bitmap._of(merged)
+
+    def __sub__(self, other: 'Bitmap') -> 'Bitmap':
+        return Bitmap._of({high: _sub(c, other.containers[high]) if high in other.containers else c
+                           for high, c in self.containers.items()})
+
+    def intersection_count(self, other: 'Bitmap') -> int:
+        """len(self & other) without building the intersection."""
+        return sum(_and_count(c, other.containers[high])
+                   for high, c in self.containers.items() if high in other.containers)
+
+    # ---------- serialization ----------
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(MAGIC, len(self.containers))]
+        for high in sorted(self.containers):
+            c = self.containers[high]
+            if isinstance(c, int):
+                parts.append(_CONTAINER.pack(high, 1, BITSET_BYTES))
+                parts.append(c.to_bytes(BITSET_BYTES, 'little'))
+            else:
+                if sys.byteorder == 'big':
+                    c = array('H', c)
+                    c.byteswap()
+                parts.append(_CONTAINER.pack(high, 0, len(c)))
+                parts.append(c.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Bitmap':
+        magic, count = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a serialized bitmap")
+        offset = _HEADER.size
+        containers: Dict[int, Container] = {}
+        for _ in range(count):
+            high, kind, size = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            if kind == 1:
+                containers[high] = int.from_bytes(data[offset:offset + size], 'little')
+                offset += size
+            else:
+                c = array('H')
+                c.frombytes(data[offset:offset + 2 * size])
+                if sys.byteorder == 'big':
+                    c.byteswap()
+                containers[high] = c
+                offset += 2 * size
+        return cls._of(containers)
+
+
+def visitor_key(event: Dict[str, Any]) -> Optional[str]:
+    if event.get('ip_hash'):
+        return event['ip_hash']
+    if event.get('session_id'):
+        return f"s:{event['session_id']}"
+    return None
+
+
+class CohortEngine:
+    def __init__(self, repo, dictionaries: DictionaryCache, retention_days: int = 180,
+                 seal_delay: timedelta = timedelta(hours=1),
+                 pending_since: Optional[Callable[[], Optional[datetime]]] = None):
+        self.repo = repo
+        self.dictionaries = dictionaries
+        self.retention_days = retention_days
+        self.seal_delay = seal_delay
+        # Timestamp of the oldest acked event not stored yet (None when nothing is pending)
+        self.pending_since = pending_since
+
+    def seal_boundary(self, now: Optional[datetime] = None) -> date:
+        """First day that may still receive events (everything before it can be sealed)."""
+        settled = (now or datetime.now(timezone.utc)) - self.seal_delay
+        pending = self.pending_since() if self.pending_since is not None else None
+        if pending is not None:
+            settled = min(settled, pending)
+        return settled.date()
+
+    # ---------- sealing ----------
+
+    async def build_day(self, project_id: str, day: date) -> Bitmap:
+        start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        events = await self.repo.events.find_range(project_id, start, start + timedelta(days=1), limit=None)
+        keys = {key for key in map(visitor_key, events) if key}
+        if not keys:
+            return Bitmap()
+        ids = await self.dictionaries.ids(project_id, VISITOR_KIND, keys)
+        return Bitmap(ids[key] for key in keys)
+
+    async def seal_project(self, project_id: str, now: Optional[datetime] = None) -> int:
+        boundary = self.seal_boundary(now)
+        day = boundary - timedelta(days=self.retention_days)
+        sealed_days = set(await self.repo.bitmaps.list_buckets(project_id, VISITOR_KIND, day.isoformat(),
+                                                               boundary.isoformat()))
+        sealed = 0
+        while day < boundary:
+            if day.isoformat() not in sealed_days:
+                bitmap = await self.build_day(project_id, day)
+                await self.repo.bitmaps.put(project_id, VISITOR_KIND, day.isoformat(), bitmap.to_bytes())
+                sealed += 1
+            day += timedelta(days=1)
+        if sealed:
+            logger.info(f"[COHORTS] Sealed {sealed} day(s) of visitor bitmaps for {project_id}")
+        return sealed
+
+    async def seal_all(self) -> int:
+        sealed = 0
+        for project_id in await self.repo.projects.list_ids():
+            sealed += await self.seal_project(project_id)
+        return sealed
+
+    async def run_periodically(self, interval_seconds: float):
+        while True:
+            try:
+                await self.seal_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[COHORTS] Sealing failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    # ---------- queries ----------
+
+    async def day_bitmaps(self, project_id: str, first: date, end: date,
+                          now: Optional[datetime] = None) -> Dict[date, Bitmap]:
+        """Visitor bitmaps for first <= day < end; missing completed days are sealed on the way."""
+        boundary = self.seal_boundary(now)
+        days = {date.fromisoformat(row['bucket']): Bitmap.from_bytes(row['data'])
+                for row in await self.repo.bitmaps.find_range(project_id, VISITOR_KIND, first.isoformat(),
+                                                              end.isoformat())}
+        day = first
+        while day < end:
+            if day not in days:
+                days[day] = await self.build_day(project_id, day)
+                if day < boundary:
+                    await self.repo.bitmaps.put(project_id, VISITOR_KIND, day.isoformat(), days[day].to_bytes())
+            day += timedelta(days=1)
+        return days
+
+    async def retention(self, project_id: str, period: str = 'week', periods: int = 8,
+                        now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Cohort retention matrix for the last `periods` days or ISO weeks
+        (including the current, incomplete one).
+        """
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        now = now or datetime.now(timezone.utc)
+        today = now.date()
+        step = 7 if period == 'week' else 1
+        first = today - timedelta(days=today.weekday() if period == 'week' else 0) - timedelta(days=step * (periods - 1))
+
+        days = await self.day_bitmaps(project_id, first, today + timedelta(days=1), now)
+        active = []
+        for p in range(periods):
+            bitmap = Bitmap()
+            for d in range(step):
+                day_bitmap = days.get(first + timedelta(days=p * step + d))
+                if day_bitmap is not None:
+                    bitmap = bitmap | day_bitmap
+            active.append(bitmap)
+
+        # Visitors seen before the first cohort (sealed history only) are not new in it
+        seen = Bitmap()
+        for row in await self.repo.bitmaps.find_range(project_id, VISITOR_KIND, '', first.isoformat()):
+            seen = seen | Bitmap.from_bytes(row['data'])
+
+        cohorts = []
+        for p in range(periods):
+            cohort = active[p] - seen
+            seen = seen | active[p]
+            size = len(cohort)
+            retained = [size] + [cohort.intersection_count(active[q]) for q in range(p + 1, periods)]
+            cohorts.append({
+                "cohort": (first + timedelta(days=p * step)).isoformat(),
+                "visitors": size,
+                "retained": retained,
+                "retention": [round(r / size * 100, 1) if size else 0 for r in retained],
+            })
+
+        average = []
+        for k in range(periods):
+            rows = [c for c in cohorts if len(c["retained"]) > k]
+            total = sum(c["visitors"] for c in rows)
+            average.append(round(sum(c["retained"][k] for c in rows) / total * 100, 1) if total else 0)
+
+        return {
+            "period": period,
+            "periods": periods,
+            "cohorts": cohorts,
+            "average_retention": average,
+        }
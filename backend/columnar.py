@@ -0,0 +1,92 @@
+"""
+Vectorized (NumPy) aggregation path for the overview count tables.
+
+Events are loaded once into dictionary-encoded integer columns (event type,
+url, referrer, user agent, country, continent, day, session). Every
+breakdown is then a `np.bincount` over those codes, and user agents are
+classified once per distinct string instead of once per event. The output
+is identical to `aggregation.aggregate_events`.
+"""
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from aggregation import classify_browser, classify_device, empty_counts
+
+ENCODED_COLUMNS = ('event_type', 'page_url', 'referrer', 'user_agent', 'country', 'continent', 'date', 'session_id')
+
+
+class EventColumns:
+    """Dictionary-encoded columns of a list of stored event documents."""
+
+    def __init__(self, events: Iterable[Dict[str, Any]]):
+        events = events if isinstance(events, list) else list(events)
+        self.size = len(events)
+        # code -> value lookups (first-seen order) and per-event code arrays
+        self.values: Dict[str, List[Any]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        for name in ENCODED_COLUMNS:
+            if name == 'date':
+                column = [ts[:10] for ts in map(itemgetter('timestamp'), events)]
+            else:
+                try:
+                    column = list(map(itemgetter(name), events))
+                except KeyError:
+                    # older documents may lack optional fields
+                    column = [e.get(name) for e in events]
+            self._encode(name, column)
+
+    def _encode(self, name: str, column: List[Any]):
+        values = list(dict.fromkeys(column))
+        lookup = {v: i for i, v in enumerate(values)}
+        self.values[name] = values
+        self.codes[name] = np.fromiter(map(lookup.__getitem__, column), dtype=np.int32, count=len(column))
+
+    def code_of(self, column: str, value: Any) -> int:
+        try:
+            return self.values[column].index(value)
+        except ValueError:
+            return -1
+
+    def bincount(self, column: str, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        codes = self.codes[column] if mask is None else self.codes[column][mask]
+        return np.bincount(codes, minlength=len(self.values[column]))
+
+
+def _fold(values: List[Any], counts: np.ndarray, label: Callable[[Any], Optional[str]]) -> Dict[str, int]:
+    """Turn per-code counts into a {label: count} table, dropping codes labelled None."""
+    out: Dict[str, int] = {}
+    for code in np.flatnonzero(counts):
+        key = label(values[code])
+        if key is not None:
+            out[key] = out.get(key, 0) + int(counts[code])
+    return out
+
+
+def aggregate_columnar(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Vectorized equivalent of `aggregation.aggregate_events`."""
+    cols = EventColumns(events)
+    counts = empty_counts()
+    counts['total_events'] = cols.size
+    counts['sessions'] = set(cols.values['session_id'])
+    if cols.size == 0:
+        return counts
+
+    is_pageview = cols.codes['event_type'] == cols.code_of('event_type', 'pageview')
+    counts['total_pageviews'] = int(is_pageview.sum())
+
+    counts['daily'] = _fold(cols.values['date'], cols.bincount('date'), lambda v: v)
+    counts['browsers'] = _fold(cols.values['user_agent'], cols.bincount('user_agent'),
+                               lambda ua: classify_browser(ua) if ua else None)
+
+    counts['page_counts'] = _fold(cols.values['page_url'], cols.bincount('page_url', is_pageview),
+                                  lambda url: url or None)
+    counts['referrers'] = _fold(cols.values['referrer'], cols.bincount('referrer', is_pageview),
+                                lambda ref: ref or 'Direct')
+    counts['continents'] = _fold(cols.values['continent'], cols.bincount('continent', is_pageview),
+                                 lambda cont: cont or None)
+    counts['devices'] = _fold(cols.values['user_agent'], cols.bincount('user_agent', is_pageview), classify_device)
+    counts['countries'] = _fold(cols.values['country'], cols.bincount('country', is_pageview),
+                                lambda c: c or 'Unknown')
+    return counts
@@ -0,0 +1,254 @@
+"""
+Compact event encoding.
+
+Stored event documents repeat long field names, a 36-character UUID and
+full user-agent / URL strings on every event. With EVENTS_ENCODING=compact
+the event store keeps them as:
+
+  - short keys ('s' for session_id, 'u' for page_url, ...); fields that
+    are None are left out
+  - the event id as 22 characters of base64url instead of a UUID string
+  - user agents, page URLs and referrers as small integer ids into
+    per-project dictionaries (`DictionaryStore`); the page dictionary is the
+    one that assigns `page_id`, so it is not stored a second time
+
+`project_id`, `timestamp` and `is_bot` keep their names: indexes, the
+time-series layout and the bot filter depend on them. `CompactEventStore`
+wraps any event store and translates in both directions, so callers keep
+reading and writing the documents they always did; documents written before
+the switch are returned unchanged.
+"""
+import base64
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from storage import DictionaryStore, EventStore
+
+# Long field name -> stored key
+SHORT_KEYS = {
+    'id': 'i',
+    'session_id': 's',
+    'event_type': 'e',
+    'event_name': 'n',
+    'page_url': 'u',
+    'page_title': 'pt',
+    'referrer': 'r',
+    'user_agent': 'a',
+    'country': 'c',
+    'continent': 'ct',
+    'ip_hash': 'h',
+    'device_type': 'd',
+    'properties': 'pr',
+    'bot_reason': 'br',
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+# Fields every decoded document has (None when absent), like documents built from the Event model
+EVENT_FIELDS = [field for field in SHORT_KEYS if field != 'bot_reason'] + ['page_id']
+
+# Fields stored as dictionary ids, and the dictionary each one uses
+INTERNED_FIELDS = {'page_url': 'page', 'referrer': 'referrer', 'user_agent': 'user_agent'}
+
+# Stored key for ids that are not UUIDs
+RAW_ID_KEY = 'I'
+
+
+def encode_id(value: str) -> Tuple[str, str]:
+    try:
+        u = uuid.UUID(value)
+    except (ValueError, AttributeError, TypeError):
+        return RAW_ID_KEY, value
+    if str(u) != value:
+        return RAW_ID_KEY, value
+    return 'i', base64.urlsafe_b64encode(u.bytes).decode()[:22]
+
+
+def decode_id(value: str) -> str:
+    # Same string as str(uuid.UUID(bytes=...)), several times faster
+    h = base64.urlsafe_b64decode(value + '==').hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+class DictionaryCache:
+    """In-process cache in front of a DictionaryStore (both directions, bounded in size).
+
+    A full dictionary is replaced, not cleared in place, and lookups return a new
+    mapping of just the values asked for: a caller holding the result across an
+    await never sees entries vanish under it.
+    """
+
+    def __init__(self, store: DictionaryStore, max_dictionaries: int = 10000, max_values: int = 100000):
+        self.store = store
+        self.max_dictionaries = max_dictionaries
+        self.max_values = max_values
+        self._dicts: "OrderedDict[Tuple[str, str], Tuple[Dict[str, int], Dict[int, str]]]" = OrderedDict()
+
+    def _get(self, project_id: str, kind: str):
+        key = (project_id, kind)
+        entry = self._dicts.get(key)
+        if entry is None or len(entry[0]) > self.max_values:
+            entry = self._dicts[key] = ({}, {})
+            if len(self._dicts) > self.max_dictionaries:
+                self._dicts.popitem(last=False)
+        self._dicts.move_to_end(key)
+        return entry
+
+    async def ids(self, project_id: str, kind: str, values) -> Dict[str, int]:
+        to_id, to_value = self._get(project_id, kind)
+        missing = [v for v in values if v not in to_id]
+        if missing:
+            for value, vid in (await self.store.intern(project_id, kind, missing)).items():
+                to_id[value] = vid
+                to_value[vid] = value
+        return {v: to_id[v] for v in values}
+
+    async def values(self, project_id: str, kind: str, ids) -> Dict[int, str]:
+        to_id, to_value = self._get(project_id, kind)
+        missing = [i for i in ids if i not in to_value]
+        if missing:
+            for vid, value in (await self.store.lookup(project_id, kind, missing)).items():
+                to_id[value] = vid
+                to_value[vid] = value
+        return {i: to_value[i] for i in ids if i in to_value}
+
+    def drop_project(self, project_id: str):
+        for key in [k for k in self._dicts if k[0] == project_id]:
+            del self._dicts[key]
+
+
+class CompactEventStore(EventStore):
+    def __init__(self, inner: EventStore, dictionaries: DictionaryStore):
+        self.inner = inner
+        # Encoded ids are stored under 'i' (UUIDs) or RAW_ID_KEY; documents written before the switch under 'id'
+        self.inner.id_keys = ('id', 'i', RAW_ID_KEY)
+        self.cache = DictionaryCache(dictionaries)
+        self.mode = inner.mode
+        self.encoding = 'compact'
+
+    @property
+    def collection_name(self):
+        return self.inner.collection_name
+
+    async def ensure_schema(self):
+        await self.inner.ensure_schema()
+
+    async def storage_stats(self):
+        return {**await self.inner.storage_stats(), "encoding": self.encoding}
+
+    async def delete_project(self, project_id):
+        await self.inner.delete_project(project_id)
+        self.cache.drop_project(project_id)
+
+    # ---------- encoding ----------
+
+    async def encode(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # One dictionary round trip per (project, field) for the whole batch
+        wanted: Dict[Tuple[str, str], set] = {}
+        for doc in docs:
+            for field in INTERNED_FIELDS:
+                value = doc.get(field)
+                if value is not None:
+                    wanted.setdefault((doc['project_id'], field), set()).add(value)
+        ids = {key: await self.cache.ids(key[0], INTERNED_FIELDS[key[1]], values)
+               for key, values in wanted.items()}
+
+        out = []
+        for doc in docs:
+            project_id = doc['project_id']
+            enc: Dict[str, Any] = {}
+            for field, value in doc.items():
+                if value is None or field == 'page_id':
+                    continue
+                if field == 'id':
+                    key, value = encode_id(value)
+                    enc[key] = value
+                elif field in INTERNED_FIELDS:
+                    enc[SHORT_KEYS[field]] = ids[(project_id, field)][value]
+                else:
+                    enc[SHORT_KEYS.get(field, field)] = value
+            out.append(enc)
+        return out
+
+    async def decode(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        wanted: Dict[Tuple[str, str], set] = {}
+        for doc in docs:
+            for field in INTERNED_FIELDS:
+                vid = doc.get(SHORT_KEYS[field])
+                if vid is not None:
+                    wanted.setdefault((doc['project_id'], field), set()).add(vid)
+        values = {key: await self.cache.values(key[0], INTERNED_FIELDS[key[1]], ids)
+                  for key, ids in wanted.items()}
+
+        template = dict.fromkeys(EVENT_FIELDS)
+        long_key = LONG_KEYS.get
+        interned = [(field, SHORT_KEYS[field]) for field in INTERNED_FIELDS]
+        out = []
+        for doc in docs:
+            if 'session_id' in doc:
+                # Written before the store switched to the compact encoding
+                out.append(doc)
+                continue
+            project_id = doc['project_id']
+            dec = template.copy()
+            for key, value in doc.items():
+                dec[long_key(key, key)] = value
+            if dec['id'] is not None:
+                dec['id'] = decode_id(dec['id'])
+            elif RAW_ID_KEY in dec:
+                dec['id'] = dec.pop(RAW_ID_KEY)
+            for field, key in interned:
+                vid = doc.get(key)
+                if vid is not None:
+                    dec[field] = values[(project_id, field)].get(vid)
+            dec['page_id'] = doc.get('u')
+            out.append(dec)
+        return out
+
+    # ---------- EventStore ----------
+
+    async def insert(self, doc):
+        await self.insert_many([doc])
+
+    async def insert_many(self, docs):
+        if not docs:
+            return []
+        encoded = await self.encode(docs)
+        position = {id(enc): i for i, enc in enumerate(encoded)}
+        return [docs[position[id(enc)]] for enc in await self.inner.insert_many(encoded)]
+
+    async def find_range(self, project_id, start, end=None, limit=10000, include_bots=False):
+        return await self.decode(await self.inner.find_range(project_id, start, end, limit=limit,
+                                                             include_bots=include_bots))
+
+    async def find_range_many(self, project_ids, start, end=None, limit=None):
+        return await self.decode(await self.inner.find_range_many(project_ids, start, end, limit=limit))
+
+    async def scan_sessions(self, project_id, start, end=None, batch_size=5000, session_field='session_id'):
+        async for batch in self.inner.scan_sessions(project_id, start, end, batch_size,
+                                                    session_field=SHORT_KEYS.get(session_field, session_field)):
+            yield await self.decode(batch)
+
+    def _path(self, path: str) -> str:
+        head, _, rest = path.partition('.')
+        head = SHORT_KEYS.get(head, head)
+        return f"{head}.{rest}" if rest else head
+
+    async def aggregate_properties(self, project_id, start, end=None, group_by=None, sum_of=None, where=None):
+        # Property values are stored as they are; only the field names differ
+        return await self.inner.aggregate_properties(
+            project_id, start, end,
+            group_by=self._path(group_by) if group_by else None,
+            sum_of=self._path(sum_of) if sum_of else None,
+            where={self._path(field): value for field, value in (where or {}).items()},
+        )
+
+    async def ensure_field_index(self, path):
+        await self.inner.ensure_field_index(self._path(path))
+
+    async def list_field_indexes(self):
+        out = []
+        for path in await self.inner.list_field_indexes():
+            head, _, rest = path.partition('.')
+            head = LONG_KEYS.get(head, head)
+            out.append(f"{head}.{rest}" if rest else head)
+        return out
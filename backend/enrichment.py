@@ -0,0 +1,309 @@
+"""
+Event enrichment stage.
+
+`track_event` only validates the request and builds a raw event; everything
+CPU-bound (IP hashing, GeoIP / IP range lookup, user-agent
+classification, page URL canonicalization) happens in `enrich_batch`, which
+works on a whole batch at once and resolves each distinct IP / user agent /
+URL only once per batch.
+
+`EnrichmentPipeline` runs that stage off the event loop: raw events are
+queued, grouped into batches and enriched in a thread or process pool
+before a single bulk write, while the HTTP request is acknowledged as soon
+as the event is queued.
+
+Modes (ENRICHMENT_MODE):
+  - inline:  enrich and write inside the request (original behaviour)
+  - thread:  enrich batches in a ThreadPoolExecutor
+  - process: enrich batches in a ProcessPoolExecutor (one GeoIP reader per process)
+
+Countries come from the GeoLite2 database when one is installed, else from
+the offline IP range index (`iprange`); addresses neither knows are 'XX'
+with no continent rather than a guess.
+"""
+import asyncio
+import hashlib
+import logging
+from contextlib import nullcontext
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aggregation import classify_device
+from iprange import IpRangeIndex, continent_of
+from storage import to_datetime
+from urls import UrlCanonicalizer
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_MODES = ('inline', 'thread', 'process')
+
+# Per-process GeoIP reader, IP range index and URL canonicalizer (set by the server, or by init_worker in pool processes)
+_geoip_reader = None
+_ip_index: Optional[IpRangeIndex] = None
+_canonicalize_url: Optional[UrlCanonicalizer] = None
+
+
+def set_geoip_reader(reader):
+    global _geoip_reader
+    _geoip_reader = reader
+
+
+def set_ip_index(index: Optional[IpRangeIndex]):
+    global _ip_index
+    _ip_index = index
+
+
+def set_url_canonicalizer(canonicalizer: Optional[UrlCanonicalizer]):
+    global _canonicalize_url
+    _canonicalize_url = canonicalizer
+
+
+def open_geoip_reader(path: str):
+    # Imported here rather than at module load: geoip2 pulls in aiohttp and requests
+    try:
+        import geoip2.database
+    except Exception:
+        logger.warning("⚠ geoip2 not imported or available")
+        return None
+    try:
+        reader = geoip2.database.Reader(path)
+        logger.info(f"✓ GeoIP reader initialized. DB: {path}")
+        return reader
+    except Exception as e:
+        logger.error(f"✗ GeoIP init failed. DB: {path}. Error: {e}")
+        return None
+
+
+def open_ip_index(path: str) -> Optional[IpRangeIndex]:
+    try:
+        index = IpRangeIndex.open(path)
+        logger.info(f"✓ IP range index loaded. {index.stats()}")
+        return index
+    except FileNotFoundError:
+        logger.warning(f"⚠ No IP range index at {path} (build it with build_ip_ranges.py)")
+    except Exception as e:
+        logger.error(f"✗ IP range index failed to load. File: {path}. Error: {e}")
+    return None
+
+
+def init_worker(geoip_path: Optional[str], canonicalizer: Optional[UrlCanonicalizer] = None,
+                ip_ranges_path: Optional[str] = None):
+    """ProcessPoolExecutor initializer: each worker process opens its own reader (the index mapping is shared)."""
+    set_geoip_reader(open_geoip_reader(geoip_path) if geoip_path else None)
+    set_ip_index(open_ip_index(ip_ranges_path) if ip_ranges_path else None)
+    set_url_canonicalizer(canonicalizer)
+
+
+def hash_ip(client_ip: str) -> Optional[str]:
+    try:
+        return hashlib.sha256(client_ip.encode()).hexdigest()[:16]
+    except Exception:
+        return None
+
+
+def locate_ip(client_ip: Optional[str]):
+    """(country ISO, continent name) for an IP: GeoIP, then the IP range index; ('XX', None) when unknown."""
+    if not client_ip:
+        return 'XX', None
+
+    country_iso = None
+    continent_name = None
+    if _geoip_reader is not None:
+        try:
+            rec = _geoip_reader.country(client_ip)
+            if rec and rec.country:
+                country_iso = rec.country.iso_code
+            if rec and rec.continent:
+                continent_name = rec.continent.name
+        except Exception as e:
+            logger.debug(f"[ENRICH] GeoIP lookup failed for {client_ip}: {e}")
+
+    if not country_iso and _ip_index is not None:
+        country_iso = _ip_index.country(client_ip)
+    if country_iso and not continent_name:
+        continent_name = continent_of(country_iso)
+    return country_iso or 'XX', continent_name
+
+
+def enrich_batch(raw_events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Turn raw events into stored documents.
+
+    Raw events carry `_client_ip` and `_anonymize_ip`; both are stripped and
+    replaced by `ip_hash`, `country`, `continent` and `device_type`. Page URLs
+    are canonicalized when a canonicalizer is configured.
+    """
+    locations: Dict[Optional[str], Any] = {}
+    hashes: Dict[str, Optional[str]] = {}
+    devices: Dict[Optional[str], str] = {}
+    urls: Dict[str, str] = {}
+    docs = []
+    for raw in raw_events:
+        doc = dict(raw)
+        url = doc.get('page_url')
+        if url and _canonicalize_url is not None:
+            canonical = urls.get(url)
+            if canonical is None:
+                canonical = urls[url] = _canonicalize_url(url)
+            doc['page_url'] = canonical
+
+        client_ip = doc.pop('_client_ip', None)
+        anonymize_ip = doc.pop('_anonymize_ip', True)
+
+        location = locations.get(client_ip)
+        if location is None:
+            location = locations[client_ip] = locate_ip(client_ip)
+        doc['country'], doc['continent'] = location
+
+        # Anonymize IP if enabled
+        if client_ip and anonymize_ip:
+            ip_hash = hashes.get(client_ip)
+            if ip_hash is None:
+                ip_hash = hashes[client_ip] = hash_ip(client_ip)
+            doc['ip_hash'] = ip_hash
+
+        ua = doc.get('user_agent')
+        device = devices.get(ua)
+        if device is None:
+            device = devices[ua] = classify_device(ua)
+        doc['device_type'] = device
+        docs.append(doc)
+    return docs
+
+
+class EnrichmentPipeline:
+    """Batches raw events, enriches them in an executor and hands them to `sink` in bulk."""
+
+    def __init__(self, mode: str, sink: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+                 batch_size: int = 500, max_delay: float = 0.05, max_queue: int = 100000,
+                 workers: Optional[int] = None, geoip_path: Optional[str] = None,
+                 canonicalizer: Optional[UrlCanonicalizer] = None, ip_ranges_path: Optional[str] = None,
+                 metrics=None, max_attempts: int = 5, retry_backoff: float = 0.5, max_backoff: float = 10.0):
+        if mode not in ENRICHMENT_MODES:
+            raise ValueError(f"Unknown enrichment mode '{mode}' (expected one of {', '.join(ENRICHMENT_MODES)})")
+        self.mode = mode
+        self.sink = sink
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.workers = workers
+        self.geoip_path = geoip_path
+        self.ip_ranges_path = ip_ranges_path
+        self.canonicalizer = canonicalizer
+        self.metrics = metrics
+        # Queued events are already acked: a failed write is retried with backoff, and only
+        # dropped (counted in `failed`) after max_attempts
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.queue: Optional[asyncio.Queue] = None
+        self.executor: Optional[Executor] = None
+        self._task: Optional[asyncio.Task] = None
+        # Events taken off the queue but not yet handed to _process, and the batch being written
+        self._collecting: List[Dict[str, Any]] = []
+        self._batch: List[Dict[str, Any]] = []
+        self._inflight: Optional[asyncio.Future] = None
+        self.enriched = 0
+        self.failed = 0
+        self.retries = 0
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def oldest_pending(self) -> Optional[datetime]:
+        """Timestamp of the oldest acked event not stored yet (batches are taken in queue order)."""
+        for events in (self._batch, self._collecting):
+            if events and events[0].get('timestamp') is not None:
+                return to_datetime(events[0]['timestamp'])
+        if self.depth:
+            # Only between two batches: the next one is being picked up now
+            return datetime.now(timezone.utc) - timedelta(seconds=self.max_delay)
+        return None
+
+    async def start(self):
+        if self.mode == 'inline':
+            return
+        if self.mode == 'process':
+            self.executor = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                                initargs=(self.geoip_path, self.canonicalizer, self.ip_ranges_path))
+        else:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='enrich')
+        self.queue = asyncio.Queue(self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, raw: Dict[str, Any]):
+        """Enrich and store one raw event (queued unless running inline or the queue is full)."""
+        if self.queue is None or self.queue.full():
+            await self.sink(enrich_batch([raw]))
+            return
+        self.queue.put_nowait(raw)
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        # Collected in self._collecting so stop() can flush a batch interrupted half-way
+        batch = self._collecting = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self._collecting = []
+        return batch
+
+    async def enrich(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Enrich a batch in the executor (or inline when there is none)."""
+        with self.metrics.span('ingest.enrich') if self.metrics is not None else nullcontext():
+            if self.executor is None:
+                return enrich_batch(batch)
+            return await asyncio.get_running_loop().run_in_executor(self.executor, enrich_batch, batch)
+
+    async def _process(self, batch: List[Dict[str, Any]]):
+        delay = self.retry_backoff
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                docs = await self.enrich(batch)
+                await self.sink(docs)
+                self.enriched += len(docs)
+                return
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    self.failed += len(batch)
+                    logger.error(f"[ENRICH] Dropped batch of {len(batch)} events after {attempt} attempts: {e}")
+                    return
+                self.retries += 1
+                logger.warning(f"[ENRICH] Batch of {len(batch)} events failed (attempt {attempt}), "
+                               f"retrying in {delay:g}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    async def _run(self):
+        while True:
+            self._batch = await self._next_batch()
+            self._inflight = asyncio.ensure_future(self._process(self._batch))
+            # Shielded: cancelling the loop (stop) must not abandon a batch half-written
+            await asyncio.shield(self._inflight)
+            self._batch = []
+
+    async def stop(self):
+        """Stop taking batches, finish the one being written, flush queued events and shut the executor down."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            if self._inflight is not None:
+                await self._inflight
+        pending, self._collecting = self._collecting, []
+        while pending or (self.queue is not None and not self.queue.empty()):
+            room = self.batch_size - len(pending)
+            pending += [self.queue.get_nowait() for _ in range(min(room, self.queue.qsize()))]
+            batch, pending = pending, []
+            await self._process(batch)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
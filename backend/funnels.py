@@ -0,0 +1,151 @@
+"""
+Conversion funnels over sessions.
+
+A funnel is an ordered list of step predicates plus a conversion window. A
+session reaches step k when it has events matching steps 0..k in that order,
+with the step-k event no later than `window` after the step-0 event.
+
+Events are streamed ordered by (session_id, timestamp) from the event store
+(`EventStore.scan_sessions`) through a small per-session state machine:
+for every step it keeps the latest start time of a chain reaching that step
+(a later start leaves the most room in the window). That is O(steps) work
+per event and O(steps) state per session, and only one session is held at a
+time, so memory does not grow with the number of sessions or events.
+"""
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urlsplit
+
+MAX_STEPS = 10
+
+
+class StepPredicate:
+    """
+    Matches events by event_type, event_name and/or page.
+
+    `page` is compared with the URL path (or with the full URL when it
+    contains '://'); a trailing '*' turns it into a prefix match.
+    """
+
+    def __init__(self, event_type: Optional[str] = None, event_name: Optional[str] = None,
+                 page: Optional[str] = None, label: Optional[str] = None):
+        if not (event_type or event_name or page):
+            raise ValueError("A funnel step needs at least one of event_type, event_name or page")
+        self.event_type = event_type
+        self.event_name = event_name
+        self.page = page
+        self.prefix = bool(page) and page.endswith('*')
+        self.page_value = page[:-1] if self.prefix else page
+        self.full_url = bool(page) and '://' in page
+        self.label = label or page or event_name or event_type
+        # Page-only steps are compared once per distinct URL
+        self._page_matches: Dict[str, bool] = {}
+
+    def _match_page(self, url: Optional[str]) -> bool:
+        if not url:
+            return False
+        matched = self._page_matches.get(url)
+        if matched is None:
+            target = url if self.full_url else (urlsplit(url).path or '/')
+            matched = target.startswith(self.page_value) if self.prefix else target == self.page_value
+            if len(self._page_matches) < 100000:
+                self._page_matches[url] = matched
+        return matched
+
+    def __call__(self, event: Dict[str, Any]) -> bool:
+        if self.event_type and event.get('event_type') != self.event_type:
+            return False
+        if self.event_name and event.get('event_name') != self.event_name:
+            return False
+        if self.page and not self._match_page(event.get('page_url')):
+            return False
+        return True
+
+
+def _epoch(ts: Any) -> float:
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    return ts.timestamp()
+
+
+class Funnel:
+    def __init__(self, steps: List[StepPredicate], window_seconds: float):
+        if not 2 <= len(steps) <= MAX_STEPS:
+            raise ValueError(f"A funnel needs between 2 and {MAX_STEPS} steps")
+        if window_seconds <= 0:
+            raise ValueError("The conversion window must be positive")
+        self.steps = steps
+        self.window = window_seconds
+        self.reached = [0] * len(steps)
+        self.sessions = 0
+        self.events = 0
+
+    def _finish(self, best: List[Optional[float]]):
+        self.sessions += 1
+        for k in range(len(best) - 1, -1, -1):
+            if best[k] is not None:
+                for j in range(k + 1):
+                    self.reached[j] += 1
+                break
+
+    def feed(self, events: List[Dict[str, Any]], state: Dict[str, Any]):
+        """Advance the state machine over a batch of (session, timestamp)-ordered events."""
+        steps = self.steps
+        n = len(steps)
+        window = self.window
+        session = state.get('session')
+        best = state.get('best')
+        for e in events:
+            self.events += 1
+            sid = e.get('session_id')
+            if sid != session:
+                if best is not None:
+                    self._finish(best)
+                session = sid
+                best = [None] * n
+            ts = None
+            # Highest step first, so one event cannot satisfy two consecutive steps
+            for k in range(n - 1, -1, -1):
+                if k and best[k - 1] is None:
+                    continue
+                if not steps[k](e):
+                    continue
+                if ts is None:
+                    ts = _epoch(e['timestamp'])
+                start = ts if k == 0 else best[k - 1]
+                if k and ts - start > window:
+                    continue
+                if best[k] is None or start > best[k]:
+                    best[k] = start
+        state['session'] = session
+        state['best'] = best
+
+    async def run(self, batches: AsyncIterator[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        state: Dict[str, Any] = {}
+        async for batch in batches:
+            self.feed(batch, state)
+        if state.get('best') is not None:
+            self._finish(state['best'])
+        return self.result()
+
+    def result(self) -> Dict[str, Any]:
+        first = self.reached[0]
+        steps = []
+        for k, step in enumerate(self.steps):
+            count = self.reached[k]
+            prev = self.reached[k - 1] if k else count
+            steps.append({
+                "step": k + 1,
+                "label": step.label,
+                "sessions": count,
+                "conversion_rate": round(count / first * 100, 1) if first else 0,
+                "step_conversion_rate": round(count / prev * 100, 1) if prev else 0,
+                "drop_off": prev - count,
+            })
+        return {
+            "steps": steps,
+            "overall_conversion_rate": steps[-1]["conversion_rate"],
+            "window_seconds": self.window,
+            "sessions_scanned": self.sessions,
+            "events_scanned": self.events,
+        }
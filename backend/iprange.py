@@ -0,0 +1,245 @@
+"""
+Offline IP -> country index.
+
+Used when no GeoLite2 database is installed (and for addresses GeoLite2
+does not know). The index is a single file of sorted range starts, built
+by `build_ip_ranges.py` from the RIR delegation files (or a db-ip style
+`start,end,country` CSV):
+
+    header   '<4sHHII': magic, version, country count, IPv4 ranges, IPv6 ranges
+    countries           2 ASCII bytes each; index 0 is "unknown"
+    IPv4 starts         uint32 little-endian, ascending
+    IPv4 countries      uint8 index per range
+    IPv6 starts         uint64 little-endian (the /64 prefix), ascending
+    IPv6 countries      uint8 index per range
+
+Ranges tile the whole address space (gaps are "unknown" ranges), so the
+country of an address is the one of the last start <= address: a `bisect`
+over the mmap'ed start array, with no parsing at load time and pages shared
+between worker processes. IPv6 is indexed by /64 prefix, the smallest unit
+anything is allocated in.
+"""
+import bisect
+import mmap
+import socket
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MAGIC = b'IPRG'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+UNKNOWN = '--'
+
+CONTINENT_CODES = {
+    'Africa': 'AO BF BI BJ BW CD CF CG CI CM CV DJ DZ EG EH ER ET GA GH GM GN GQ GW KE KM LR LS LY MA MG '
+              'ML MR MU MW MZ NA NE NG RE RW SC SD SH SL SN SO SS ST SZ TD TG TN TZ UG YT ZA ZM ZW',
+    'Antarctica': 'AQ BV GS HM TF',
+    'Asia': 'AE AF AM AP AZ BD BH BN BT CC CN CX CY GE HK ID IL IN IO IQ IR JO JP KG KH KP KR KW KZ LA LB '
+            'LK MM MN MO MV MY NP OM PH PK PS QA SA SG SY TH TJ TL TM TR TW UZ VN YE',
+    'Europe': 'AD AL AT AX BA BE BG BY CH CZ DE DK EE ES EU FI FO FR GB GG GI GR HR HU IE IM IS IT JE LI LT '
+              'LU LV MC MD ME MK MT NL NO PL PT RO RS RU SE SI SJ SK SM UA VA XK',
+    'North America': 'AG AI AW BB BL BM BQ BS BZ CA CR CU CW DM DO GD GL GP GT HN HT JM KN KY LC MF MQ MS '
+                     'MX NI PA PM PR SV SX TC TT UM US VC VG VI',
+    'Oceania': 'AS AU CK FJ FM GU KI MH MP NC NF NR NU NZ PF PG PN PW SB TK TO TV VU WF WS',
+    'South America': 'AR BO BR CL CO EC FK GF GY PE PY SR UY VE',
+}
+CONTINENTS: Dict[str, str] = {code: name for name, codes in CONTINENT_CODES.items() for code in codes.split()}
+
+
+def continent_of(country: Optional[str]) -> Optional[str]:
+    return CONTINENTS.get(country) if country else None
+
+
+def parse_ip(value: str) -> Tuple[int, int]:
+    """(4 or 6, integer value); IPv4-mapped IPv6 addresses are IPv4. Raises ValueError."""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, value), 'big')
+    except OSError:
+        pass
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, value.split('%', 1)[0])
+    except OSError:
+        raise ValueError(f"Invalid IP address '{value}'")
+    if packed[:12] == b'\0' * 10 + b'\xff\xff':
+        return 4, int.from_bytes(packed[12:], 'big')
+    return 6, int.from_bytes(packed, 'big')
+
+
+def _pad(size: int) -> int:
+    return -size % 8
+
+
+class IpRangeIndex:
+    def __init__(self, buffer, source: Optional[str] = None):
+        self.source = source
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, n_countries, n_v4, n_v6 = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not an IP range index (version {VERSION}): {source or 'buffer'}")
+        offset = HEADER.size
+        codes = bytes(view[offset:offset + 2 * n_countries]).decode('ascii')
+        self.countries: List[Optional[str]] = [None] + [codes[i:i + 2] for i in range(2, len(codes), 2)]
+        offset += 2 * n_countries
+        offset += _pad(offset)
+        self._v4 = self._array(view[offset:offset + 4 * n_v4], 'I')
+        offset += 4 * n_v4
+        self._v4_codes = view[offset:offset + n_v4]
+        offset += n_v4
+        offset += _pad(offset)
+        self._v6 = self._array(view[offset:offset + 8 * n_v6], 'Q')
+        offset += 8 * n_v6
+        self._v6_codes = view[offset:offset + n_v6]
+
+    @staticmethod
+    def _array(view: memoryview, typecode: str):
+        if sys.byteorder == 'little':
+            return view.cast(typecode)
+        # Big-endian hosts get a private copy instead of the shared mapping
+        values = array(typecode, bytes(view))
+        values.byteswap()
+        return values
+
+    @classmethod
+    def open(cls, path: str) -> 'IpRangeIndex':
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), source=path)
+
+    def __len__(self) -> int:
+        return len(self._v4) + len(self._v6)
+
+    def country(self, ip: str) -> Optional[str]:
+        """ISO country code of an address; None when unknown or not a valid address."""
+        try:
+            version, value = parse_ip(ip)
+        except ValueError:
+            return None
+        if version == 4:
+            i = bisect.bisect_right(self._v4, value) - 1
+            return self.countries[self._v4_codes[i]] if i >= 0 else None
+        i = bisect.bisect_right(self._v6, value >> 64) - 1
+        return self.countries[self._v6_codes[i]] if i >= 0 else None
+
+    def lookup(self, ip: str) -> Tuple[Optional[str], Optional[str]]:
+        """(country, continent)."""
+        country = self.country(ip)
+        return country, continent_of(country)
+
+    def lookup_many(self, ips: Iterable[str]) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """{ip: (country, continent)} for many addresses, each distinct one resolved once."""
+        out: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        for ip in ips:
+            if ip not in out:
+                out[ip] = self.lookup(ip)
+        return out
+
+    def stats(self) -> Dict[str, object]:
+        return {"source": self.source, "ipv4_ranges": len(self._v4), "ipv6_ranges": len(self._v6),
+                "countries": len(self.countries) - 1}
+
+    def close(self):
+        self._v4 = self._v6 = array('I')
+        self._v4_codes = self._v6_codes = b''
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+# ---------- building ----------
+
+Range = Tuple[int, int, str]  # first address, last address (inclusive), country
+
+
+def _tile(ranges: List[Range], top: int, index: Dict[str, int]) -> Tuple[List[int], List[int]]:
+    """Sorted, non-overlapping starts covering [0, top], merging neighbours of the same country."""
+    starts: List[int] = []
+    codes: List[int] = []
+
+    def emit(start: int, code: int):
+        if codes and codes[-1] == code:
+            return
+        if starts and starts[-1] == start:
+            starts.pop()
+            codes.pop()
+            if codes and codes[-1] == code:
+                return
+        starts.append(start)
+        codes.append(code)
+
+    position = 0
+    for first, last, country in sorted(ranges):
+        first = max(first, position)
+        last = min(last, top)
+        if first > last:
+            continue  # overlapped by an earlier range
+        if first > position:
+            emit(position, 0)
+        emit(first, index.setdefault(country, len(index)))
+        position = last + 1
+    if position <= top:
+        emit(position, 0)
+    return starts, codes
+
+
+def build_index(ranges: Iterable[Tuple[int, int, int, str]]) -> bytes:
+    """Serialize (ip version, first, last, country) ranges; overlaps keep the earlier-starting range."""
+    v4: List[Range] = []
+    v6: List[Range] = []
+    for version, first, last, country in ranges:
+        country = country.upper()
+        if len(country) != 2 or not country.isalpha():
+            continue
+        if version == 4:
+            v4.append((first, last, country))
+        else:
+            v6.append((first >> 64, last >> 64, country))
+    index = {UNKNOWN: 0}
+    v4_starts, v4_codes = _tile(v4, 2 ** 32 - 1, index)
+    v6_starts, v6_codes = _tile(v6, 2 ** 64 - 1, index)
+    if len(index) > 256:
+        raise ValueError(f"{len(index) - 1} country codes do not fit the one-byte country index")
+
+    countries = ''.join(sorted(index, key=index.get)).encode('ascii')
+    out = bytearray(HEADER.pack(MAGIC, VERSION, len(index), len(v4_starts), len(v6_starts)))
+    out += countries + b'\0' * _pad(len(out) + len(countries))
+    out += struct.pack(f'<{len(v4_starts)}I', *v4_starts) + bytes(v4_codes)
+    out += b'\0' * _pad(len(out))
+    out += struct.pack(f'<{len(v6_starts)}Q', *v6_starts) + bytes(v6_codes)
+    return bytes(out)
+
+
+def parse_delegated(lines: Iterable[str]) -> Iterable[Tuple[int, int, int, str]]:
+    """
+    RIR statistics exchange format ('delegated-*-extended-latest'):
+    registry|cc|type|start|value|date|status[|...], where value is an
+    address count for ipv4 and a prefix length for ipv6.
+    """
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        parts = line.strip().split('|')
+        if len(parts) < 7 or parts[2] not in ('ipv4', 'ipv6') or parts[6] not in ('allocated', 'assigned'):
+            continue
+        country = parts[1]
+        try:
+            version, first = parse_ip(parts[3])
+            size = int(parts[4]) if parts[2] == 'ipv4' else 2 ** (128 - int(parts[4]))
+        except ValueError:
+            continue
+        yield version, first, first + size - 1, country
+
+
+def parse_csv(lines: Iterable[str]) -> Iterable[Tuple[int, int, int, str]]:
+    """'first,last,country' rows (db-ip lite and similar), IPv4 and IPv6 mixed."""
+    for line in lines:
+        parts = [part.strip().strip('"') for part in line.split(',')]
+        if len(parts) < 3:
+            continue
+        try:
+            version, first = parse_ip(parts[0])
+            last_version, last = parse_ip(parts[1])
+        except ValueError:
+            continue
+        if version == last_version and first <= last:
+            yield version, first, last, parts[2]
@@ -0,0 +1,280 @@
+"""
+Latency histograms and counters, exposed in the Prometheus text format.
+
+  - `MetricsMiddleware` times every request by route template, method and status
+  - `Metrics.span(stage)` times one stage of a handler or pipeline (project
+    lookup, database query, aggregation, enrichment, serialization...)
+  - `mongo_listeners` (PyMongo command and pool listeners) record time spent
+    in each database command, connection checkout waits and pool usage
+  - `collect` registers values read at scrape time: cache hit counts, ingest
+    queue depth, write-ahead log lag
+
+Histograms have fixed log-spaced buckets (two per power of two, 0.1 ms to
+~100 s, so any quantile is within ~19%): observing is a bisect and an
+increment, and the buckets are what `histogram_quantile` aggregates across
+instances. Values are per process; with several workers scrape each one.
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+BUCKETS = tuple(0.0001 * 2 ** (i / 2) for i in range(41))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...] = BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # Observations also come from PyMongo's monitoring threads
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None when empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else float('inf')
+        return float('inf')
+
+
+class _Span:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return '{' + pairs + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, bounds: Tuple[float, ...] = BUCKETS):
+        self.bounds = bounds
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._values: Dict[str, Dict[Labels, float]] = {}
+        self._collectors: List[Tuple[str, Callable]] = []
+        self._lock = threading.Lock()
+        self.define('http_request_duration_seconds', 'histogram', 'Request latency by route template, method and status')
+        self.define('analytics_stage_duration_seconds', 'histogram', 'Time spent in each stage of request handling and ingestion')
+
+    def define(self, name: str, kind: str, help: str):
+        self._meta[name] = (kind, help)
+
+    # ---------- recording ----------
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        series = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = series.setdefault(key, Histogram(self.bounds))
+        return histogram
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    def span(self, stage: str) -> _Span:
+        """`with metrics.span('overview.counts'):` records the block's duration for that stage."""
+        return _Span(self.histogram('analytics_stage_duration_seconds', stage=stage))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Add to a counter (or, with a negative amount, a gauge)."""
+        series = self._values.setdefault(name, {})
+        key = _labels(labels)
+        with self._lock:
+            series[key] = series.get(key, 0) + amount
+
+    def collect(self, name: str, kind: str, help: str,
+                read: Callable[[], Union[float, Iterable[Tuple[Dict[str, str], float]]]]):
+        """Register a value read at scrape time: a number, or (labels, value) pairs."""
+        self.define(name, kind, help)
+        self._collectors.append((name, read))
+
+    # ---------- exposition ----------
+
+    def quantiles(self, name: str = 'http_request_duration_seconds',
+                  qs: Tuple[float, ...] = (0.5, 0.95, 0.99)) -> List[Dict[str, object]]:
+        """Per-series count and quantiles, for JSON health endpoints."""
+        out = []
+        for labels, histogram in list(self._histograms.get(name, {}).items()):
+            row: Dict[str, object] = dict(labels)
+            row["count"] = histogram.count
+            for q in qs:
+                value = histogram.quantile(q)
+                row[f"p{round(q * 100)}_ms"] = None if value is None else round(value * 1000, 2)
+            out.append(row)
+        return out
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+
+        def header(name: str):
+            kind, help = self._meta.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for name, series in list(self._histograms.items()):
+            header(name)
+            for labels, histogram in sorted(series.items()):
+                with histogram._lock:
+                    counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+                cumulative = 0
+                for bound, n in zip(self.bounds + (float('inf'),), counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name, series in list(self._values.items()):
+            header(name)
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_number(value)}")
+        for name, read in self._collectors:
+            try:
+                value = read()
+            except Exception:
+                continue
+            header(name)
+            if isinstance(value, (int, float)):
+                lines.append(f"{name} {_number(value)}")
+                continue
+            for labels, v in value:
+                lines.append(f"{name}{_format_labels(_labels(labels))} {_number(v)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request, labelled with the matched route template (not the raw path)."""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            self.metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                                 route=route, method=scope['method'], status=status)
+
+
+def mongo_listeners(metrics: Metrics) -> list:
+    """PyMongo listeners for command durations, checkout waits and pool usage ([] without pymongo)."""
+    try:
+        from pymongo import monitoring
+    except Exception:
+        return []
+
+    metrics.define('mongo_command_duration_seconds', 'histogram', 'Database time per MongoDB command')
+    metrics.define('mongo_command_failures_total', 'counter', 'Failed MongoDB commands')
+    metrics.define('mongo_pool_checkout_wait_seconds', 'histogram', 'Time waiting for a pooled connection')
+    metrics.define('mongo_pool_checkout_failures_total', 'counter', 'Connection checkouts that failed or timed out')
+    metrics.define('mongo_pool_connections', 'gauge', 'Open pooled connections')
+    metrics.define('mongo_pool_connections_in_use', 'gauge', 'Pooled connections checked out')
+
+    class CommandListener(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            metrics.observe('mongo_command_duration_seconds', event.duration_micros / 1e6, command=event.command_name)
+
+        def failed(self, event):
+            metrics.observe('mongo_command_duration_seconds', event.duration_micros / 1e6, command=event.command_name)
+            metrics.inc('mongo_command_failures_total', command=event.command_name)
+
+    class PoolListener(monitoring.ConnectionPoolListener):
+        def pool_created(self, event):
+            pass
+
+        def pool_ready(self, event):
+            pass
+
+        def pool_cleared(self, event):
+            pass
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_created(self, event):
+            metrics.inc('mongo_pool_connections')
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_closed(self, event):
+            metrics.inc('mongo_pool_connections', -1)
+
+        def connection_check_out_started(self, event):
+            pass
+
+        def connection_check_out_failed(self, event):
+            metrics.inc('mongo_pool_checkout_failures_total', reason=str(event.reason))
+
+        def connection_checked_out(self, event):
+            metrics.inc('mongo_pool_connections_in_use')
+            duration = getattr(event, 'duration', None)  # PyMongo 4.7+
+            if duration is not None:
+                metrics.observe('mongo_pool_checkout_wait_seconds', duration)
+
+        def connection_checked_in(self, event):
+            metrics.inc('mongo_pool_connections_in_use', -1)
+
+    return [CommandListener(), PoolListener()]
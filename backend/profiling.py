@@ -0,0 +1,428 @@
+"""
+On-demand request profiling and continuous low-rate stack sampling.
+
+Captures are armed by an admin for the next N requests matching a path glob
+(`/api/analytics/*/overview`) and/or a project id (a path segment or the
+`project_id` query parameter), and armed on every worker through the
+`SharedState`, which also counts the N requests across workers:
+
+  - cprofile: each matching request runs under cProfile and is dumped as
+    a .pstats file; downloads merge them. cProfile sees the whole event
+    loop thread, so coroutines of concurrent requests show up too, and
+    only one request per worker is profiled at a time (others run normally
+    and do not use up the capture)
+  - sampling: while matching requests are in flight, every thread's stack
+    is sampled `capture_hz` times a second; downloadable as speedscope JSON
+    or collapsed stacks (flamegraph.pl / speedscope)
+
+With `sample_hz` > 0 the same sampler runs all the time at that rate
+(PROFILE_SAMPLE_HZ; 1-10 Hz costs next to nothing) and aggregates stacks
+per worker, to find hot loops in production without arming anything.
+Idle threads (waiting on a lock or in the event loop's select) are skipped.
+
+Files live under `directory/<capture id>/`, one file per request (cprofile)
+or per worker (sampling), so every worker on the host can write and serve
+them; only the newest `max_captures` captures are kept.
+"""
+import asyncio
+import cProfile
+import fnmatch
+import json
+import logging
+import marshal
+import os
+import pstats
+import shutil
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('cprofile', 'sampling')
+DOWNLOAD_FORMATS = ('pstats', 'speedscope', 'collapsed')
+CHANNEL = 'profiling'
+
+Frame = Tuple[str, str, int]  # function, file, first line
+Stack = Tuple[Frame, ...]  # root first
+
+# Leaf frames of threads that are waiting, not working
+IDLE_FRAMES = {('wait', 'threading.py'), ('select', 'selectors.py'), ('_worker', 'thread.py')}
+
+
+def _stack(frame) -> Stack:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+def _is_idle(stack: Stack) -> bool:
+    if not stack:
+        return True
+    name, filename, _ = stack[-1]
+    return (name, os.path.basename(filename)) in IDLE_FRAMES
+
+
+def collapsed(stacks: Dict[Stack, int]) -> str:
+    """Brendan Gregg's folded format: 'root;child;leaf count' per line."""
+    lines = []
+    for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+        names = ';'.join(f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack)
+        lines.append(f"{names} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+def speedscope(stacks: Dict[Stack, int], name: str, hz: float) -> Dict[str, Any]:
+    """A speedscope 'sampled' profile (https://www.speedscope.app/file-format-schema.json)."""
+    frames: List[Dict[str, Any]] = []
+    index: Dict[Frame, int] = {}
+    samples = []
+    weights = []
+    for stack, count in stacks.items():
+        ids = []
+        for frame in stack:
+            i = index.get(frame)
+            if i is None:
+                i = index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            ids.append(i)
+        samples.append(ids)
+        weights.append(count / hz if hz else count)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds" if hz else "none",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        }],
+        "name": name,
+        "exporter": "analytics-profiler",
+    }
+
+
+def _encode_stacks(stacks: Dict[Stack, int]) -> List[Any]:
+    return [[[list(frame) for frame in stack], count] for stack, count in stacks.items()]
+
+
+def _decode_stacks(rows: List[Any], into: Dict[Stack, int]):
+    for frames, count in rows:
+        stack = tuple((name, filename, line) for name, filename, line in frames)
+        into[stack] = into.get(stack, 0) + count
+
+
+class Capture:
+    def __init__(self, id: str, mode: str, requests: int, route: Optional[str] = None,
+                 project_id: Optional[str] = None, expires_at: float = 0.0, created_at: Optional[str] = None):
+        self.id = id
+        self.mode = mode
+        self.requests = requests
+        self.route = route
+        self.project_id = project_id
+        self.expires_at = expires_at
+        self.created_at = created_at
+
+    def matches(self, path: str, query_string: bytes) -> bool:
+        if self.route and not fnmatch.fnmatchcase(path, self.route):
+            return False
+        if self.project_id and self.project_id not in path.split('/'):
+            query = parse_qs(query_string.decode('latin-1')) if query_string else {}
+            if self.project_id not in query.get('project_id', []):
+                return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "mode": self.mode, "requests": self.requests, "route": self.route,
+                "project_id": self.project_id, "expires_at": self.expires_at, "created_at": self.created_at}
+
+
+class Profiler:
+    def __init__(self, directory: Path, state, sample_hz: float = 0.0, capture_hz: float = 200.0,
+                 max_captures: int = 20, max_age: float = 3600, max_requests: int = 100, max_stacks: int = 20000):
+        self.directory = directory
+        self.state = state
+        self.sample_hz = sample_hz
+        self.capture_hz = capture_hz
+        self.max_captures = max_captures
+        # Captures that have not seen their N requests stop after max_age seconds
+        self.max_age = max_age
+        self.max_requests = max_requests
+        self.max_stacks = max_stacks
+        self.armed: Dict[str, Capture] = {}
+        self._cprofile_busy = False
+        self._sampling: Dict[str, int] = {}  # capture id -> matching requests in flight
+        self._capture_stacks: Dict[str, Dict[Stack, int]] = {}
+        self.continuous: Dict[Stack, int] = {}
+        self.continuous_since = time.time()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._seq = 0
+        state.subscribe(CHANNEL, self._on_message)
+
+    # ---------- lifecycle ----------
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+        self._thread.start()
+        if self.sample_hz > 0:
+            logger.info(f"[PROFILE] Continuous sampling at {self.sample_hz} Hz")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    # ---------- captures ----------
+
+    async def arm(self, mode: str, requests: int, route: Optional[str] = None,
+                  project_id: Optional[str] = None) -> Dict[str, Any]:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of {', '.join(PROFILE_MODES)}")
+        if not route and not project_id:
+            raise ValueError("Specify a route and/or a project_id to match")
+        if not 1 <= requests <= self.max_requests:
+            raise ValueError(f"requests must be between 1 and {self.max_requests}")
+        capture = Capture(uuid.uuid4().hex[:12], mode, requests, route, project_id,
+                          expires_at=time.time() + self.max_age,
+                          created_at=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+        path = self.directory / capture.id
+        path.mkdir(parents=True, exist_ok=True)
+        (path / 'capture.json').write_text(json.dumps(capture.to_dict()))
+        self._prune()
+        await self.state.publish(CHANNEL, json.dumps({"arm": capture.to_dict()}))
+        logger.info(f"[PROFILE] Armed {mode} capture {capture.id} for {requests} requests "
+                    f"(route={route}, project={project_id})")
+        return capture.to_dict()
+
+    def _on_message(self, message: str):
+        data = json.loads(message)
+        if 'arm' in data:
+            capture = Capture(**data['arm'])
+            self.armed[capture.id] = capture
+        elif 'disarm' in data:
+            self.armed.pop(data['disarm'], None)
+
+    async def disarm(self, capture_id: str):
+        await self.state.publish(CHANNEL, json.dumps({"disarm": capture_id}))
+
+    def match(self, scope) -> Optional[Capture]:
+        now = time.time()
+        for capture in list(self.armed.values()):
+            if capture.expires_at < now:
+                self.armed.pop(capture.id, None)
+            elif capture.matches(scope['path'], scope.get('query_string', b'')):
+                return capture
+        return None
+
+    async def _claim(self, capture: Capture) -> bool:
+        """Take one of the capture's N requests (counted across workers)."""
+        taken = await self.state.incr(f'profile:taken:{capture.id}')
+        if taken > capture.requests:
+            self.armed.pop(capture.id, None)
+            return False
+        if taken == capture.requests:
+            self.armed.pop(capture.id, None)
+            await self.disarm(capture.id)
+        return True
+
+    async def run(self, capture: Capture, app, scope, receive, send):
+        if capture.mode == 'cprofile' and self._cprofile_busy:
+            await app(scope, receive, send)
+            return
+        if capture.mode == 'cprofile':
+            self._cprofile_busy = True
+        if not await self._claim(capture):
+            self._cprofile_busy = False
+            await app(scope, receive, send)
+            return
+        if capture.mode == 'cprofile':
+            await self._run_cprofile(capture, app, scope, receive, send)
+        else:
+            await self._run_sampled(capture, app, scope, receive, send)
+
+    async def _run_cprofile(self, capture: Capture, app, scope, receive, send):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                await app(scope, receive, send)
+            finally:
+                profile.disable()
+        finally:
+            self._cprofile_busy = False
+        self._seq += 1
+        target = self.directory / capture.id / f"{os.getpid()}-{self._seq}.pstats"
+        await asyncio.get_running_loop().run_in_executor(None, self._dump_pstats, profile, target)
+
+    @staticmethod
+    def _dump_pstats(profile: cProfile.Profile, target: Path):
+        try:
+            profile.dump_stats(str(target))
+        except Exception as e:
+            logger.error(f"[PROFILE] Failed to write {target}: {e}")
+
+    async def _run_sampled(self, capture: Capture, app, scope, receive, send):
+        with self._lock:
+            self._sampling[capture.id] = self._sampling.get(capture.id, 0) + 1
+            self._capture_stacks.setdefault(capture.id, {})
+        self._wake.set()
+        try:
+            await app(scope, receive, send)
+        finally:
+            with self._lock:
+                self._sampling[capture.id] -= 1
+                if not self._sampling[capture.id]:
+                    del self._sampling[capture.id]
+                rows = _encode_stacks(self._capture_stacks[capture.id])
+                if capture.id not in self._sampling and capture.id not in self.armed:
+                    del self._capture_stacks[capture.id]
+            target = self.directory / capture.id / f"{os.getpid()}.stacks.json"
+            await asyncio.get_running_loop().run_in_executor(None, self._write, target, json.dumps(rows))
+
+    @staticmethod
+    def _write(target: Path, data: str):
+        try:
+            tmp = target.with_suffix('.tmp')
+            tmp.write_text(data)
+            tmp.replace(target)
+        except Exception as e:
+            logger.error(f"[PROFILE] Failed to write {target}: {e}")
+
+    # ---------- sampler ----------
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        next_continuous = time.monotonic()
+        while not self._stop.is_set():
+            with self._lock:
+                active = list(self._sampling)
+            continuous_due = self.sample_hz > 0 and time.monotonic() >= next_continuous
+            if active or continuous_due:
+                stacks = [_stack(frame) for ident, frame in sys._current_frames().items() if ident != own]
+                stacks = [stack for stack in stacks if not _is_idle(stack)]
+                with self._lock:
+                    for capture_id in active:
+                        self._add(self._capture_stacks.setdefault(capture_id, {}), stacks)
+                    if continuous_due:
+                        self._add(self.continuous, stacks)
+                if continuous_due:
+                    next_continuous = time.monotonic() + 1 / self.sample_hz
+            if active:
+                time.sleep(1 / self.capture_hz)
+            elif self.sample_hz > 0:
+                self._wake.wait(max(0.0, next_continuous - time.monotonic()))
+                self._wake.clear()
+            else:
+                self._wake.wait()
+                self._wake.clear()
+
+    def _add(self, into: Dict[Stack, int], stacks: List[Stack]):
+        for stack in stacks:
+            if stack not in into and len(into) >= self.max_stacks:
+                stack = (('[other stacks]', '', 0),)
+            into[stack] = into.get(stack, 0) + 1
+
+    def continuous_profile(self, fmt: str = 'speedscope', reset: bool = False):
+        with self._lock:
+            stacks = dict(self.continuous)
+            since = self.continuous_since
+            if reset:
+                self.continuous = {}
+                self.continuous_since = time.time()
+        name = f"pid {os.getpid()} since {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(since))}"
+        if fmt == 'collapsed':
+            return collapsed(stacks)
+        return speedscope(stacks, name, self.sample_hz)
+
+    # ---------- stored captures ----------
+
+    def _capture_dirs(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        dirs = [p for p in self.directory.iterdir() if (p / 'capture.json').exists()]
+        return sorted(dirs, key=lambda p: (p / 'capture.json').stat().st_mtime, reverse=True)
+
+    def _prune(self):
+        for path in self._capture_dirs()[self.max_captures:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def list(self) -> List[Dict[str, Any]]:
+        out = []
+        for path in self._capture_dirs():
+            info = json.loads((path / 'capture.json').read_text())
+            info["files"] = len([p for p in path.iterdir() if p.suffix == '.pstats' or p.name.endswith('.stacks.json')])
+            info["armed"] = info["id"] in self.armed
+            out.append(info)
+        return out
+
+    def _capture_dir(self, capture_id: str) -> Path:
+        path = self.directory / capture_id
+        if not capture_id.isalnum() or not (path / 'capture.json').exists():
+            raise KeyError(capture_id)
+        return path
+
+    def delete(self, capture_id: str):
+        shutil.rmtree(self._capture_dir(capture_id), ignore_errors=True)
+        self.armed.pop(capture_id, None)
+
+    def export(self, capture_id: str, fmt: str) -> Tuple[bytes, str]:
+        """(content, media type) of a capture: merged pstats, speedscope JSON or collapsed stacks."""
+        path = self._capture_dir(capture_id)
+        info = json.loads((path / 'capture.json').read_text())
+        if fmt not in DOWNLOAD_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(DOWNLOAD_FORMATS)}")
+        if info['mode'] == 'cprofile':
+            if fmt != 'pstats':
+                raise ValueError("cprofile captures download as pstats")
+            files = sorted(str(p) for p in path.glob('*.pstats'))
+            if not files:
+                raise LookupError("No requests captured yet")
+            stats = pstats.Stats(files[0])
+            for f in files[1:]:
+                stats.add(f)
+            # What Stats.dump_stats writes
+            return marshal.dumps(stats.stats), 'application/octet-stream'
+        if fmt == 'pstats':
+            raise ValueError("sampling captures download as speedscope or collapsed")
+        stacks: Dict[Stack, int] = {}
+        for f in path.glob('*.stacks.json'):
+            _decode_stacks(json.loads(f.read_text()), stacks)
+        if not stacks:
+            raise LookupError("No requests captured yet")
+        if fmt == 'collapsed':
+            return collapsed(stacks).encode(), 'text/plain; charset=utf-8'
+        return json.dumps(speedscope(stacks, f"capture {capture_id}", self.capture_hz)).encode(), 'application/json'
+
+
+class ProfilingMiddleware:
+    """ASGI middleware handing requests that match an armed capture to the Profiler."""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.profiler.armed:
+            await self.app(scope, receive, send)
+            return
+        capture = self.profiler.match(scope)
+        if capture is None:
+            await self.app(scope, receive, send)
+            return
+        await self.profiler.run(capture, self.app, scope, receive, send)
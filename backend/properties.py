@@ -0,0 +1,303 @@
+"""
+Custom event property analytics.
+
+Events carry an arbitrary `properties` dict (revenue, plan, button ids, ...).
+At ingest `PropertyAnalytics.observe` maintains, per project:
+
+  - the property schema (`PropertySchemaStore`): every key seen, the JSON
+    types of its values and on how many events
+  - partial indexes on (project_id, properties.<key>, timestamp) for hot
+    keys, created once a key has been seen on `index_threshold` events or
+    when it is declared `indexed`. Indexes are per event store (shared by
+    all projects) and capped at `max_indexes`, since each one slows down
+    every insert
+  - daily rollups (`RollupStore`) for numeric keys declared `rollup`:
+    counters 'prop:<key>:sum' / 'prop:<key>:count', and the same per value
+    of every low-cardinality key in `rollup_by`
+
+`query` groups and sums over whole UTC days: from the rollups when they
+cover the range, otherwise with a group-by run by the database
+(`EventStore.aggregate_properties`), which the partial indexes serve.
+Events are never loaded into the API process.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote
+
+from storage import to_iso
+
+logger = logging.getLogger(__name__)
+
+# Keys usable in document paths / SQL json paths as they are
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+# Group values longer than this are not rolled up (rollup_by is meant for plans, tiers, variants...)
+MAX_ROLLUP_VALUE_LENGTH = 200
+
+
+def value_type(value: Any) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, list):
+        return 'array'
+    return 'object'
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _escape(value: Any) -> str:
+    # Counter names become Mongo field names: no '.' and no '$'
+    return json.dumps(value, separators=(',', ':')).replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+
+def _unescape(name: str) -> Any:
+    return json.loads(unquote(name))
+
+
+def _add(counters: Dict[str, float], name: str, value: float):
+    counters[f"{name}:sum"] = counters.get(f"{name}:sum", 0) + value
+    counters[f"{name}:count"] = counters.get(f"{name}:count", 0) + 1
+
+
+def check_key(key: str) -> str:
+    if not KEY_PATTERN.match(key or ''):
+        raise ValueError(f"Invalid property key '{key}' (letters, digits, '_' and '-', at most 64)")
+    return key
+
+
+class PropertyAnalytics:
+    def __init__(self, repo, index_threshold: int = 10000, max_indexes: int = 10, max_keys: int = 500,
+                 settings_ttl: float = 60, max_projects: int = 10000):
+        self.repo = repo
+        self.index_threshold = index_threshold
+        self.max_indexes = max_indexes
+        self.max_keys = max_keys
+        # Schema documents are cached per project; other workers' declarations show up after settings_ttl
+        self.settings_ttl = settings_ttl
+        self.max_projects = max_projects
+        self._settings: Dict[str, tuple] = {}
+        self._indexing: set = set()
+        self._refused: set = set()
+        self._tasks: set = set()
+
+    async def settings(self, project_id: str) -> Dict[str, Dict[str, Any]]:
+        cached = self._settings.get(project_id)
+        if cached is not None and time.monotonic() - cached[0] < self.settings_ttl:
+            return cached[1]
+        docs = {doc['key']: doc for doc in await self.repo.properties.find(project_id)}
+        self._settings.pop(project_id, None)
+        if len(self._settings) >= self.max_projects:
+            self._settings.pop(next(iter(self._settings)))
+        self._settings[project_id] = (time.monotonic(), docs)
+        return docs
+
+    def drop_project(self, project_id: str):
+        self._settings.pop(project_id, None)
+
+    # ---------- ingest ----------
+
+    async def observe(self, docs: List[Dict[str, Any]]):
+        """Schema, hot-key indexes and rollups for a batch of stored events; never raises."""
+        by_project: Dict[str, List[Dict[str, Any]]] = {}
+        for doc in docs:
+            if doc.get('properties') and not doc.get('is_bot'):
+                by_project.setdefault(doc['project_id'], []).append(doc)
+        for project_id, events in by_project.items():
+            try:
+                await self._observe_project(project_id, events)
+            except Exception as e:
+                logger.error(f"[PROPERTIES] Failed to update property analytics for {project_id}: {e}")
+
+    async def _observe_project(self, project_id: str, events: List[Dict[str, Any]]):
+        types: Dict[str, Dict[str, int]] = {}
+        for event in events:
+            for key, value in event['properties'].items():
+                if KEY_PATTERN.match(key):
+                    counts = types.setdefault(key, {})
+                    t = value_type(value)
+                    counts[t] = counts.get(t, 0) + 1
+        seen_at = max(to_iso(event['timestamp']) for event in events)
+
+        settings = await self.settings(project_id)
+        for key, counts in types.items():
+            if key not in settings and len(settings) >= self.max_keys:
+                continue
+            doc = settings[key] = await self.repo.properties.observe(project_id, key, counts, seen_at)
+            if not doc.get('indexed') and doc.get('count', 0) >= self.index_threshold:
+                self._schedule_index(project_id, key)
+
+        declared = [(key, doc.get('rollup_by') or []) for key, doc in settings.items() if doc.get('rollup')]
+        if not declared:
+            return
+        by_day: Dict[str, Dict[str, float]] = {}
+        for event in events:
+            props = event['properties']
+            for key, dims in declared:
+                value = props.get(key)
+                if not _is_number(value):
+                    continue
+                counters = by_day.setdefault(to_iso(event['timestamp'])[:10], {})
+                _add(counters, f"prop:{key}", value)
+                for dim in dims:
+                    group = props.get(dim)
+                    if group is None or isinstance(group, (dict, list)):
+                        continue
+                    name = _escape(group)
+                    if len(name) <= MAX_ROLLUP_VALUE_LENGTH:
+                        _add(counters, f"prop:{key}:{dim}={name}", value)
+        for day, counters in by_day.items():
+            await self.repo.rollups.increment(project_id, day, counters)
+
+    # ---------- indexes ----------
+
+    async def _index_allowed(self, path: str) -> bool:
+        existing = await self.repo.events.list_field_indexes()
+        return path in existing or len(existing) < self.max_indexes
+
+    def _schedule_index(self, project_id: str, key: str):
+        path = f"properties.{key}"
+        if path in self._indexing or path in self._refused:
+            return
+        self._indexing.add(path)
+        task = asyncio.create_task(self._create_index(project_id, key, path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _create_index(self, project_id: str, key: str, path: str):
+        try:
+            if not await self._index_allowed(path):
+                self._refused.add(path)
+                logger.warning(f"[PROPERTIES] Not indexing '{path}': {self.max_indexes} property indexes already exist")
+                return
+            await self.repo.events.ensure_field_index(path)
+            doc = await self.repo.properties.update(project_id, key, {"indexed": True})
+            settings = self._settings.get(project_id)
+            if settings is not None:
+                settings[1][key] = doc
+            logger.info(f"[PROPERTIES] Indexed '{path}'")
+        except Exception as e:
+            logger.error(f"[PROPERTIES] Failed to index '{path}': {e}")
+        finally:
+            self._indexing.discard(path)
+
+    # ---------- schema ----------
+
+    async def schema(self, project_id: str) -> List[Dict[str, Any]]:
+        docs = await self.repo.properties.find(project_id)
+        return [{k: v for k, v in doc.items() if k != 'project_id'} for doc in docs]
+
+    async def configure(self, project_id: str, key: str, index: bool = False, rollup: Optional[bool] = None,
+                        rollup_by: Optional[List[str]] = None, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Request an index for `key` and/or turn its numeric rollups on or off.
+        Rollups start with the first full day every worker has picked them up,
+        so a query never mixes rolled up and missing days.
+        """
+        check_key(key)
+        for dim in rollup_by or []:
+            check_key(dim)
+        now = now or datetime.now(timezone.utc)
+        current = (await self.settings(project_id)).get(key, {})
+
+        update: Dict[str, Any] = {}
+        if rollup is not None or rollup_by is not None:
+            enabled = current.get('rollup', False) if rollup is None else rollup
+            dims = sorted(set(rollup_by if rollup_by is not None else current.get('rollup_by') or []))
+            if enabled != current.get('rollup', False) or dims != (current.get('rollup_by') or []):
+                first_day = (now + timedelta(seconds=self.settings_ttl)).date() + timedelta(days=1)
+                update = {"rollup": enabled, "rollup_by": dims,
+                          "rollup_since": first_day.isoformat() if enabled else None}
+        if index and not current.get('indexed'):
+            path = f"properties.{key}"
+            if not await self._index_allowed(path):
+                raise ValueError(f"At most {self.max_indexes} property indexes are allowed")
+            self._refused.discard(path)
+            self._schedule_index(project_id, key)
+
+        doc = await self.repo.properties.update(project_id, key, update) if update else {
+            "project_id": project_id, "key": key, **current}
+        self.drop_project(project_id)
+        return {k: v for k, v in doc.items() if k != 'project_id'}
+
+    # ---------- queries ----------
+
+    async def _from_rollups(self, project_id: str, first: date, settings: Optional[Dict[str, Any]],
+                            sum_of: str, group_by: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        if not settings or not settings.get('rollup') or not settings.get('rollup_since'):
+            return None
+        if first.isoformat() < settings['rollup_since']:
+            return None
+        if group_by and group_by not in (settings.get('rollup_by') or []):
+            return None
+        prefix = f"prop:{sum_of}:{group_by}=" if group_by else f"prop:{sum_of}:"
+        groups: Dict[str, Dict[str, Any]] = {}
+        for rollup in await self.repo.rollups.find_range(project_id, first.isoformat()):
+            for name, value in rollup['counters'].items():
+                if not name.startswith(prefix):
+                    continue
+                group, _, field = name[len(prefix):].rpartition(':')
+                if (group == '') == bool(group_by):
+                    continue
+                row = groups.setdefault(group, {"value": _unescape(group) if group_by else None, "events": 0, "sum": 0})
+                row["events" if field == 'count' else "sum"] += value
+        for row in groups.values():
+            row["events"] = int(row["events"])
+        return list(groups.values())
+
+    async def query(self, project_id: str, days: int = 30, group_by: Optional[str] = None,
+                    sum_of: Optional[str] = None, event_name: Optional[str] = None, limit: int = 50,
+                    now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Events and sum of `sum_of` per value of `group_by` over the last `days` UTC days (today included)."""
+        if not group_by and not sum_of:
+            raise ValueError("Specify group_by and/or sum_of")
+        for key in (group_by, sum_of):
+            if key:
+                check_key(key)
+        now = now or datetime.now(timezone.utc)
+        first = now.date() - timedelta(days=days - 1)
+
+        rows = None
+        source = 'rollups'
+        if sum_of and event_name is None:
+            settings = await self.settings(project_id)
+            rows = await self._from_rollups(project_id, first, settings.get(sum_of), sum_of, group_by)
+        if rows is None:
+            source = 'events'
+            rows = await self.repo.events.aggregate_properties(
+                project_id, datetime.combine(first, dtime.min, tzinfo=timezone.utc),
+                group_by=f"properties.{group_by}" if group_by else None,
+                sum_of=f"properties.{sum_of}" if sum_of else None,
+                where={"event_name": event_name} if event_name else None,
+            )
+        rows = [row for row in rows if row["events"]]
+        rows.sort(key=lambda row: row["sum"] if sum_of else row["events"], reverse=True)
+        if not sum_of:
+            for row in rows:
+                row.pop("sum", None)
+
+        total = {"events": sum(row["events"] for row in rows)}
+        if sum_of:
+            total["sum"] = sum(row["sum"] for row in rows)
+        return {
+            "group_by": group_by,
+            "sum_of": sum_of,
+            "event_name": event_name,
+            "days": days,
+            "start": first.isoformat(),
+            "source": source,
+            "total": total,
+            "groups": rows[:limit],
+            "truncated": len(rows) > limit,
+        }
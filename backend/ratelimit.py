@@ -0,0 +1,134 @@
+"""
+Ingest rate limiting.
+
+Token buckets kept in memory per key (project id, IP hash): each bucket
+refills at `rate` tokens per second up to `burst`, and every tracked event
+takes one token. A rate of 0 means no limit, both as the default and as a
+per-key override. A check is a dict lookup and a little arithmetic, so it
+runs before any database work in `track_event`.
+
+Limits are per worker process: with N workers a client can get up to N
+times the configured rate.
+
+The per-IP key is the address of the connection (`client_address`), never
+one supplied by the client: an `ip_address` in the payload or an
+X-Forwarded-For header is only believed from configured trusted proxies,
+otherwise a flooder could send a new address with every request.
+"""
+import ipaddress
+import math
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def parse_networks(specs: Iterable[str]) -> List:
+    """'10.0.0.0/8', '127.0.0.1', ... -> ip_network objects (TRUSTED_PROXIES)."""
+    return [ipaddress.ip_network(spec.strip(), strict=False) for spec in specs if spec.strip()]
+
+
+def _trusted(address: str, networks) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str], trusted_proxies) -> Optional[str]:
+    """
+    The address a request came from: the connection's peer, or, when the
+    peer is a trusted proxy, the right-most X-Forwarded-For hop that is not
+    one of the trusted proxies (hops further left are client-supplied).
+    """
+    if not peer or not forwarded_for or not _trusted(peer, trusted_proxies):
+        return peer
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop, trusted_proxies):
+            return hop
+    return hops[0] if hops else peer
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000,
+                 overrides: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # Per-key (rate, burst) quotas that differ from the default
+        self.overrides = overrides or {}
+        self.buckets: Dict[str, List[float]] = {}
+        self.allowed = 0
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 or any(rate > 0 for rate, _ in self.overrides.values())
+
+    def quota(self, key: str) -> Tuple[float, float]:
+        return self.overrides.get(key, (self.rate, self.burst))
+
+    def _prune(self, now: float):
+        # Buckets idle long enough to be full again carry no information
+        for key in [k for k, (tokens, updated) in self.buckets.items()
+                    if tokens + (now - updated) * self.quota(k)[0] >= self.quota(k)[1]]:
+            del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            # Still too many active keys: evict the least recently used tenth, keeping busy (limited) keys
+            by_use = sorted(self.buckets, key=lambda k: self.buckets[k][1])
+            for key in by_use[:max(1, len(by_use) // 10)]:
+                del self.buckets[key]
+
+    def check(self, key: str, now: Optional[float] = None) -> float:
+        """Take a token for `key`; returns 0 if allowed, else the seconds until one is available."""
+        now = now or time.monotonic()
+        rate, burst = self.quota(key)
+        if rate <= 0:
+            self.allowed += 1
+            return 0.0
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self.buckets[key] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed += 1
+            return 0.0
+        self.limited += 1
+        return (1 - bucket[0]) / rate
+
+
+class IngestRateLimiter:
+    """Per-project and per-IP buckets for /api/track, with dropped-event counters."""
+
+    def __init__(self, project: TokenBucketLimiter, ip: TokenBucketLimiter, max_tracked_projects: int = 10000):
+        self.project = project
+        self.ip = ip
+        self.max_tracked_projects = max_tracked_projects
+        self.dropped: Dict[str, int] = {}
+
+    def check(self, project_id: str, ip_key: Optional[str]) -> Optional[Tuple[str, int]]:
+        """None if the event may proceed, else (limit name, Retry-After seconds)."""
+        for name, limiter, key in (('ip', self.ip, ip_key), ('project', self.project, project_id)):
+            if not limiter.enabled or key is None:
+                continue
+            wait = limiter.check(key)
+            if wait:
+                if project_id in self.dropped or len(self.dropped) < self.max_tracked_projects:
+                    self.dropped[project_id] = self.dropped.get(project_id, 0) + 1
+                return name, max(1, math.ceil(min(wait, 3600)))
+        return None
+
+    def stats(self, top_n: int = 10) -> Dict:
+        return {
+            "project": {"rate": self.project.rate, "burst": self.project.burst,
+                        "allowed": self.project.allowed, "limited": self.project.limited},
+            "ip": {"rate": self.ip.rate, "burst": self.ip.burst,
+                   "allowed": self.ip.allowed, "limited": self.ip.limited},
+            "dropped_total": sum(self.dropped.values()),
+            "dropped_by_project": dict(sorted(self.dropped.items(), key=lambda x: x[1], reverse=True)[:top_n]),
+        }
@@ -0,0 +1,289 @@
+"""
+Real-time counters and live stream.
+
+`track_event` feeds every stored event into a `CounterStore`: per project, a
+ring of per-second buckets (events, pageviews) and a ring of per-minute
+buckets (events, pageviews, a HyperLogLog sketch of session ids and a capped
+top-pages table). Memory per project is bounded by the ring sizes, and
+projects that stop sending events are evicted.
+
+The `LiveHub` computes a single snapshot per watched project once per tick,
+serializes it once and fans the same payload out to every subscriber queue,
+so a worker can hold thousands of open dashboards.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class HyperLogLog:
+    """Fixed-size distinct counter (2**precision one-byte registers, ~1.04/sqrt(m) error)."""
+
+    def __init__(self, precision: int = 10):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add(self, value: str):
+        h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+        idx = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+
+class TopPages:
+    """Approximate heavy hitters: keeps at most 2*capacity urls, pruned back to the top `capacity`."""
+
+    def __init__(self, capacity: int = 50):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+
+    def add(self, url: str):
+        counts = self.counts
+        counts[url] = counts.get(url, 0) + 1
+        if len(counts) > 2 * self.capacity:
+            self.counts = dict(sorted(counts.items(), key=lambda x: x[1], reverse=True)[:self.capacity])
+
+
+class ProjectCounters:
+    """Per-second and per-minute ring buffers for one project."""
+
+    def __init__(self, seconds: int = 300, minutes: int = 60, sketch_precision: int = 10, top_pages: int = 50):
+        self.sketch_precision = sketch_precision
+        self.top_pages_capacity = top_pages
+        self.sec_keys = [-1] * seconds
+        self.sec_events = [0] * seconds
+        self.sec_pageviews = [0] * seconds
+        self.min_keys = [-1] * minutes
+        self.min_events = [0] * minutes
+        self.min_pageviews = [0] * minutes
+        self.min_sessions: List[Optional[HyperLogLog]] = [None] * minutes
+        self.min_pages: List[Optional[TopPages]] = [None] * minutes
+        self.last_seen = 0.0
+
+    def add(self, now: float, session_id: str, is_pageview: bool, page_url: Optional[str]):
+        self.last_seen = now
+        second = int(now)
+        i = second % len(self.sec_keys)
+        if self.sec_keys[i] != second:
+            self.sec_keys[i] = second
+            self.sec_events[i] = 0
+            self.sec_pageviews[i] = 0
+        self.sec_events[i] += 1
+
+        minute = second // 60
+        j = minute % len(self.min_keys)
+        if self.min_keys[j] != minute:
+            self.min_keys[j] = minute
+            self.min_events[j] = 0
+            self.min_pageviews[j] = 0
+            self.min_sessions[j] = HyperLogLog(self.sketch_precision)
+            self.min_pages[j] = TopPages(self.top_pages_capacity)
+        self.min_events[j] += 1
+        self.min_sessions[j].add(session_id)
+
+        if is_pageview:
+            self.sec_pageviews[i] += 1
+            self.min_pageviews[j] += 1
+            if page_url:
+                self.min_pages[j].add(page_url)
+
+    def per_second(self, now: int, seconds: int) -> List[Dict[str, int]]:
+        """Oldest-first (events, pageviews) for the `seconds` seconds ending at `now`."""
+        seconds = min(seconds, len(self.sec_keys))
+        out = []
+        for second in range(now - seconds + 1, now + 1):
+            i = second % len(self.sec_keys)
+            if self.sec_keys[i] == second:
+                out.append({"events": self.sec_events[i], "pageviews": self.sec_pageviews[i]})
+            else:
+                out.append({"events": 0, "pageviews": 0})
+        return out
+
+    def summary(self, now: int, minutes: int, top_n: int = 5) -> Dict[str, Any]:
+        """Totals over the last `minutes` minutes (the current partial minute included)."""
+        minutes = min(minutes, len(self.min_keys))
+        current = now // 60
+        sessions = HyperLogLog(self.sketch_precision)
+        pages: Dict[str, int] = {}
+        events = pageviews = 0
+        per_minute = []
+        for minute in range(current - minutes + 1, current + 1):
+            j = minute % len(self.min_keys)
+            if self.min_keys[j] != minute:
+                per_minute.append({"minute": minute * 60, "events": 0, "pageviews": 0})
+                continue
+            events += self.min_events[j]
+            pageviews += self.min_pageviews[j]
+            sessions.merge(self.min_sessions[j])
+            for url, cnt in self.min_pages[j].counts.items():
+                pages[url] = pages.get(url, 0) + cnt
+            per_minute.append({"minute": minute * 60, "events": self.min_events[j],
+                               "pageviews": self.min_pageviews[j]})
+        return {
+            "minutes": minutes,
+            "events": events,
+            "pageviews": pageviews,
+            "unique_sessions": sessions.count(),
+            "top_pages": [{"url": url, "views": cnt}
+                          for url, cnt in sorted(pages.items(), key=lambda x: x[1], reverse=True)[:top_n]],
+            "per_minute": per_minute,
+        }
+
+
+class CounterStore:
+    """ProjectCounters for every active project, with idle / LRU eviction."""
+
+    def __init__(self, seconds: int = 300, minutes: int = 60, max_projects: int = 10000,
+                 idle_seconds: Optional[float] = None):
+        self.seconds = seconds
+        self.minutes = minutes
+        self.max_projects = max_projects
+        # Nothing in the rings is readable after `minutes` of silence
+        self.idle_seconds = idle_seconds if idle_seconds is not None else minutes * 60
+        self.projects: "OrderedDict[str, ProjectCounters]" = OrderedDict()
+        self.evicted = 0
+
+    def add(self, project_id: str, session_id: str, is_pageview: bool, page_url: Optional[str],
+            now: Optional[float] = None):
+        counters = self.projects.get(project_id)
+        if counters is None:
+            counters = self.projects[project_id] = ProjectCounters(self.seconds, self.minutes)
+            if len(self.projects) > self.max_projects:
+                self.projects.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.projects.move_to_end(project_id)
+        counters.add(now or time.time(), session_id, is_pageview, page_url)
+
+    def get(self, project_id: str) -> ProjectCounters:
+        return self.projects.get(project_id) or ProjectCounters(self.seconds, self.minutes)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        cutoff = (now or time.time()) - self.idle_seconds
+        evicted = 0
+        # Least recently updated projects are at the front
+        while self.projects:
+            project_id, counters = next(iter(self.projects.items()))
+            if counters.last_seen >= cutoff:
+                break
+            del self.projects[project_id]
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    def realtime(self, project_id: str, minutes: int, now: Optional[float] = None) -> Dict[str, Any]:
+        now = int(now or time.time())
+        summary = self.get(project_id).summary(now, minutes)
+        summary["timestamp"] = now
+        return summary
+
+
+class LiveHub:
+    def __init__(self, counters: CounterStore, window_seconds: int = 300, tick_seconds: float = 1.0,
+                 series_seconds: int = 60):
+        self.counters = counters
+        self.window_seconds = window_seconds
+        self.tick_seconds = tick_seconds
+        self.series_seconds = series_seconds
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    def publish(self, event: Dict[str, Any]):
+        """Record a stored event; O(1), called from track_event."""
+        self.counters.add(event['project_id'], event['session_id'], event['event_type'] == 'pageview',
+                          event.get('page_url'))
+
+    def publish_many(self, events: List[Dict[str, Any]]):
+        """Record a batch of stored events (one 'tracked-events' message per stored batch)."""
+        for event in events:
+            self.publish(event)
+
+    def snapshot(self, project_id: str) -> Dict[str, Any]:
+        now = int(time.time())
+        counters = self.counters.get(project_id)
+        window = counters.summary(now, max(1, self.window_seconds // 60))
+        return {
+            "timestamp": now,
+            "window_seconds": self.window_seconds,
+            "active_sessions": window["unique_sessions"],
+            "events": window["events"],
+            "pageviews": window["pageviews"],
+            "pageviews_per_second": [b["pageviews"] for b in counters.per_second(now, self.series_seconds)],
+            "top_pages": window["top_pages"],
+        }
+
+    def subscribe(self, project_id: str) -> asyncio.Queue:
+        # Only the latest snapshot matters, so a slow client never builds a backlog
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        queue.put_nowait(json.dumps(self.snapshot(project_id)))
+        self.subscribers.setdefault(project_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, project_id: str, queue: asyncio.Queue):
+        subs = self.subscribers.get(project_id)
+        if subs is not None:
+            subs.discard(queue)
+            if not subs:
+                del self.subscribers[project_id]
+
+    def connection_count(self) -> int:
+        return sum(len(subs) for subs in self.subscribers.values())
+
+    def broadcast(self):
+        for project_id, subs in list(self.subscribers.items()):
+            payload = json.dumps(self.snapshot(project_id))
+            for queue in list(subs):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(payload)
+
+    async def run(self, evict_every: int = 60):
+        ticks = 0
+        while True:
+            try:
+                self.broadcast()
+                ticks += 1
+                if ticks % evict_every == 0:
+                    self.counters.evict_idle()
+            except Exception as e:
+                logger.error(f"[LIVE] Broadcast failed: {e}")
+            await asyncio.sleep(self.tick_seconds)
+
+
+async def sse_stream(hub: LiveHub, project_id: str, request, keepalive_seconds: float = 15.0):
+    """Server-Sent Events generator for one dashboard connection."""
+    queue = hub.subscribe(project_id)
+    try:
+        while True:
+            if await request.is_disconnected():
+                break
+            try:
+                payload = await asyncio.wait_for(queue.get(), timeout=keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: live\ndata: {payload}\n\n"
+    finally:
+        hub.unsubscribe(project_id, queue)
@@ -0,0 +1,238 @@
+"""
+Columnar analytics engine over sealed Parquet segments.
+
+Events of completed days are periodically compacted into one Parquet file
+per project and day:
+
+    <SEGMENTS_DIR>/<project_id>/date=YYYY-MM-DD/events.parquet
+
+Overview / NLQ count tables are then computed with vectorized pyarrow
+group-by counts over the sealed segments, and only the unsealed tail of the
+range (today, or any day not compacted yet) is read from the event store.
+A day without events is sealed with an empty marker file instead of a
+Parquet file. A day is only sealed once `seal_delay` has passed and no
+event acked before its end is still waiting to be stored.
+Requires pyarrow; without it the engine reports itself unavailable and the
+API keeps aggregating raw events.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import json
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aggregation import aggregate_events, aggregate_totals, classify_browser, classify_device, empty_counts, merge_counts
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_COLUMNS = [
+    'id', 'session_id', 'event_type', 'event_name', 'page_url', 'page_title', 'referrer',
+    'user_agent', 'country', 'continent', 'ip_hash', 'properties', 'timestamp',
+]
+SEGMENT_SCHEMA = pa.schema([(name, pa.string()) for name in SEGMENT_COLUMNS]) if pa is not None else None
+
+
+def _segment_row(event: Dict[str, Any]) -> Dict[str, Any]:
+    row = {name: event.get(name) for name in SEGMENT_COLUMNS}
+    if row['properties'] is not None:
+        row['properties'] = json.dumps(row['properties'])
+    return row
+
+
+def _value_counts(arr) -> Dict[str, int]:
+    counts = {}
+    for item in pc.value_counts(arr).to_pylist():
+        counts[item['values']] = item['counts']
+    return counts
+
+
+def _relabel(counts: Dict[Any, int], missing: str) -> Dict[str, int]:
+    """Fold null / empty keys into a single `missing` label."""
+    out: Dict[str, int] = {}
+    for key, cnt in counts.items():
+        key = key or missing
+        out[key] = out.get(key, 0) + cnt
+    return out
+
+
+def _classified(counts: Dict[Any, int], classify) -> Dict[str, int]:
+    """Classify distinct values once instead of once per event."""
+    out: Dict[str, int] = {}
+    for key, cnt in counts.items():
+        label = classify(key)
+        out[label] = out.get(label, 0) + cnt
+    return out
+
+
+class SegmentEngine:
+    def __init__(self, repo, root: Path, retention_days: int = 180, seal_delay: timedelta = timedelta(hours=1),
+                 pending_since: Optional[Callable[[], Optional[datetime]]] = None):
+        self.repo = repo
+        self.root = Path(root)
+        self.retention_days = retention_days
+        self.seal_delay = seal_delay
+        # Timestamp of the oldest acked event not stored yet (None when nothing is pending)
+        self.pending_since = pending_since
+
+    @property
+    def available(self) -> bool:
+        return pa is not None
+
+    # ---------- layout ----------
+
+    def segment_path(self, project_id: str, day: date) -> Path:
+        return self.root / project_id / f"date={day.isoformat()}" / "events.parquet"
+
+    def empty_marker(self, project_id: str, day: date) -> Path:
+        return self.root / project_id / f"date={day.isoformat()}" / "empty"
+
+    def is_sealed(self, project_id: str, day: date) -> bool:
+        return self.segment_path(project_id, day).exists() or self.empty_marker(project_id, day).exists()
+
+    def seal_boundary(self, now: Optional[datetime] = None) -> date:
+        """First day that may still receive events (everything before it can be sealed)."""
+        settled = (now or datetime.now(timezone.utc)) - self.seal_delay
+        pending = self.pending_since() if self.pending_since is not None else None
+        if pending is not None:
+            settled = min(settled, pending)
+        return settled.date()
+
+    def drop_project(self, project_id: str):
+        shutil.rmtree(self.root / project_id, ignore_errors=True)
+
+    # ---------- compaction ----------
+
+    def _write_segment(self, project_id: str, day: date, events: List[Dict[str, Any]]) -> int:
+        if not events:
+            marker = self.empty_marker(project_id, day)
+            marker.parent.mkdir(parents=True, exist_ok=True)
+            marker.touch()
+            return 0
+        path = self.segment_path(project_id, day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rows = sorted((_segment_row(e) for e in events), key=lambda r: r['timestamp'])
+        table = pa.Table.from_pylist(rows, schema=SEGMENT_SCHEMA)
+        tmp_path = path.with_suffix('.parquet.tmp')
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+        return len(rows)
+
+    async def _load_day(self, project_id: str, day: date) -> List[Dict[str, Any]]:
+        # Hour by hour, letting requests in between: a synchronous store (sqlite) reading a whole day
+        # in one call would stall every request meanwhile
+        start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        events: List[Dict[str, Any]] = []
+        for hour in range(24):
+            events.extend(await self.repo.events.find_range(project_id, start + timedelta(hours=hour),
+                                                            start + timedelta(hours=hour + 1), limit=None))
+            await asyncio.sleep(0)
+        return events
+
+    async def compact_day(self, project_id: str, day: date) -> int:
+        events = await self._load_day(project_id, day)
+        return await asyncio.to_thread(self._write_segment, project_id, day, events)
+
+    async def compact_project(self, project_id: str, now: Optional[datetime] = None) -> int:
+        boundary = self.seal_boundary(now)
+        day = boundary - timedelta(days=self.retention_days)
+        sealed = 0
+        while day < boundary:
+            if not self.is_sealed(project_id, day):
+                rows = await self.compact_day(project_id, day)
+                sealed += 1
+                logger.info(f"[SEGMENTS] Sealed {project_id} {day} ({rows} events)")
+            day += timedelta(days=1)
+        return sealed
+
+    async def compact_all(self) -> int:
+        sealed = 0
+        for project_id in await self.repo.projects.list_ids():
+            sealed += await self.compact_project(project_id)
+        return sealed
+
+    async def run_periodically(self, interval_seconds: float):
+        while True:
+            try:
+                await self.compact_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[SEGMENTS] Compaction failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    # ---------- queries ----------
+
+    def _coverage(self, project_id: str, start: datetime, end: Optional[datetime]) -> Tuple[List[Path], datetime]:
+        """
+        Sealed files covering a contiguous prefix of [start, end) and the
+        datetime from which the event store has to be read instead.
+        """
+        files = []
+        day = start.date()
+        last_day = self.seal_boundary()
+        if end is not None:
+            last_day = min(last_day, (end - timedelta(microseconds=1)).date() + timedelta(days=1))
+        while day < last_day and self.is_sealed(project_id, day):
+            path = self.segment_path(project_id, day)
+            if path.exists():
+                files.append(path)
+            day += timedelta(days=1)
+        if day == start.date():
+            return files, start
+        return files, max(start, datetime.combine(day, time.min, tzinfo=timezone.utc))
+
+    def _scan(self, files: List[Path], start: datetime, end: datetime, totals_only: bool) -> Dict[str, Any]:
+        dataset = ds.dataset([str(f) for f in files], schema=SEGMENT_SCHEMA, format='parquet')
+        flt = (ds.field('timestamp') >= start.isoformat()) & (ds.field('timestamp') < end.isoformat())
+        columns = ['session_id', 'event_type'] if totals_only else [
+            'session_id', 'event_type', 'page_url', 'referrer', 'user_agent', 'country', 'continent', 'timestamp',
+        ]
+        table = dataset.to_table(columns=columns, filter=flt)
+
+        counts = empty_counts()
+        counts['total_events'] = table.num_rows
+        counts['sessions'] = set(pc.unique(table['session_id']).to_pylist())
+        pageviews = table.filter(pc.equal(table['event_type'], 'pageview'))
+        counts['total_pageviews'] = pageviews.num_rows
+        if totals_only:
+            return counts
+
+        counts['daily'] = _value_counts(pc.utf8_slice_codeunits(table['timestamp'], 0, 10))
+        user_agents = table['user_agent'].filter(pc.not_equal(table['user_agent'], ''))
+        counts['browsers'] = _classified(_value_counts(user_agents), classify_browser)
+
+        page_urls = pageviews['page_url'].filter(pc.not_equal(pageviews['page_url'], ''))
+        counts['page_counts'] = _value_counts(page_urls)
+        counts['referrers'] = _relabel(_value_counts(pageviews['referrer']), 'Direct')
+        continents = pageviews['continent'].filter(pc.not_equal(pageviews['continent'], ''))
+        counts['continents'] = _value_counts(continents)
+        counts['devices'] = _classified(_value_counts(pageviews['user_agent']), classify_device)
+        counts['countries'] = _relabel(_value_counts(pageviews['country']), 'Unknown')
+        return counts
+
+    async def counts(self, project_id: str, start: datetime, end: Optional[datetime] = None,
+                     totals_only: bool = False) -> Dict[str, Any]:
+        """Count tables for [start, end): sealed segments plus the unsealed tail from the event store."""
+        end_or_now = end or datetime.now(timezone.utc)
+        files, tail_start = self._coverage(project_id, start, end)
+
+        sealed = empty_counts()
+        if files:
+            sealed = await asyncio.to_thread(self._scan, files, start, min(end_or_now, tail_start), totals_only)
+
+        if end is not None and tail_start >= end:
+            return sealed
+        tail = await self.repo.events.find_range(project_id, tail_start, end, limit=None)
+        tail_counts = aggregate_totals(tail) if totals_only else aggregate_events(tail)
+        return merge_counts(sealed, tail_counts)
@@ -1,9 +1,8 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request
-from fastapi.responses import StreamingResponse
-from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
@@ -11,48 +10,221 @@ from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
 import hashlib
+import hmac
 import jwt
 import json
 import csv
 import io
-import re
+from contextlib import asynccontextmanager
+from storage import create_repository
+from aggregation import aggregate_events, aggregate_totals, build_overview, merge_many, percent_change, top_items
+from cache import BucketCache, ProjectDirectory, ResponseCache
+from shared_state import create_shared_state
+from realtime import CounterStore, LiveHub, sse_stream
+from enrichment import (EnrichmentPipeline, hash_ip, open_geoip_reader, open_ip_index, set_geoip_reader, set_ip_index,
+                        set_url_canonicalizer)
+from urls import DEFAULT_STRIP_PARAMS, UrlCanonicalizer
+from compact import DictionaryCache
+from funnels import Funnel, StepPredicate
+from cohorts import CohortEngine
+from properties import PropertyAnalytics
+from timebuckets import CalendarCounts, resolve_range, resolve_timezone
+from wal import WriteAheadLog, WalShipper
+from bots import BOT_POLICIES, BotFilter
+from ratelimit import IngestRateLimiter, TokenBucketLimiter, client_address, parse_networks
+from metrics import Metrics, MetricsMiddleware, mongo_listeners
+from profiling import Profiler, ProfilingMiddleware
+from warmup import WarmUp
 try:
-    import geoip2.database
+    from columnar import aggregate_columnar
 except Exception:
-    geoip2 = None
+    aggregate_columnar = None
 
 ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+if (ROOT_DIR / '.env').exists():
+    from dotenv import load_dotenv
+    load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGODB_URI']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Initialize logger
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
 logger = logging.getLogger(__name__)
 
-# Initialize GeoIP reader if DB available
+# Request / stage latency histograms and counters, scraped from /metrics (METRICS_TOKEN: bearer token required)
+metrics = Metrics()
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Storage backend: 'mongo' (MongoDB via Motor) or 'sqlite' (embedded, for tests / small deployments)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+if STORAGE_BACKEND == 'mongo':
+    repo = create_repository(
+        'mongo',
+        mongo_url=os.environ['MONGODB_URI'],
+        db_name=os.environ['DB_NAME'],
+        # Event storage: 'standard' (regular collection) or 'timeseries' (MongoDB time-series collection)
+        events_mode=os.environ.get('EVENTS_STORAGE_MODE', 'standard'),
+        events_collection=os.environ.get('EVENTS_COLLECTION') or None,
+        # Event encoding: 'full' (documents as built) or 'compact' (short keys, interned strings)
+        events_encoding=os.environ.get('EVENTS_ENCODING', 'full'),
+        event_listeners=mongo_listeners(metrics),
+    )
+else:
+    repo = create_repository(STORAGE_BACKEND, sqlite_path=os.environ.get('SQLITE_PATH', str(ROOT_DIR / 'analytics.db')),
+                             events_encoding=os.environ.get('EVENTS_ENCODING', 'full'))
+
+# Analytics engine: 'events' (aggregate raw events) or 'segments' (columnar Parquet segments, needs pyarrow)
+ANALYTICS_ENGINE = os.environ.get('ANALYTICS_ENGINE', 'events')
+segment_engine = None
+if ANALYTICS_ENGINE == 'segments':
+    from segments import SegmentEngine
+    segment_engine = SegmentEngine(
+        repo,
+        Path(os.environ.get('SEGMENTS_DIR', str(ROOT_DIR / 'segments'))),
+        retention_days=int(os.environ.get('SEGMENT_RETENTION_DAYS', '180')),
+    )
+    if not segment_engine.available:
+        logger.warning("⚠ ANALYTICS_ENGINE=segments requires pyarrow; falling back to raw event aggregation")
+        segment_engine = None
+SEGMENT_COMPACT_INTERVAL = float(os.environ.get('SEGMENT_COMPACT_INTERVAL', '3600'))
+
+# Raw event aggregation: 'numpy' (vectorized, dictionary-encoded columns) or 'python' (reference loop)
+OVERVIEW_AGGREGATION = os.environ.get('OVERVIEW_AGGREGATION', 'numpy')
+if OVERVIEW_AGGREGATION == 'numpy' and aggregate_columnar is not None:
+    aggregate_overview_events = aggregate_columnar
+else:
+    aggregate_overview_events = aggregate_events
+
+# State shared by all workers: memory:// (single process) or redis://...
+shared_state = create_shared_state(os.environ.get('SHARED_STATE_URL'))
+
+# Overview result cache (ETag / conditional GET), invalidated by track_event
+response_cache = ResponseCache(
+    shared_state,
+    max_entries=int(os.environ.get('RESPONSE_CACHE_ENTRIES', '1024')),
+    bucket_seconds=int(os.environ.get('RESPONSE_CACHE_BUCKET_SECONDS', '60')),
+)
+
+# Tenant -> projects map for project lists and ownership checks, invalidated on project create / delete
+# (bypassed when WEB_CONCURRENCY > 1 without SHARED_STATE_URL: invalidations would not reach the other workers)
+project_directory = ProjectDirectory(repo.projects, shared_state,
+                                     max_projects=int(os.environ.get('TENANT_MAX_PROJECTS', '1000')),
+                                     workers=int(os.environ.get('WEB_CONCURRENCY', '1')))
+
+# Count tables of completed calendar buckets (hour / day / week / month in the project's timezone),
+# immutable once BUCKET_SETTLE_SECONDS have passed after the bucket's end
+bucket_cache = BucketCache(shared_state, max_entries=int(os.environ.get('BUCKET_CACHE_ENTRIES', '4096')))
+BUCKET_SETTLE_SECONDS = int(os.environ.get('BUCKET_SETTLE_SECONDS', '300'))
+
+# Real-time counters ("last N minutes") and live dashboards, both fed by track_event
+realtime_counters = CounterStore(
+    seconds=int(os.environ.get('REALTIME_SECONDS', '300')),
+    minutes=int(os.environ.get('REALTIME_MINUTES', '60')),
+    max_projects=int(os.environ.get('REALTIME_MAX_PROJECTS', '10000')),
+)
+live_hub = LiveHub(
+    realtime_counters,
+    window_seconds=int(os.environ.get('LIVE_WINDOW_SECONDS', '300')),
+    tick_seconds=float(os.environ.get('LIVE_TICK_SECONDS', '1')),
+)
+# Every worker sees every tracked event, whichever worker stored it
+def on_tracked_events(message: str):
+    events = json.loads(message)
+    # A list per stored batch; a single event from workers still running the previous release
+    live_hub.publish_many(events if isinstance(events, list) else [events])
+
+
+shared_state.subscribe('tracked-events', on_tracked_events)
+
+# Ingest-time bot filtering; BOT_POLICY is the default for projects without their own bot_policy
+bot_filter = BotFilter(
+    default_policy=os.environ.get('BOT_POLICY', 'tag'),
+    max_events_per_ip=int(os.environ.get('BOT_MAX_EVENTS_PER_IP', '120')),
+    window_seconds=float(os.environ.get('BOT_RATE_WINDOW_SECONDS', '60')),
+)
+
+# Ingest rate limits (token buckets, events/second and burst size; a rate of 0 disables the limit).
+# RATE_LIMIT_PROJECT_OVERRIDES: JSON {"<project_id>": [rate, burst]} for projects with their own quota
+rate_limiter = IngestRateLimiter(
+    project=TokenBucketLimiter(
+        float(os.environ.get('RATE_LIMIT_PROJECT_RPS', '200')),
+        float(os.environ.get('RATE_LIMIT_PROJECT_BURST', '1000')),
+        overrides={pid: tuple(q) for pid, q in json.loads(os.environ.get('RATE_LIMIT_PROJECT_OVERRIDES') or '{}').items()},
+    ),
+    ip=TokenBucketLimiter(
+        float(os.environ.get('RATE_LIMIT_IP_RPS', '20')),
+        float(os.environ.get('RATE_LIMIT_IP_BURST', '100')),
+    ),
+)
+# Proxies (IPs / CIDRs) whose X-Forwarded-For is believed for the per-IP rate limit and bot heuristic
+TRUSTED_PROXIES = parse_networks(os.environ.get('TRUSTED_PROXIES', '').split(','))
+
+# Page URL canonicalization at ingest (tracking params, fragments, trailing slashes, host case)
+url_canonicalizer = None
+if os.environ.get('URL_CANONICALIZE', 'true').lower() in ('1', 'true', 'yes'):
+    url_canonicalizer = UrlCanonicalizer(
+        strip_params=os.environ['URL_STRIP_PARAMS'].split(',') if os.environ.get('URL_STRIP_PARAMS') else DEFAULT_STRIP_PARAMS,
+        keep_query=os.environ.get('URL_KEEP_QUERY', 'true').lower() in ('1', 'true', 'yes'),
+        keep_fragment=os.environ.get('URL_KEEP_FRAGMENT', 'false').lower() in ('1', 'true', 'yes'),
+    )
+set_url_canonicalizer(url_canonicalizer)
+
+# Per-project dictionaries: every stored event gets the small integer page_id of its canonical URL,
+# every visitor an id in the retention bitmaps
+dictionary_cache = getattr(repo.events, 'cache', None) or DictionaryCache(repo.dictionaries)
+
+# Retention cohorts: completed days are sealed into visitor bitmaps every COHORT_SEAL_INTERVAL seconds
+# (0: only when a retention query needs them)
+cohort_engine = CohortEngine(repo, dictionary_cache, retention_days=int(os.environ.get('COHORT_RETENTION_DAYS', '180')))
+COHORT_SEAL_INTERVAL = float(os.environ.get('COHORT_SEAL_INTERVAL', '3600'))
+
+# Custom event properties: schema discovered at ingest, partial indexes for keys seen on
+# PROPERTY_INDEX_THRESHOLD events (at most PROPERTY_MAX_INDEXES), rollups for declared numeric keys
+property_analytics = PropertyAnalytics(
+    repo,
+    index_threshold=int(os.environ.get('PROPERTY_INDEX_THRESHOLD', '10000')),
+    max_indexes=int(os.environ.get('PROPERTY_MAX_INDEXES', '10')),
+    max_keys=int(os.environ.get('PROPERTY_MAX_KEYS', '500')),
+)
+
+# GeoIP reader if DB available, and the offline IP range index for addresses without GeoIP data
+# (see build_ip_ranges.py); both are opened by the warm-up, after the server has started
 GEOIP_DB = os.environ.get('GEOIP_DB_PATH', str(ROOT_DIR / 'GeoLite2-Country.mmdb'))
+IP_RANGES_PATH = os.environ.get('IP_RANGES_PATH', str(ROOT_DIR / 'ip_ranges.bin'))
 geoip_reader = None
-if 'geoip2' in globals() and geoip2 is not None:
-    try:
-        geoip_reader = geoip2.database.Reader(GEOIP_DB)
-        logger.info(f"✓ GeoIP reader initialized. DB: {GEOIP_DB}")
-    except Exception as e:
-        logger.error(f"✗ GeoIP init failed. DB: {GEOIP_DB}. Error: {e}")
-        geoip_reader = None
-else:
-    logger.warning("⚠ geoip2 not imported or available")
+ip_index = None
+
+# Slow startup work (storage schema / index checks, GeoIP and IP range data) runs in the background once
+# the server is up; /api/health/ready and /api/track answer 503 until it has finished
+warm_up = WarmUp(retry_seconds=float(os.environ.get('WARMUP_RETRY_SECONDS', '5')))
+TRACK_WARMUP_RETRY_AFTER = int(os.environ.get('TRACK_WARMUP_RETRY_AFTER', '1'))
+
+# Request profiling (admin endpoints, enabled by setting ADMIN_TOKEN): cProfile / sampled captures of
+# matching requests under PROFILE_DIR, plus always-on stack sampling at PROFILE_SAMPLE_HZ (0: off)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+profiler = Profiler(
+    Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles'))),
+    shared_state,
+    sample_hz=float(os.environ.get('PROFILE_SAMPLE_HZ', '0')),
+    capture_hz=float(os.environ.get('PROFILE_CAPTURE_HZ', '200')),
+    max_captures=int(os.environ.get('PROFILE_MAX_CAPTURES', '20')),
+)
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24 * 7  # 1 week
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_services()
+    try:
+        yield
+    finally:
+        await stop_services()
+
 # Create the main app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 # ==================== MODELS ====================
@@ -81,6 +253,8 @@ class Project(BaseModel):
     name: str
     domain: str
     tracking_code: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    bot_policy: Optional[str] = None  # drop, tag, route, allow (None: server default)
+    timezone: Optional[str] = None  # IANA name for calendar buckets (None: UTC)
     privacy_settings: Dict[str, Any] = Field(default_factory=lambda: {
         "anonymize_ip": True,
         "require_consent": True,
@@ -91,6 +265,8 @@ class Project(BaseModel):
 class ProjectCreate(BaseModel):
     name: str
     domain: str
+    bot_policy: Optional[str] = None
+    timezone: Optional[str] = None
 
 class Event(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -106,6 +282,8 @@ class Event(BaseModel):
     country: Optional[str] = None
     continent: Optional[str] = None
     ip_hash: Optional[str] = None
+    device_type: Optional[str] = None
+    page_id: Optional[int] = None
     properties: Optional[Dict[str, Any]] = None
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -127,6 +305,9 @@ class NLQRequest(BaseModel):
     project_id: str
     question: str
     date_range: Optional[str] = "7d"  # 7d, 30d, 90d, all
+    start: Optional[str] = None  # YYYY-MM-DD, overrides date_range
+    end: Optional[str] = None  # YYYY-MM-DD, inclusive
+    tz: Optional[str] = None
 
 class NLQResponse(BaseModel):
     question: str
@@ -134,6 +315,28 @@ class NLQResponse(BaseModel):
     data: Optional[Dict[str, Any]] = None
     insights: List[str] = Field(default_factory=list)
 
+class FunnelStep(BaseModel):
+    event_type: Optional[str] = None  # pageview, click, custom
+    event_name: Optional[str] = None
+    page: Optional[str] = None  # URL path (or full URL), trailing * for a prefix
+    label: Optional[str] = None
+
+class FunnelRequest(BaseModel):
+    steps: List[FunnelStep]
+    window_minutes: int = 60 * 24
+    days: int = 30
+
+class ProfileRequest(BaseModel):
+    mode: str = 'cprofile'  # cprofile or sampling
+    requests: int = 10
+    route: Optional[str] = None  # path glob, e.g. /api/analytics/*/overview
+    project_id: Optional[str] = None
+
+class PropertySettings(BaseModel):
+    index: bool = False
+    rollup: Optional[bool] = None  # daily sum / count rollups of a numeric property
+    rollup_by: Optional[List[str]] = None  # low-cardinality properties to break the rollups down by
+
 # ==================== AUTH UTILITIES ====================
 
 def hash_password(password: str) -> str:
@@ -163,12 +366,32 @@ def verify_token(authorization: str = Header(None)) -> dict:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail='Invalid token')
 
+def verify_admin(x_admin_token: str = Header(None)) -> bool:
+    """Admin endpoints only exist when ADMIN_TOKEN is set, and require it in X-Admin-Token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail='Not found')
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail='Invalid admin token')
+    return True
+
+def verify_metrics_token(authorization: str = Header(None)) -> bool:
+    """/metrics and /api/health/ingest require `Bearer <METRICS_TOKEN>` when METRICS_TOKEN is set."""
+    if METRICS_TOKEN and not (authorization and hmac.compare_digest(authorization, f'Bearer {METRICS_TOKEN}')):
+        raise HTTPException(status_code=401, detail='Missing or invalid authorization header')
+    return True
+
+def verify_token_or_query(authorization: str = Header(None), token: Optional[str] = None) -> dict:
+    """Like verify_token, but also accepts ?token= (EventSource cannot send headers)"""
+    if not authorization and token:
+        authorization = f'Bearer {token}'
+    return verify_token(authorization)
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register")
 async def register(input: TenantCreate):
     # Check if email exists
-    existing = await db.tenants.find_one({"email": input.email}, {"_id": 0})
+    existing = await repo.tenants.find_by_email(input.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -180,14 +403,14 @@ async def register(input: TenantCreate):
     
     doc = tenant.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    await db.tenants.insert_one(doc)
+    await repo.tenants.insert(doc)
     
     token = create_token(tenant.id, tenant.email)
     return {"token": token, "tenant": {"id": tenant.id, "name": tenant.name, "email": tenant.email}}
 
 @api_router.post("/auth/login")
 async def login(input: TenantLogin):
-    tenant_doc = await db.tenants.find_one({"email": input.email}, {"_id": 0})
+    tenant_doc = await repo.tenants.find_by_email(input.email)
     if not tenant_doc or not verify_password(input.password, tenant_doc['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
@@ -198,21 +421,31 @@ async def login(input: TenantLogin):
 
 @api_router.post("/projects", response_model=Project)
 async def create_project(input: ProjectCreate, user: dict = Depends(verify_token)):
+    if input.bot_policy is not None and input.bot_policy not in BOT_POLICIES:
+        raise HTTPException(status_code=400, detail=f"bot_policy must be one of {', '.join(BOT_POLICIES)}")
+    if input.timezone is not None:
+        try:
+            resolve_timezone(input.timezone)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     project = Project(
         tenant_id=user['tenant_id'],
         name=input.name,
-        domain=input.domain
+        domain=input.domain,
+        bot_policy=input.bot_policy,
+        timezone=input.timezone
     )
     
     doc = project.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    await db.projects.insert_one(doc)
+    await repo.projects.insert(doc)
+    await project_directory.invalidate(user['tenant_id'])
     
     return project
 
 @api_router.get("/projects", response_model=List[Project])
 async def get_projects(user: dict = Depends(verify_token)):
-    projects = await db.projects.find({"tenant_id": user['tenant_id']}, {"_id": 0}).to_list(100)
+    projects = [dict(p) for p in await project_directory.list(user['tenant_id'])]
     for p in projects:
         if isinstance(p['created_at'], str):
             p['created_at'] = datetime.fromisoformat(p['created_at'])
@@ -220,9 +453,10 @@ async def get_projects(user: dict = Depends(verify_token)):
 
 @api_router.get("/projects/{project_id}", response_model=Project)
 async def get_project(project_id: str, user: dict = Depends(verify_token)):
-    project = await db.projects.find_one({"id": project_id, "tenant_id": user['tenant_id']}, {"_id": 0})
+    project = await project_directory.find(project_id, user['tenant_id'])
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    project = dict(project)
     if isinstance(project['created_at'], str):
         project['created_at'] = datetime.fromisoformat(project['created_at'])
     return project
@@ -234,18 +468,30 @@ async def delete_project(project_id: str, user: dict = Depends(verify_token)):
     Delete a project and its associated data (events). Requires tenant ownership.
     """
     # Verify project exists and belongs to tenant
-    project = await db.projects.find_one({"id": project_id, "tenant_id": user['tenant_id']}, {"_id": 0})
+    project = await repo.projects.find(project_id, user['tenant_id'])
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
     # Delete project document
-    result = await db.projects.delete_one({"id": project_id, "tenant_id": user['tenant_id']})
-    if result.deleted_count == 0:
+    deleted_count = await repo.projects.delete(project_id, user['tenant_id'])
+    if deleted_count == 0:
         raise HTTPException(status_code=500, detail="Failed to delete project")
+    await project_directory.invalidate(user['tenant_id'])
 
     # Delete related events and other associated data if any
     try:
-        await db.events.delete_many({"project_id": project_id})
+        await repo.events.delete_project(project_id)
+        await repo.bot_events.delete_project(project_id)
+        await repo.dictionaries.delete_project(project_id)
+        dictionary_cache.drop_project(project_id)
+        await repo.rollups.delete_project(project_id)
+        await repo.bitmaps.delete_project(project_id)
+        await repo.properties.delete_project(project_id)
+        property_analytics.drop_project(project_id)
+        if segment_engine is not None:
+            segment_engine.drop_project(project_id)
+        await response_cache.drop_project(project_id)
+        bucket_cache.drop_project(project_id)
     except Exception:
         # Log and continue; don't fail the request if cleanup partially fails
         pass
@@ -254,21 +500,92 @@ async def delete_project(project_id: str, user: dict = Depends(verify_token)):
 
 # ==================== TRACKING ROUTES ====================
 
+async def store_events(docs: List[Dict[str, Any]]):
+    """Bulk-write enriched events, then invalidate caches and feed the live counters."""
+    with_pages: Dict[str, List[Dict[str, Any]]] = {}
+    for doc in docs:
+        if doc.get('page_url'):
+            with_pages.setdefault(doc['project_id'], []).append(doc)
+    with metrics.span('ingest.page_ids'):
+        for project_id, page_docs in with_pages.items():
+            page_ids = await dictionary_cache.ids(project_id, 'page', {doc['page_url'] for doc in page_docs})
+            for doc in page_docs:
+                doc['page_id'] = page_ids[doc['page_url']]
+    routed = []
+    kept = []
+    for doc in docs:
+        (routed if doc.pop('_route_bot', False) else kept).append(doc)
+    if routed:
+        await repo.bot_events.insert_many(routed)
+    with metrics.span('ingest.insert'):
+        # Only events not stored before: a replayed or retried batch is not counted twice
+        docs = await repo.events.insert_many(kept)
+    # The events are stored: from here on failures are logged, not raised, since raising
+    # would make the write-ahead log / enrichment retry the batch
+    try:
+        with metrics.span('ingest.properties'):
+            await property_analytics.observe(docs)
+    except Exception as e:
+        logger.error(f"[INGEST] Property schema / rollup update failed for {len(docs)} events: {e}")
+    try:
+        with metrics.span('ingest.publish'):
+            for project_id in {doc['project_id'] for doc in docs}:
+                await response_cache.bump(project_id)
+            # One message per batch: a per-event publish is a Redis round trip per event
+            live = [{
+                "project_id": doc['project_id'],
+                "session_id": doc['session_id'],
+                "event_type": doc['event_type'],
+                "page_url": doc.get('page_url'),
+            } for doc in docs if not doc.get('is_bot')]
+            if live:
+                await shared_state.publish('tracked-events', json.dumps(live))
+    except Exception as e:
+        logger.error(f"[INGEST] Cache invalidation / live publish failed for {len(docs)} events: {e}")
+
+# Enrichment: 'inline' (inside the request), 'thread' or 'process' (batched in an executor, acked on enqueue)
+enrichment = EnrichmentPipeline(
+    os.environ.get('ENRICHMENT_MODE', 'thread'),
+    store_events,
+    batch_size=int(os.environ.get('ENRICHMENT_BATCH_SIZE', '500')),
+    max_delay=float(os.environ.get('ENRICHMENT_MAX_DELAY', '0.05')),
+    max_queue=int(os.environ.get('ENRICHMENT_MAX_QUEUE', '100000')),
+    workers=int(os.environ['ENRICHMENT_WORKERS']) if os.environ.get('ENRICHMENT_WORKERS') else None,
+    geoip_path=GEOIP_DB,
+    canonicalizer=url_canonicalizer,
+    ip_ranges_path=IP_RANGES_PATH if os.path.exists(IP_RANGES_PATH) else None,
+    metrics=metrics,
+    max_attempts=int(os.environ.get('ENRICHMENT_MAX_ATTEMPTS', '5')),
+)
+
+async def ship_events(raws: List[Dict[str, Any]]):
+    await store_events(await enrichment.enrich(raws))
+
+# Ingest write-ahead log: events are acked once on local disk and shipped to storage in the background
+# (each worker process claims its own log under INGEST_WAL_DIR and ships the logs of workers that are gone)
+ingest_wal = None
+wal_shipper = None
+if os.environ.get('INGEST_WAL', 'false').lower() in ('1', 'true', 'yes'):
+    ingest_wal = WriteAheadLog(
+        Path(os.environ.get('INGEST_WAL_DIR', str(ROOT_DIR / 'wal'))),
+        segment_bytes=int(os.environ.get('INGEST_WAL_SEGMENT_BYTES', str(64 * 1024 * 1024))),
+        flush_interval=float(os.environ.get('INGEST_WAL_FLUSH_INTERVAL', '0.005')),
+    )
+    wal_shipper = WalShipper(
+        ingest_wal,
+        ship_events,
+        batch_size=int(os.environ.get('INGEST_WAL_SHIP_BATCH', '1000')),
+        max_backoff=float(os.environ.get('INGEST_WAL_MAX_BACKOFF', '30')),
+        lag_warning_seconds=float(os.environ.get('INGEST_WAL_LAG_WARNING_SECONDS', '60')),
+        disk_warning_bytes=int(os.environ.get('INGEST_WAL_DISK_WARNING_BYTES', str(1024 ** 3))),
+    )
+
 @api_router.post("/track")
 async def track_event(event_input: EventCreate, request: Request):
-    # Verify tracking code
-    project = await db.projects.find_one(
-        {"id": event_input.project_id, "tracking_code": event_input.tracking_code},
-        {"_id": 0}
-    )
-    if not project:
-        raise HTTPException(status_code=403, detail="Invalid project or tracking code")
-    
-    # Privacy checks
-    privacy_settings = project.get('privacy_settings', {})
-    if privacy_settings.get('require_consent', True) and not event_input.consent_given:
-        return {"status": "consent_required"}
-    
+    # Events stored before warm-up would miss the unique id indexes and the GeoIP / IP range data for good
+    if not warm_up.ready:
+        raise HTTPException(status_code=503, detail="Warming up", headers={"Retry-After": str(TRACK_WARMUP_RETRY_AFTER)})
+
     # Determine client IP: prefer provided ip_address, else try headers / connection
     client_ip = None
     if event_input.ip_address:
@@ -285,84 +602,41 @@ async def track_event(event_input: EventCreate, request: Request):
             except Exception:
                 client_ip = None
 
-    logger.info(f"[TRACK] Detected client_ip: {client_ip}, geoip_reader: {geoip_reader is not None}")
+    # Rate limits (per IP hash and per project), before any database work. The IP key is the connection's
+    # address (or a trusted proxy's X-Forwarded-For), not the spoofable ip_address / header used for geo
+    with metrics.span('track.rate_limit'):
+        peer = request.client.host if request.client else None
+        source_ip = client_address(peer, request.headers.get('x-forwarded-for'), TRUSTED_PROXIES)
+        ip_key = hash_ip(source_ip) if source_ip else None
+        limited = rate_limiter.check(event_input.project_id, ip_key)
+    if limited is not None:
+        limit_name, retry_after = limited
+        raise HTTPException(status_code=429, detail=f"Rate limit exceeded ({limit_name})",
+                            headers={"Retry-After": str(retry_after)})
 
-    # Anonymize IP if enabled
-    ip_hash = None
-    if client_ip and privacy_settings.get('anonymize_ip', True):
-        try:
-            ip_hash = hashlib.sha256(client_ip.encode()).hexdigest()[:16]
-        except Exception:
-            ip_hash = None
-
-    # GeoIP lookup (country / continent) when available
-    country_iso = None
-    continent_name = None
-    if client_ip and geoip_reader:
-        try:
-            rec = geoip_reader.country(client_ip)
-            if rec and rec.country:
-                country_iso = rec.country.iso_code
-            if rec and rec.continent:
-                continent_name = rec.continent.name
-            logger.info(f"[TRACK] ✓ GeoIP success: country={country_iso}, continent={continent_name}")
-        except Exception as e:
-            logger.error(f"[TRACK] ✗ GeoIP lookup failed for {client_ip}: {e}")
-            country_iso = None
-            continent_name = None
-    elif client_ip and not geoip_reader:
-        logger.warning(f"[TRACK] ⚠ No geoip_reader available for {client_ip}")
-    elif not client_ip:
-        logger.warning(f"[TRACK] ⚠ No client_ip detected")
-    
-    # Fallback: If no GeoIP data, try to estimate from IP address patterns or use a placeholder
-    if not country_iso and client_ip:
-        try:
-            # Simple heuristic: use IP octets to pick from common countries
-            # This is a demo fallback; real IP geolocation requires GeoIP DB
-            # IP ranges are approximate and based on common allocations
-            parts = client_ip.split('.')
-            if len(parts) >= 1:
-                first_octet = int(parts[0])
-                # Rough IP range to country mapping (educational purposes)
-                if 1 <= first_octet <= 24:
-                    country_iso = 'US'  # 1.0.0.0 - 24.255.255.255
-                elif 25 <= first_octet <= 49:
-                    country_iso = 'IN'  # 25.0.0.0 - 49.255.255.255 (rough: Asia/India)
-                elif 50 <= first_octet <= 99:
-                    country_iso = 'EU'  # 50.0.0.0 - 99.255.255.255 (rough: Europe)
-                elif 100 <= first_octet <= 127:
-                    country_iso = 'CN'  # 100.0.0.0 - 127.255.255.255 (rough: Asia)
-                elif 128 <= first_octet <= 172:
-                    country_iso = 'JP'  # 128.0.0.0 - 172.255.255.255
-                elif 173 <= first_octet <= 191:
-                    country_iso = 'AU'  # Oceania/APAC
-                elif 192 <= first_octet <= 223:
-                    country_iso = 'BR'  # South America / Latin America
-                else:
-                    country_iso = 'XX'  # Unknown
-                logger.info(f"[TRACK] Using fallback country: {country_iso} (based on IP {client_ip})")
-        except Exception:
-            country_iso = 'XX'
-    
-    # Fallback for continent if still missing
-    if not continent_name and client_ip:
-        continents_fallback = ['North America', 'Europe', 'Asia', 'South America', 'Africa', 'Oceania']
-        try:
-            ip_int = sum(int(x) for x in client_ip.split('.')) if '.' in client_ip else 0
-            continent_name = continents_fallback[ip_int % len(continents_fallback)]
-            logger.info(f"[TRACK] Using fallback continent: {continent_name}")
-        except Exception:
-            continent_name = 'Unknown'
-    
-    # Debug log: confirm what country/continent will be saved
-    logger.info(f"[TRACK] Final values to save: country={country_iso}, continent={continent_name}")
+    # Verify tracking code
+    with metrics.span('track.project_lookup'):
+        project = await repo.projects.find_by_tracking_code(event_input.project_id, event_input.tracking_code)
+    if not project:
+        raise HTTPException(status_code=403, detail="Invalid project or tracking code")
     
-    # Ensure country_iso is never None (fallback to XX if still missing)
-    if not country_iso:
-        country_iso = 'XX'
-        logger.warning(f"[TRACK] ⚠ country_iso is None, setting to 'XX' as fallback")
+    # Privacy checks
+    privacy_settings = project.get('privacy_settings', {})
+    if privacy_settings.get('require_consent', True) and not event_input.consent_given:
+        return {"status": "consent_required"}
     
+    # Bot filtering: UA patterns and per-IP rate, before anything is stored
+    bot_policy = bot_filter.policy_for(project)
+    bot_reason = None
+    if bot_policy != 'allow':
+        with metrics.span('track.bot_filter'):
+            bot_reason = bot_filter.classify(event_input.user_agent, ip_key)
+    if bot_reason is not None:
+        bot_policy = bot_filter.action(bot_policy, bot_reason)
+        bot_filter.actions[bot_policy] += 1
+        if bot_policy == 'drop':
+            return {"status": "filtered", "reason": f"bot:{bot_reason}"}
+
     event = Event(
         project_id=event_input.project_id,
         session_id=event_input.session_id,
@@ -372,257 +646,268 @@ async def track_event(event_input: EventCreate, request: Request):
         page_title=event_input.page_title,
         referrer=event_input.referrer,
         user_agent=event_input.user_agent,
-        country=country_iso,
-        continent=continent_name,
-        ip_hash=ip_hash,
         properties=event_input.properties
     )
-    
-    doc = event.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
-    await db.events.insert_one(doc)
+
+    # IP hashing, geolocation and UA classification run in the enrichment pipeline
+    raw = event.model_dump()
+    raw['_client_ip'] = client_ip
+    raw['_anonymize_ip'] = privacy_settings.get('anonymize_ip', True)
+    if bot_reason is not None:
+        raw['is_bot'] = True
+        raw['bot_reason'] = bot_reason
+        raw['_route_bot'] = bot_policy == 'route'
+    with metrics.span('track.enqueue'):
+        if ingest_wal is not None:
+            await ingest_wal.append(raw)
+        else:
+            await enrichment.submit(raw)
     
     return {"status": "tracked", "event_id": event.id}
 
 # ==================== ANALYTICS ROUTES ====================
 
+async def compute_counts(project_ids: List[str], start: datetime, end: Optional[datetime] = None,
+                         totals_only: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Count tables per project for events in [start, end) from the configured analytics engine."""
+    if segment_engine is not None:
+        return {pid: await segment_engine.counts(pid, start, end, totals_only=totals_only) for pid in project_ids}
+    # One query for all projects, split afterwards
+    by_project: Dict[str, List[Dict[str, Any]]] = {pid: [] for pid in project_ids}
+    with metrics.span('counts.query'):
+        events = await repo.events.find_range_many(project_ids, start, end)
+    for e in events:
+        by_project[e['project_id']].append(e)
+    aggregate = aggregate_totals if totals_only else aggregate_overview_events
+    with metrics.span('counts.aggregate'):
+        return {pid: aggregate(events) for pid, events in by_project.items()}
+
+def oldest_pending_event() -> Optional[datetime]:
+    """Oldest acked event still in the write-ahead log backlog or the enrichment queue (None if none)."""
+    pending = [enrichment.oldest_pending()]
+    if wal_shipper is not None and wal_shipper.oldest_unshipped is not None:
+        pending.append(datetime.fromtimestamp(wal_shipper.oldest_unshipped, timezone.utc))
+    pending = [p for p in pending if p is not None]
+    return min(pending) if pending else None
+
+# Ranges are computed bucket by bucket so completed buckets are only ever aggregated once; a bucket is
+# only sealed once BUCKET_SETTLE_SECONDS have passed and no event acked before its end is still pending
+calendar_counts = CalendarCounts(compute_counts, bucket_cache, settle=timedelta(seconds=BUCKET_SETTLE_SECONDS),
+                                 pending_since=oldest_pending_event)
+cohort_engine.pending_since = oldest_pending_event
+if segment_engine is not None:
+    segment_engine.pending_since = oldest_pending_event
+
+def resolve_project_range(project: Dict[str, Any], start: Optional[str], end: Optional[str], days: int,
+                          tz: Optional[str], granularity: str):
+    """Calendar range in `tz` (default: the project's timezone); 400 on invalid parameters."""
+    try:
+        return resolve_range(start, end, days, tz or project.get('timezone'), granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.get("/analytics/{project_id}/overview")
-async def get_analytics_overview(project_id: str, days: int = 7, user: dict = Depends(verify_token)):
+async def get_analytics_overview(project_id: str, request: Request, days: int = 7, start: Optional[str] = None,
+                                 end: Optional[str] = None, tz: Optional[str] = None, granularity: str = 'day',
+                                 user: dict = Depends(verify_token)):
     # Verify project ownership
-    project = await db.projects.find_one({"id": project_id, "tenant_id": user['tenant_id']}, {"_id": 0})
+    with metrics.span('overview.project_lookup'):
+        project = await project_directory.find(project_id, user['tenant_id'])
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    start_date = datetime.now(timezone.utc) - timedelta(days=days)
-    prev_start_date = start_date - timedelta(days=days)
-    start_date_iso = start_date.isoformat()
-    prev_start_date_iso = prev_start_date.isoformat()
+    time_range = resolve_project_range(project, start, end, days, tz, granularity)
     
-    # Get current period events
-    events = await db.events.find({
-        "project_id": project_id,
-        "timestamp": {"$gte": start_date_iso}
-    }, {"_id": 0}).to_list(10000)
+    # Conditional GET: nothing to recompute when no new events have landed, or ever for a closed range
+    sealed = calendar_counts.is_sealed(time_range)
+    cache_key, etag, last_modified = await response_cache.validators(
+        project_id, ('overview',) + time_range.key(), sealed_at=time_range.end if sealed else None)
+    cache_headers = response_cache.headers(etag, last_modified, immutable=sealed)
+    if response_cache.is_not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=cache_headers)
+    cached = await response_cache.get(cache_key, etag)
+    if cached is not None:
+        return JSONResponse(cached, headers=cache_headers)
     
-    # Get previous period events for comparison
-    prev_events = await db.events.find({
-        "project_id": project_id,
-        "timestamp": {"$gte": prev_start_date_iso, "$lt": start_date_iso}
-    }, {"_id": 0}).to_list(10000)
+    # Current period, plus the previous period for comparison
+    with metrics.span('overview.counts'):
+        counts = await calendar_counts.counts(project_id, time_range)
+        prev_counts = await calendar_counts.counts(project_id, time_range.previous(), totals_only=True)
     
-    # Calculate current metrics
-    total_pageviews = sum(1 for e in events if e['event_type'] == 'pageview')
-    unique_sessions = len(set(e['session_id'] for e in events))
-    total_events = len(events)
-    
-    # Calculate previous metrics
-    prev_total_pageviews = sum(1 for e in prev_events if e['event_type'] == 'pageview')
-    prev_unique_sessions = len(set(e['session_id'] for e in prev_events))
-    prev_total_events = len(prev_events)
-    
-    # Calculate percentage changes
-    # If there's current data but no previous data, show 100% (first time)
-    # If there's no current data, show -100% (decreased to zero)
-    pageviews_change = 0
-    if prev_total_pageviews > 0:
-        pageviews_change = round(((total_pageviews - prev_total_pageviews) / prev_total_pageviews) * 100, 1)
-    elif total_pageviews > 0 and prev_total_pageviews == 0:
-        pageviews_change = 100  # New data (first time)
-    elif total_pageviews == 0 and prev_total_pageviews > 0:
-        pageviews_change = -100  # No more data
-    
-    sessions_change = 0
-    if prev_unique_sessions > 0:
-        sessions_change = round(((unique_sessions - prev_unique_sessions) / prev_unique_sessions) * 100, 1)
-    elif unique_sessions > 0 and prev_unique_sessions == 0:
-        sessions_change = 100  # New data (first time)
-    elif unique_sessions == 0 and prev_unique_sessions > 0:
-        sessions_change = -100  # No more data
-    
-    events_change = 0
-    if prev_total_events > 0:
-        events_change = round(((total_events - prev_total_events) / prev_total_events) * 100, 1)
-    elif total_events > 0 and prev_total_events == 0:
-        events_change = 100  # New data (first time)
-    elif total_events == 0 and prev_total_events > 0:
-        events_change = -100  # No more data
-    
-    # Top pages
-    page_counts = {}
-    for e in events:
-        if e['event_type'] == 'pageview' and e.get('page_url'):
-            page_counts[e['page_url']] = page_counts.get(e['page_url'], 0) + 1
-    top_pages = sorted(page_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+    with metrics.span('overview.build'):
+        overview = build_overview(counts, prev_counts)
+    overview["range"] = time_range.describe()
+    await response_cache.set(cache_key, etag, overview)
+    with metrics.span('overview.serialize'):
+        return JSONResponse(overview, headers=cache_headers)
+
+@api_router.get("/tenant/overview")
+async def get_tenant_overview(days: int = 7, start: Optional[str] = None, end: Optional[str] = None,
+                              tz: Optional[str] = None, granularity: str = 'day', user: dict = Depends(verify_token)):
+    """
+    Overview across all of the tenant's projects, with a per-project
+    breakdown. Uncached buckets are aggregated in one query per page of
+    TENANT_MAX_PROJECTS projects.
+    """
+    pages = [page async for page in project_directory.pages(user['tenant_id'])]
+    projects = [p for page in pages for p in page]
+    # Default to the projects' timezone when they all share one
+    timezones = {p.get('timezone') for p in projects}
+    time_range = resolve_project_range({'timezone': timezones.pop() if len(timezones) == 1 else None},
+                                       start, end, days, tz, granularity)
     
-    # Traffic over time (daily)
-    daily_traffic = {}
-    for e in events:
-        date_str = e['timestamp'][:10]  # YYYY-MM-DD
-        daily_traffic[date_str] = daily_traffic.get(date_str, 0) + 1
+    counts, prev_counts = {}, {}
+    for page in pages:
+        project_ids = [p['id'] for p in page]
+        counts.update(await calendar_counts.counts_many(project_ids, time_range))
+        prev_counts.update(await calendar_counts.counts_many(project_ids, time_range.previous(), totals_only=True))
     
-    # Calculate browser distribution
-    browsers = {}
-    for e in events:
-        if e.get('user_agent'):
-            ua = e['user_agent']
-            if 'Chrome' in ua and 'Edg' not in ua:
-                browser = 'Chrome'
-            elif 'Safari' in ua and 'Chrome' not in ua:
-                browser = 'Safari'
-            elif 'Firefox' in ua:
-                browser = 'Firefox'
-            elif 'Edg' in ua:
-                browser = 'Edge'
-            else:
-                browser = 'Other'
-            browsers[browser] = browsers.get(browser, 0) + 1
+    overview = build_overview(merge_many(counts.values()), merge_many(prev_counts.values()))
+    breakdown = []
+    for p in projects:
+        cur, prev = counts[p['id']], prev_counts[p['id']]
+        breakdown.append({
+            "project_id": p['id'],
+            "name": p['name'],
+            "domain": p['domain'],
+            "total_pageviews": cur['total_pageviews'],
+            "unique_sessions": len(cur['sessions']),
+            "total_events": cur['total_events'],
+            "pageviews_change": percent_change(cur['total_pageviews'], prev['total_pageviews']),
+            "sessions_change": percent_change(len(cur['sessions']), len(prev['sessions'])),
+            "events_change": percent_change(cur['total_events'], prev['total_events']),
+        })
+    overview["projects"] = sorted(breakdown, key=lambda p: p["total_pageviews"], reverse=True)
+    overview["range"] = time_range.describe()
+    return overview
+
+@api_router.get("/analytics/{project_id}/realtime")
+async def get_realtime_metrics(project_id: str, minutes: int = 30, user: dict = Depends(verify_token)):
+    """
+    Events, pageviews, distinct sessions (approximate) and top pages over the
+    last N minutes, served from in-memory counters without touching storage.
+    """
+    project = await project_directory.find(project_id, user['tenant_id'])
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if minutes < 1 or minutes > realtime_counters.minutes:
+        raise HTTPException(status_code=400, detail=f"minutes must be between 1 and {realtime_counters.minutes}")
     
-    # Traffic sources (referrers)
-    referrers = {}
-    for e in events:
-        if e['event_type'] == 'pageview':
-            referrer = e.get('referrer') or 'Direct'
-            if not referrer or referrer == '':
-                referrer = 'Direct'
-            referrers[referrer] = referrers.get(referrer, 0) + 1
-    
-    # Aggregate referrers into provider-friendly buckets (Gmail, Outlook, Yahoo, Google, Bing, Direct, etc.)
-    def _provider_for_ref(ref):
-        if not ref:
-            return 'Direct'
-        s = ref.lower()
-        # direct / empty
-        if s in ('direct', 'direct / none', ''):
-            return 'Direct'
-        # common mail providers
-        if 'mail.google' in s or 'gmail' in s:
-            return 'Gmail'
-        if 'outlook' in s or 'office' in s or 'live.com' in s or 'hotmail' in s:
-            return 'Outlook/Hotmail'
-        if 'yahoo' in s:
-            return 'Yahoo Mail'
-        # social / search
-        if 'facebook' in s:
-            return 'Facebook'
-        if 't.co' in s or 'twitter' in s:
-            return 'Twitter'
-        if 'linkedin' in s:
-            return 'LinkedIn'
-        if 'google' in s and 'mail' not in s:
-            return 'Google'
-        if 'bing' in s:
-            return 'Bing'
-        if 'duck' in s:
-            return 'DuckDuckGo'
-        # fallback: extract hostname
-        try:
-            host = re.sub(r'^https?://(www\.)?', '', ref).split('/')[0]
-            return host or ref
-        except Exception:
-            return ref
-
-    provider_counts: Dict[str, int] = {}
-    for raw_ref, cnt in referrers.items():
-        provider = _provider_for_ref(raw_ref)
-        provider_counts[provider] = provider_counts.get(provider, 0) + cnt
+    metrics = realtime_counters.realtime(project_id, minutes)
+    metrics["visitors_now"] = live_hub.snapshot(project_id)["active_sessions"]
+    return metrics
 
-    top_referrers = sorted(provider_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-
-    # Continent aggregation (uses stored continent from GeoIP when available)
-    continent_counts = {}
-    for e in events:
-        if e['event_type'] == 'pageview':
-            cont = e.get('continent')
-            if cont and cont != '':
-                continent_counts[cont] = continent_counts.get(cont, 0) + 1
-
-    # Build continent list sorted by count
-    continents_list = [
-        {"name": name, "count": count, "percentage": round((count / total_pageviews * 100), 1) if total_pageviews > 0 else 0}
-        for name, count in sorted(continent_counts.items(), key=lambda x: x[1], reverse=True)
-    ]
-    
-    # If no continent data, generate demo data for demonstration
-    if not continents_list and total_pageviews > 0:
-        demo_continents = [
-            {"name": "North America", "count": int(total_pageviews * 0.35), "percentage": 35.0},
-            {"name": "Europe", "count": int(total_pageviews * 0.25), "percentage": 25.0},
-            {"name": "Asia", "count": int(total_pageviews * 0.25), "percentage": 25.0},
-            {"name": "South America", "count": int(total_pageviews * 0.10), "percentage": 10.0},
-            {"name": "Africa", "count": int(total_pageviews * 0.03), "percentage": 3.0},
-            {"name": "Oceania", "count": int(total_pageviews * 0.02), "percentage": 2.0},
-        ]
-        continents_list = demo_continents
-
-    # Device type aggregation (Mobile, Tablet, Desktop, Bot)
-    device_counts = {}
-    for e in events:
-        if e['event_type'] == 'pageview':
-            ua = e.get('user_agent', '') or ''
-            ua_lower = ua.lower()
-            if any(k in ua_lower for k in ['mobile', 'iphone', 'android', 'ipod', 'opera mini']):
-                dev = 'Mobile'
-            elif any(k in ua_lower for k in ['ipad', 'tablet', 'kindle']):
-                dev = 'Tablet'
-            elif any(k in ua_lower for k in ['bot', 'spider', 'crawl']):
-                dev = 'Bot'
-            else:
-                dev = 'Desktop'
-            device_counts[dev] = device_counts.get(dev, 0) + 1
-
-    # Ensure at least empty keys for consistent UI
-    for key in ['Desktop', 'Mobile', 'Tablet', 'Bot']:
-        device_counts.setdefault(key, 0)
+@api_router.get("/analytics/{project_id}/live")
+async def live_stream(project_id: str, request: Request, user: dict = Depends(verify_token_or_query)):
+    """
+    Server-Sent Events stream of live metrics (active sessions, pageviews per
+    second, top current pages), pushed once per second.
+    """
+    project = await project_directory.find(project_id, user['tenant_id'])
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    return StreamingResponse(
+        sse_stream(live_hub, project_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    # Country aggregation (uses stored country ISO when available)
-    country_counts = {}
-    for e in events:
-        if e['event_type'] == 'pageview':
-            c = e.get('country') or 'Unknown'
-            country_counts[c] = country_counts.get(c, 0) + 1
+@api_router.post("/analytics/{project_id}/funnel")
+async def get_funnel(project_id: str, funnel_input: FunnelRequest, user: dict = Depends(verify_token)):
+    """
+    Per-step conversion of sessions through an ordered list of steps, each
+    step completed within `window_minutes` of the first one.
+    """
+    project = await project_directory.find(project_id, user['tenant_id'])
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not 1 <= funnel_input.days <= 365:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 365")
+    
+    try:
+        funnel = Funnel(
+            [StepPredicate(step.event_type, step.event_name, step.page, step.label) for step in funnel_input.steps],
+            window_seconds=funnel_input.window_minutes * 60,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    start_date = datetime.now(timezone.utc) - timedelta(days=funnel_input.days)
+    result = await funnel.run(repo.events.scan_sessions(project_id, start_date))
+    result["days"] = funnel_input.days
+    return result
 
-    # Build countries list sorted by count (limit to top 10 for payload size)
-    countries_list = [
-        {"iso": name, "count": count, "percentage": round((count / total_pageviews * 100), 1) if total_pageviews > 0 else 0}
-        for name, count in sorted(country_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-    ]
+@api_router.get("/analytics/{project_id}/retention")
+async def get_retention(project_id: str, period: str = 'week', periods: int = 8, user: dict = Depends(verify_token)):
+    """
+    Retention matrix: for visitors first seen in each day / week, how many
+    came back in each following one.
+    """
+    project = await project_directory.find(project_id, user['tenant_id'])
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not 1 <= periods <= 52:
+        raise HTTPException(status_code=400, detail="periods must be between 1 and 52")
     
-    # Average metrics
-    avg_events_per_session = round(total_events / unique_sessions, 2) if unique_sessions > 0 else 0
+    try:
+        return await cohort_engine.retention(project_id, period, periods)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/analytics/{project_id}/properties")
+async def get_property_analytics(project_id: str, group_by: Optional[str] = None, sum_of: Optional[str] = None,
+                                 event_name: Optional[str] = None, days: int = 30, limit: int = 50,
+                                 user: dict = Depends(verify_token)):
+    """
+    Events (and the sum of the numeric property `sum_of`) per value of the
+    property `group_by`, e.g. revenue by plan, over the last `days` UTC days.
+    """
+    project = await project_directory.find(project_id, user['tenant_id'])
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not 1 <= days <= 365:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 365")
     
-    return {
-        "total_pageviews": total_pageviews,
-        "unique_sessions": unique_sessions,
-        "total_events": total_events,
-        "avg_events_per_session": avg_events_per_session,
-        "pageviews_change": pageviews_change,
-        "sessions_change": sessions_change,
-        "events_change": events_change,
-        "top_pages": [{"url": url, "views": count} for url, count in top_pages],
-        "daily_traffic": [{"date": date, "count": count} for date, count in sorted(daily_traffic.items())],
-        "browsers": dict(sorted(browsers.items(), key=lambda x: x[1], reverse=True)[:5]),
-        "referrers": [{"source": ref, "count": count} for ref, count in top_referrers],
-        "continents": continents_list,
-        "devices": device_counts,
-        "countries": countries_list
-    }
+    try:
+        return await property_analytics.query(project_id, days, group_by, sum_of, event_name, max(1, min(limit, 1000)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/analytics/{project_id}/properties/schema")
+async def get_property_schema(project_id: str, user: dict = Depends(verify_token)):
+    """Property keys seen on the project's events, with their value types, counts and index / rollup settings."""
+    project = await project_directory.find(project_id, user['tenant_id'])
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    return {"properties": await property_analytics.schema(project_id)}
+
+@api_router.put("/analytics/{project_id}/properties/schema/{key}")
+async def update_property_settings(project_id: str, key: str, settings: PropertySettings, user: dict = Depends(verify_token)):
+    project = await project_directory.find(project_id, user['tenant_id'])
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    try:
+        return await property_analytics.configure(project_id, key, settings.index, settings.rollup, settings.rollup_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @api_router.get("/analytics/{project_id}/export")
-async def export_analytics_csv(project_id: str, days: int = 7, user: dict = Depends(verify_token)):
+async def export_analytics_csv(project_id: str, days: int = 7, start: Optional[str] = None, end: Optional[str] = None,
+                               tz: Optional[str] = None, granularity: str = 'day', user: dict = Depends(verify_token)):
     # Verify project ownership
-    project = await db.projects.find_one({"id": project_id, "tenant_id": user['tenant_id']}, {"_id": 0})
+    project = await project_directory.find(project_id, user['tenant_id'])
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    start_date = datetime.now(timezone.utc) - timedelta(days=days)
-    end_date = datetime.now(timezone.utc)
-    start_date_iso = start_date.isoformat()
+    time_range = resolve_project_range(project, start, end, days, tz, granularity)
+    start_date = time_range.start.astimezone(time_range.tz)
+    end_date = (time_range.end - timedelta(microseconds=1)).astimezone(time_range.tz)
     
     # Get events in date range
-    events = await db.events.find({
-        "project_id": project_id,
-        "timestamp": {"$gte": start_date_iso}
-    }, {"_id": 0}).to_list(10000)
+    events = await repo.events.find_range(project_id, time_range.start, time_range.end)
     
     # Prepare CSV data
     output = io.StringIO()
@@ -632,7 +917,8 @@ async def export_analytics_csv(project_id: str, days: int = 7, user: dict = Depe
     output.write(f"Project: {project['name']}\n")
     output.write(f"Domain: {project['domain']}\n")
     output.write(f"Date Range: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}\n")
-    output.write(f"Generated: {end_date.strftime('%Y-%m-%d %H:%M:%S UTC')}\n")
+    output.write(f"Timezone: {time_range.tz}\n")
+    output.write(f"Generated: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}\n")
     output.write("\n")
     
     # Overview Metrics Section
@@ -686,10 +972,10 @@ async def export_analytics_csv(project_id: str, days: int = 7, user: dict = Depe
         output.write(f'"{referrer}",{count},{percentage:.2f}%\n')
     output.write("\n\n")
     
-    # Daily Traffic Breakdown
+    # Traffic breakdown per calendar bucket (day by default) in the project's timezone
     daily_data = {}
     for e in events:
-        date_str = e['timestamp'][:10]
+        date_str = time_range.label_of(e['timestamp'])
         if date_str not in daily_data:
             daily_data[date_str] = {
                 'pageviews': 0,
@@ -702,7 +988,8 @@ async def export_analytics_csv(project_id: str, days: int = 7, user: dict = Depe
         daily_data[date_str]['events'] += 1
         daily_data[date_str]['sessions'].add(e['session_id'])
     
-    output.write("Daily Traffic Breakdown\n")
+    granularity_title = {'hour': 'Hourly', 'day': 'Daily', 'week': 'Weekly', 'month': 'Monthly'}[time_range.granularity]
+    output.write(f"{granularity_title} Traffic Breakdown\n")
     output.write("Date,Pageviews,Total Events,Unique Sessions,Events per Session\n")
     for date in sorted(daily_data.keys()):
         data = daily_data[date]
@@ -784,7 +1071,7 @@ async def process_nlq(request: NLQRequest, user: dict = Depends(verify_token)):
     Returns insights and data based on the question asked.
     """
     # Verify project ownership
-    project = await db.projects.find_one({"id": request.project_id, "tenant_id": user['tenant_id']}, {"_id": 0})
+    project = await project_directory.find(request.project_id, user['tenant_id'])
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -795,25 +1082,22 @@ async def process_nlq(request: NLQRequest, user: dict = Depends(verify_token)):
     elif request.date_range == "90d":
         days = 90
     
-    start_date = datetime.now(timezone.utc) - timedelta(days=days)
-    start_date_iso = start_date.isoformat()
+    time_range = resolve_project_range(project, request.start, request.end, days, request.tz, 'day')
+    if request.start:
+        days = time_range.days
+        period = f"the period {request.start} to {request.end or 'today'}"
+    else:
+        period = f"the last {days} days"
     
-    events = await db.events.find({
-        "project_id": request.project_id,
-        "timestamp": {"$gte": start_date_iso}
-    }, {"_id": 0}).to_list(10000)
+    counts = await calendar_counts.counts(request.project_id, time_range)
     
     # Calculate metrics
-    total_pageviews = sum(1 for e in events if e['event_type'] == 'pageview')
-    unique_sessions = len(set(e['session_id'] for e in events))
-    total_events = len(events)
+    total_pageviews = counts['total_pageviews']
+    unique_sessions = len(counts['sessions'])
+    total_events = counts['total_events']
     
     # Top pages
-    page_counts = {}
-    for e in events:
-        if e['event_type'] == 'pageview' and e.get('page_url'):
-            page_counts[e['page_url']] = page_counts.get(e['page_url'], 0) + 1
-    top_pages = sorted(page_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+    top_pages = top_items(counts['page_counts'], 5)
     
     # Process question and generate answer
     question_lower = request.question.lower()
@@ -822,8 +1106,20 @@ async def process_nlq(request: NLQRequest, user: dict = Depends(verify_token)):
     insights = []
     
     # Simple keyword matching for NLQ processing
-    if any(word in question_lower for word in ['traffic', 'trend', 'pageview', 'view']):
-        answer = f"Your website received {total_pageviews} pageviews over the last {days} days from {unique_sessions} unique sessions."
+    if any(word in question_lower for word in ['retention', 'retain', 'cohort', 'returning', 'come back', 'came back', 'churn']):
+        retention = await cohort_engine.retention(request.project_id, 'week', max(2, days // 7))
+        previous = [c for c in retention['cohorts'] if len(c['retained']) > 1]
+        if previous and previous[-1]['visitors']:
+            cohort = previous[-1]
+            answer = (f"Of the {cohort['visitors']} visitors first seen in the week of {cohort['cohort']}, "
+                      f"{cohort['retention'][1]}% came back the following week.")
+            insights.append(f"Average week-1 retention across {len(previous)} cohorts: {retention['average_retention'][1]}%")
+        else:
+            answer = "Not enough data yet to measure retention; it needs visitors from at least two weeks."
+        data = retention
+    
+    elif any(word in question_lower for word in ['traffic', 'trend', 'pageview', 'view']):
+        answer = f"Your website received {total_pageviews} pageviews over {period} from {unique_sessions} unique sessions."
         data = {
             "pageviews": total_pageviews,
             "sessions": unique_sessions,
@@ -850,7 +1146,7 @@ async def process_nlq(request: NLQRequest, user: dict = Depends(verify_token)):
             data = {"top_pages": []}
     
     elif any(word in question_lower for word in ['visitor', 'session', 'user', 'unique']):
-        answer = f"You have {unique_sessions} unique visitor sessions in the last {days} days."
+        answer = f"You have {unique_sessions} unique visitor sessions in {period}."
         data = {
             "unique_sessions": unique_sessions,
             "period_days": days
@@ -860,7 +1156,7 @@ async def process_nlq(request: NLQRequest, user: dict = Depends(verify_token)):
             insights.append(f"Average {avg_events:.1f} events per session")
     
     elif any(word in question_lower for word in ['event', 'interaction', 'click', 'engagement']):
-        answer = f"Total events tracked: {total_events} over the last {days} days."
+        answer = f"Total events tracked: {total_events} over {period}."
         data = {
             "total_events": total_events,
             "period_days": days
@@ -871,7 +1167,7 @@ async def process_nlq(request: NLQRequest, user: dict = Depends(verify_token)):
     
     else:
         # Default response
-        answer = f"Based on your analytics: {total_pageviews} pageviews, {unique_sessions} unique sessions, {total_events} total events over the last {days} days."
+        answer = f"Based on your analytics: {total_pageviews} pageviews, {unique_sessions} unique sessions, {total_events} total events over {period}."
         data = {
             "pageviews": total_pageviews,
             "sessions": unique_sessions,
@@ -892,6 +1188,99 @@ async def process_nlq(request: NLQRequest, user: dict = Depends(verify_token)):
 async def root():
     return {"message": "Analytics Platform API", "version": "1.0.0"}
 
+@api_router.get("/health/live")
+async def liveness():
+    """The worker is up and serving requests (restart it when this fails)."""
+    return {"status": "alive"}
+
+@api_router.get("/health/ready")
+async def readiness():
+    """Warm-up progress; 503 until storage checks and GeoIP / IP range data loading have finished."""
+    return JSONResponse(warm_up.report(), status_code=200 if warm_up.ready else 503)
+
+@api_router.get("/health/ingest")
+async def ingest_health(authorized: bool = Depends(verify_metrics_token)):
+    """Ingestion backlog (enrichment queue, write-ahead log disk usage / lag), bot filter and rate limit counters."""
+    return {
+        "enrichment": {"mode": enrichment.mode, "queued": enrichment.depth,
+                       "enriched": enrichment.enriched, "failed": enrichment.failed, "retries": enrichment.retries},
+        "wal": wal_shipper.stats() if wal_shipper is not None else None,
+        "bots": bot_filter.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "latency": metrics.quantiles(),
+    }
+
+# ==================== PROFILING ====================
+
+@api_router.post("/admin/profiles")
+async def arm_profile(input: ProfileRequest, admin: bool = Depends(verify_admin)):
+    """Profile the next `requests` requests matching `route` and/or `project_id`, on every worker."""
+    try:
+        return await profiler.arm(input.mode, input.requests, input.route, input.project_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/admin/profiles")
+async def list_profiles(admin: bool = Depends(verify_admin)):
+    return {"captures": profiler.list(), "continuous_sample_hz": profiler.sample_hz}
+
+@api_router.get("/admin/profiles/continuous")
+async def continuous_profile(format: str = 'speedscope', reset: bool = False, admin: bool = Depends(verify_admin)):
+    """This worker's always-on stack samples (PROFILE_SAMPLE_HZ), as speedscope JSON or collapsed stacks."""
+    if profiler.sample_hz <= 0:
+        raise HTTPException(status_code=400, detail="Continuous sampling is off (set PROFILE_SAMPLE_HZ)")
+    if format == 'collapsed':
+        return Response(profiler.continuous_profile('collapsed', reset), media_type='text/plain; charset=utf-8')
+    return profiler.continuous_profile('speedscope', reset)
+
+@api_router.get("/admin/profiles/{capture_id}")
+async def download_profile(capture_id: str, format: str = 'pstats', admin: bool = Depends(verify_admin)):
+    """A capture's merged profile: pstats (cprofile captures), speedscope or collapsed (sampling captures)."""
+    try:
+        content, media_type = await asyncio.get_running_loop().run_in_executor(None, profiler.export, capture_id, format)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Capture not found")
+    except LookupError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    extension = {'pstats': 'pstats', 'speedscope': 'speedscope.json', 'collapsed': 'txt'}[format]
+    return Response(content, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="profile-{capture_id}.{extension}"'})
+
+@api_router.delete("/admin/profiles/{capture_id}")
+async def delete_profile(capture_id: str, admin: bool = Depends(verify_admin)):
+    await profiler.disarm(capture_id)
+    try:
+        profiler.delete(capture_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Capture not found")
+    return {"status": "deleted", "id": capture_id}
+
+def _cache_requests():
+    for name, cache in (('response', response_cache), ('bucket', bucket_cache), ('project_directory', project_directory)):
+        stats = cache.stats()
+        for result in ('hits', 'misses', 'not_modified'):
+            if result in stats:
+                yield {"cache": name, "result": result}, stats[result]
+
+metrics.collect('analytics_cache_requests_total', 'counter', 'Cache lookups by cache and result', _cache_requests)
+metrics.collect('ingest_queue_depth', 'gauge', 'Raw events waiting for enrichment', lambda: enrichment.depth)
+metrics.collect('ingest_events_total', 'counter', 'Events through the enrichment pipeline by outcome',
+                lambda: [({"result": "enriched"}, enrichment.enriched), ({"result": "failed"}, enrichment.failed)])
+metrics.collect('ingest_batch_retries_total', 'counter', 'Enrichment batch writes retried after a failure',
+                lambda: enrichment.retries)
+if wal_shipper is not None:
+    metrics.collect('ingest_wal_unshipped_bytes', 'gauge', 'Write-ahead log bytes not yet stored',
+                    lambda: wal_shipper.stats()['unshipped_bytes'])
+    metrics.collect('ingest_wal_lag_seconds', 'gauge', 'Age of the oldest unshipped write-ahead log entry',
+                    wal_shipper.lag_seconds)
+
+@app.get("/metrics")
+async def prometheus_metrics(authorized: bool = Depends(verify_metrics_token)):
+    """Prometheus text exposition of this worker's metrics."""
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
 # Include router and middleware
 # IMPORTANT: Add middleware BEFORE including router for proper preflight handling
 cors_origins_str = os.environ.get('CORS_ORIGINS', '*')
@@ -900,6 +1289,8 @@ cors_origins = [o.strip() for o in cors_origins_str.split(',') if o.strip()]
 # When using wildcard, cannot use allow_credentials=True
 allow_creds = '*' not in cors_origins
 
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=allow_creds,
@@ -910,16 +1301,72 @@ app.add_middleware(
 
 app.include_router(api_router)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def check_storage():
+    await repo.ensure_schema()
+    logger.info(f"✓ Storage ready (backend={repo.backend}, events={repo.events.mode}:{repo.events.collection_name})")
+
+async def load_geoip():
+    global geoip_reader
+    geoip_reader = await asyncio.to_thread(open_geoip_reader, GEOIP_DB)
+    set_geoip_reader(geoip_reader)
+    return "loaded" if geoip_reader is not None else "unavailable"
+
+async def load_ip_ranges():
+    global ip_index
+    ip_index = await asyncio.to_thread(open_ip_index, IP_RANGES_PATH)
+    set_ip_index(ip_index)
+    return "loaded" if ip_index is not None else "unavailable"
+
+warm_up.add('storage', check_storage)
+warm_up.add('geoip', load_geoip)
+warm_up.add('ip_ranges', load_ip_ranges)
+
+async def ship_wal():
+    # Events replayed from the log are enriched and stored like new ones: not before warm-up
+    await warm_up.wait()
+    await wal_shipper.run()
+
+async def start_services():
+    await shared_state.start()
+    await response_cache.start()
+    await enrichment.start()
+    profiler.start()
+    if ingest_wal is not None:
+        await ingest_wal.start()
+    app.state.live_broadcaster = asyncio.create_task(live_hub.run())
+    if COHORT_SEAL_INTERVAL > 0:
+        app.state.cohort_sealer = asyncio.create_task(cohort_engine.run_periodically(COHORT_SEAL_INTERVAL))
+    if segment_engine is not None:
+        app.state.segment_compactor = asyncio.create_task(segment_engine.run_periodically(SEGMENT_COMPACT_INTERVAL))
+    warm_up.start()
+    if ingest_wal is not None:
+        app.state.wal_shipper = asyncio.create_task(ship_wal())
+
+async def stop_services():
+    await warm_up.stop()
+    # Flush queued events before the storage connection goes away
+    if ingest_wal is not None:
+        app.state.wal_shipper.cancel()
+        await ingest_wal.close()
+        if warm_up.ready:
+            await wal_shipper.drain()
+    await enrichment.stop()
+    profiler.stop()
+    app.state.live_broadcaster.cancel()
+    await shared_state.close()
+    if getattr(app.state, 'segment_compactor', None) is not None:
+        app.state.segment_compactor.cancel()
+    if getattr(app.state, 'cohort_sealer', None) is not None:
+        app.state.cohort_sealer.cancel()
+    repo.close()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # WEB_CONCURRENCY > 1 runs several worker processes; set SHARED_STATE_URL so caches and counters stay coherent
+    workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+    if workers > 1 and not shared_state.shared:
+        logger.warning("⚠ Running multiple workers with in-memory shared state: caches and live counters are per worker")
+    if workers > 1:
+        uvicorn.run("server:app", host="0.0.0.0", port=int(os.environ.get('PORT', '8000')), workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get('PORT', '8000')))
@@ -0,0 +1,165 @@
+"""
+Shared state for multi-worker deployments.
+
+Anything that must agree across worker processes (cache versions, counters,
+cached payloads, the tracked-event feed for live dashboards) goes through a
+`SharedState`:
+
+  - InMemorySharedState: single process, no dependencies (default)
+  - RedisSharedState:    any Redis-protocol server (Redis, Valkey, KeyDB,
+                         Dragonfly); requires the `redis` package
+
+Configured with SHARED_STATE_URL (unset / memory:// or redis://host:port/0).
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except Exception:
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str], None]
+
+
+class SharedState:
+    # True when state is visible to other processes
+    shared = False
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return [await self.get(k) for k in keys]
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        """Set a value (optionally expiring after `ttl` seconds, or only if absent); returns whether it was set."""
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, handler: Handler):
+        """Register a handler called with every message published on `channel` (by any worker)."""
+        raise NotImplementedError
+
+
+class InMemorySharedState(SharedState):
+    shared = False
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    async def incr(self, key, amount=1):
+        value = int(await self.get(key) or 0) + amount
+        self._values[key] = (str(value), None)
+        return value
+
+    async def get(self, key):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires < time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key, value, ttl=None, nx=False):
+        if nx and await self.get(key) is not None:
+            return False
+        self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+        return True
+
+    async def publish(self, channel, message):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error(f"[STATE] Handler for '{channel}' failed: {e}")
+
+    def subscribe(self, channel, handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+
+class RedisSharedState(SharedState):
+    shared = True
+
+    def __init__(self, url: str):
+        if aioredis is None:
+            raise RuntimeError("SHARED_STATE_URL points at Redis but the 'redis' package is not installed")
+        self.url = url
+        self.client = aioredis.from_url(url, decode_responses=True)
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.client.ping()
+        if self._handlers:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        await self.client.aclose()
+
+    async def incr(self, key, amount=1):
+        return await self.client.incrby(key, amount)
+
+    async def get(self, key):
+        return await self.client.get(key)
+
+    async def mget(self, keys):
+        return await self.client.mget(keys) if keys else []
+
+    async def set(self, key, value, ttl=None, nx=False):
+        return bool(await self.client.set(key, value, px=int(ttl * 1000) if ttl else None, nx=nx))
+
+    async def publish(self, channel, message):
+        await self.client.publish(channel, message)
+
+    def subscribe(self, channel, handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def _listen(self):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(*self._handlers)
+                async for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    for handler in self._handlers.get(message['channel'], ()):
+                        try:
+                            handler(message['data'])
+                        except Exception as e:
+                            logger.error(f"[STATE] Handler for '{message['channel']}' failed: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[STATE] Redis subscription lost, reconnecting: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+def create_shared_state(url: Optional[str] = None) -> SharedState:
+    if not url or url.startswith('memory://'):
+        return InMemorySharedState()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisSharedState(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL '{url}'")
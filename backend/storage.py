@@ -0,0 +1,1074 @@
+"""
+Storage backends.
+
+All data access goes through a repository with one store per entity:
+tenants, projects, events, bot_events (bot traffic routed away from the
+analytics data), rollups, dictionaries, bitmaps and property schemas.
+Documents are plain dicts in the shape the API has always stored them in (ISO-8601 string timestamps), so route handlers do
+not need to know where or how they are persisted.
+
+Backends:
+  - mongo:  Motor / MongoDB (production)
+  - sqlite: embedded single-file (or :memory:) engine for tests, benchmarks
+            and small deployments, with the same query semantics
+
+Event storage modes (mongo backend only):
+  - standard:   regular `events` collection, ISO string timestamps
+  - timeseries: MongoDB time-series collection (timeField=timestamp,
+                metaField=project_id), BSON date timestamps
+
+Event encodings (any backend):
+  - full:    documents exactly as the API builds them
+  - compact: short keys, interned strings (see compact.py)
+"""
+import json
+import logging
+import re
+import sqlite3
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKENDS = ('mongo', 'sqlite')
+DUPLICATE_KEY = 11000  # MongoDB error code
+STORAGE_MODES = ('standard', 'timeseries')
+EVENT_ENCODINGS = ('full', 'compact')
+
+
+def duplicate_key_errors(error: Exception) -> Optional[List[Dict[str, Any]]]:
+    """The writeErrors of a Mongo BulkWriteError when every one is a duplicate key, else None."""
+    errors = (getattr(error, 'details', None) or {}).get('writeErrors')
+    if not errors or any(err.get('code') != DUPLICATE_KEY for err in errors):
+        return None
+    return errors
+
+
+def to_datetime(value: Any) -> datetime:
+    """Normalize an ISO string / naive datetime into an aware UTC datetime."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def to_iso(value: Any) -> str:
+    if isinstance(value, datetime):
+        return to_datetime(value).isoformat()
+    return value
+
+
+# ==================== INTERFACES ====================
+
+class TenantStore:
+    async def insert(self, doc: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def find_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class ProjectStore:
+    async def insert(self, doc: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def find(self, project_id: str, tenant_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Project by id, optionally restricted to the owning tenant."""
+        raise NotImplementedError
+
+    async def find_by_tracking_code(self, project_id: str, tracking_code: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def list_for_tenant(self, tenant_id: str, limit: int = 100, after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A page of the tenant's projects ordered by id, starting after project id `after`."""
+        raise NotImplementedError
+
+    async def list_ids(self) -> List[str]:
+        """Ids of every project (used by background maintenance jobs)."""
+        raise NotImplementedError
+
+    async def delete(self, project_id: str, tenant_id: str) -> int:
+        """Delete a tenant's project, returning the number of deleted projects."""
+        raise NotImplementedError
+
+
+class EventStore:
+    """Base interface for event persistence."""
+
+    mode = None
+    # Keys an event id can be stored under (the compact encoding adds its own); stored ids are unique
+    id_keys = ('id',)
+
+    async def ensure_schema(self):
+        raise NotImplementedError
+
+    async def insert(self, doc: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def insert_many(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Store events; returns the ones that were new. Events whose id is already
+        stored are skipped, so replaying a batch (write-ahead log, retries) is a no-op.
+        """
+        raise NotImplementedError
+
+    async def find_range(self, project_id: str, start: datetime, end: Optional[datetime] = None,
+                         limit: Optional[int] = 10000, include_bots: bool = False) -> List[Dict[str, Any]]:
+        """Events of a project with start <= timestamp < end (end open if None), without tagged bot traffic."""
+        raise NotImplementedError
+
+    async def find_range_many(self, project_ids: List[str], start: datetime, end: Optional[datetime] = None,
+                              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """find_range over several projects in one query (tenant-wide dashboards)."""
+        raise NotImplementedError
+
+    def scan_sessions(self, project_id: str, start: datetime, end: Optional[datetime] = None,
+                      batch_size: int = 5000, session_field: str = 'session_id') -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Batches of the same events ordered by (session, timestamp), streamed so
+        memory stays bounded by `batch_size` however large the range is.
+        """
+        raise NotImplementedError
+
+    async def aggregate_properties(self, project_id: str, start: datetime, end: Optional[datetime] = None,
+                                   group_by: Optional[str] = None, sum_of: Optional[str] = None,
+                                   where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        {value, events, sum} per distinct value of the `group_by` document path
+        (e.g. 'properties.plan'), computed by the database. Only events where
+        `group_by` is set and `sum_of` is a number are counted; `where` adds
+        equality filters on top-level fields.
+        """
+        raise NotImplementedError
+
+    async def ensure_field_index(self, path: str):
+        """Partial index on (project_id, path, timestamp) covering events where `path` is set."""
+        raise NotImplementedError
+
+    async def list_field_indexes(self) -> List[str]:
+        """Document paths that have an index created by ensure_field_index."""
+        raise NotImplementedError
+
+    async def delete_project(self, project_id: str):
+        raise NotImplementedError
+
+    async def storage_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class RollupStore:
+    """
+    Pre-aggregated counters per (project, bucket).
+
+    `bucket` is a sortable string key such as '2025-01-31' or
+    '2025-01-31T13'; `counters` is a flat dict of numeric values.
+    """
+
+    async def increment(self, project_id: str, bucket: str, counters: Dict[str, float]):
+        raise NotImplementedError
+
+    async def find_range(self, project_id: str, start_bucket: str,
+                         end_bucket: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Rollups with start_bucket <= bucket < end_bucket, ordered by bucket."""
+        raise NotImplementedError
+
+    async def delete_project(self, project_id: str):
+        raise NotImplementedError
+
+
+class DictionaryStore:
+    """
+    Per-project string dictionaries (user agents, URLs, referrers, ...).
+
+    Each distinct value of a `kind` gets a small integer id, stable for the
+    lifetime of the project; compact event documents store the id instead.
+    """
+
+    async def ensure_schema(self):
+        pass
+
+    async def intern(self, project_id: str, kind: str, values: List[str]) -> Dict[str, int]:
+        """Ids for `values`, assigning new ids to values seen for the first time."""
+        raise NotImplementedError
+
+    async def lookup(self, project_id: str, kind: str, ids: List[int]) -> Dict[int, str]:
+        raise NotImplementedError
+
+    async def delete_project(self, project_id: str):
+        raise NotImplementedError
+
+
+class BitmapStore:
+    """
+    Serialized bitmaps per (project, kind, bucket), e.g. the visitors seen
+    on one day (see cohorts.py). Buckets are sortable strings like rollups.
+    """
+
+    async def ensure_schema(self):
+        pass
+
+    async def put(self, project_id: str, kind: str, bucket: str, data: bytes):
+        raise NotImplementedError
+
+    async def find_range(self, project_id: str, kind: str, start_bucket: str,
+                         end_bucket: Optional[str] = None) -> List[Dict[str, Any]]:
+        """{bucket, data} for start_bucket <= bucket < end_bucket, ordered by bucket."""
+        raise NotImplementedError
+
+    async def list_buckets(self, project_id: str, kind: str, start_bucket: str,
+                           end_bucket: Optional[str] = None) -> List[str]:
+        raise NotImplementedError
+
+    async def delete_project(self, project_id: str):
+        raise NotImplementedError
+
+
+class PropertySchemaStore:
+    """
+    Custom event property keys discovered at ingest, one document per
+    (project, key): {key, types: {type: events}, count, first_seen,
+    last_seen} plus the per-key settings of properties.py (indexed, rollup,
+    rollup_by, rollup_since).
+    """
+
+    async def ensure_schema(self):
+        pass
+
+    async def observe(self, project_id: str, key: str, types: Dict[str, int], seen_at: str) -> Dict[str, Any]:
+        """Add `types` counts for `key`, returning the updated document."""
+        raise NotImplementedError
+
+    async def update(self, project_id: str, key: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def find(self, project_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def delete_project(self, project_id: str):
+        raise NotImplementedError
+
+
+# ==================== MONGO BACKEND ====================
+
+class MongoTenantStore(TenantStore):
+    def __init__(self, db):
+        self.collection = db.tenants
+
+    async def insert(self, doc):
+        await self.collection.insert_one(dict(doc))
+
+    async def find_by_email(self, email):
+        return await self.collection.find_one({"email": email}, {"_id": 0})
+
+
+class MongoProjectStore(ProjectStore):
+    def __init__(self, db):
+        self.collection = db.projects
+
+    async def ensure_schema(self):
+        await self.collection.create_index([("tenant_id", 1), ("id", 1)])
+
+    async def insert(self, doc):
+        await self.collection.insert_one(dict(doc))
+
+    async def find(self, project_id, tenant_id=None):
+        query = {"id": project_id}
+        if tenant_id is not None:
+            query["tenant_id"] = tenant_id
+        return await self.collection.find_one(query, {"_id": 0})
+
+    async def find_by_tracking_code(self, project_id, tracking_code):
+        return await self.collection.find_one({"id": project_id, "tracking_code": tracking_code}, {"_id": 0})
+
+    async def list_for_tenant(self, tenant_id, limit=100, after=None):
+        query = {"tenant_id": tenant_id}
+        if after is not None:
+            query["id"] = {"$gt": after}
+        return await self.collection.find(query, {"_id": 0}).sort("id", 1).to_list(limit)
+
+    async def list_ids(self):
+        return await self.collection.distinct("id")
+
+    async def delete(self, project_id, tenant_id):
+        result = await self.collection.delete_one({"id": project_id, "tenant_id": tenant_id})
+        return result.deleted_count
+
+
+class MongoRollupStore(RollupStore):
+    def __init__(self, db):
+        self.collection = db.rollups
+
+    async def ensure_schema(self):
+        await self.collection.create_index([("project_id", 1), ("bucket", 1)], unique=True)
+
+    async def increment(self, project_id, bucket, counters):
+        if counters:
+            await self.collection.update_one(
+                {"project_id": project_id, "bucket": bucket},
+                {"$inc": {f"counters.{k}": v for k, v in counters.items()}},
+                upsert=True,
+            )
+
+    async def find_range(self, project_id, start_bucket, end_bucket=None):
+        cond = {"$gte": start_bucket}
+        if end_bucket is not None:
+            cond["$lt"] = end_bucket
+        cursor = self.collection.find({"project_id": project_id, "bucket": cond}, {"_id": 0}).sort("bucket", 1)
+        return await cursor.to_list(None)
+
+    async def delete_project(self, project_id):
+        await self.collection.delete_many({"project_id": project_id})
+
+
+class MongoEventStore(EventStore):
+    """Shared Motor implementation; subclasses define the physical layout."""
+
+    def __init__(self, db, collection_name: str):
+        self.db = db
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    def _encode(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        return doc
+
+    def _decode(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        return doc
+
+    def _time_filter(self, start: datetime, end: Optional[datetime]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def insert(self, doc):
+        await self.collection.insert_one(self._encode(dict(doc)))
+
+    async def insert_many(self, docs):
+        if not docs:
+            return []
+        try:
+            await self.collection.insert_many([self._encode(dict(d)) for d in docs], ordered=False)
+        except Exception as e:
+            # BulkWriteError: everything but the failed documents was written
+            errors = duplicate_key_errors(e)
+            if errors is None:
+                raise
+            duplicates = {err['index'] for err in errors}
+            return [doc for i, doc in enumerate(docs) if i not in duplicates]
+        return docs
+
+    async def _ensure_id_indexes(self, unique: bool = True):
+        for key in self.id_keys:
+            try:
+                await self.collection.create_index([(key, 1)], name=f"id:{key}", unique=unique,
+                                                   partialFilterExpression={key: {"$exists": True}})
+            except Exception as e:
+                # Duplicates stored before the index existed; replays are not deduplicated until removed
+                logger.error(f"[STORAGE] ✗ Unique index on {self.collection_name}.{key} failed: {e}")
+
+    async def find_range(self, project_id, start, end=None, limit=10000, include_bots=False):
+        query = {"project_id": project_id, "timestamp": self._time_filter(start, end)}
+        if not include_bots:
+            query["is_bot"] = {"$ne": True}
+        docs = await self.collection.find(query, {"_id": 0}).to_list(limit)
+        return [self._decode(d) for d in docs]
+
+    async def find_range_many(self, project_ids, start, end=None, limit=None):
+        query = {"project_id": {"$in": list(project_ids)}, "timestamp": self._time_filter(start, end),
+                 "is_bot": {"$ne": True}}
+        docs = await self.collection.find(query, {"_id": 0}).to_list(limit)
+        return [self._decode(d) for d in docs]
+
+    async def scan_sessions(self, project_id, start, end=None, batch_size=5000, session_field='session_id'):
+        query = {"project_id": project_id, "timestamp": self._time_filter(start, end), "is_bot": {"$ne": True}}
+        # The sort can exceed the in-memory sort limit on large ranges
+        cursor = (self.collection.find(query, {"_id": 0})
+                  .sort([(session_field, 1), ("timestamp", 1)])
+                  .allow_disk_use(True)
+                  .batch_size(batch_size))
+        batch = []
+        async for doc in cursor:
+            batch.append(self._decode(doc))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def aggregate_properties(self, project_id, start, end=None, group_by=None, sum_of=None, where=None):
+        query = {"project_id": project_id, "timestamp": self._time_filter(start, end), "is_bot": {"$ne": True},
+                 **(where or {})}
+        if group_by:
+            # $exists matches the partial index filter of ensure_field_index
+            query[group_by] = {"$exists": True, "$ne": None}
+        if sum_of:
+            query[sum_of] = {"$type": "number"}
+        pipeline = [
+            {"$match": query},
+            {"$group": {"_id": f"${group_by}" if group_by else None, "events": {"$sum": 1},
+                        "sum": {"$sum": f"${sum_of}" if sum_of else 0}}},
+        ]
+        cursor = self.collection.aggregate(pipeline, allowDiskUse=True)
+        return [{"value": doc["_id"], "events": doc["events"], "sum": doc["sum"]} async for doc in cursor]
+
+    async def ensure_field_index(self, path):
+        await self.collection.create_index([("project_id", 1), (path, 1), ("timestamp", 1)], name=f"field:{path}",
+                                           partialFilterExpression={path: {"$exists": True}})
+
+    async def list_field_indexes(self):
+        info = await self.collection.index_information()
+        return [name[len("field:"):] for name in info if name.startswith("field:")]
+
+    async def delete_project(self, project_id):
+        await self.collection.delete_many({"project_id": project_id})
+
+    async def storage_stats(self):
+        stats = await self.db.command("collStats", self.collection_name)
+        return {
+            "mode": self.mode,
+            "collection": self.collection_name,
+            "count": stats.get("count"),
+            "size": stats.get("size"),
+            "storage_size": stats.get("storageSize"),
+            "index_size": stats.get("totalIndexSize"),
+        }
+
+
+class StandardEventStore(MongoEventStore):
+    """Plain collection with ISO-8601 string timestamps (the original layout)."""
+
+    mode = 'standard'
+
+    async def ensure_schema(self):
+        await self.collection.create_index([("project_id", 1), ("timestamp", 1)])
+        await self._ensure_id_indexes()
+
+    def _encode(self, doc):
+        doc['timestamp'] = to_iso(doc['timestamp'])
+        return doc
+
+    def _time_filter(self, start, end):
+        cond = {"$gte": start.isoformat()}
+        if end is not None:
+            cond["$lt"] = end.isoformat()
+        return cond
+
+
+class TimeSeriesEventStore(MongoEventStore):
+    """
+    MongoDB time-series collection bucketed by project.
+
+    Time-series collections need a BSON date timeField, so timestamps are
+    converted on the way in and turned back into ISO strings on the way out.
+    """
+
+    mode = 'timeseries'
+
+    def __init__(self, db, collection_name: str, granularity: str = 'seconds'):
+        super().__init__(db, collection_name)
+        self.granularity = granularity
+
+    async def ensure_schema(self):
+        existing = await self.db.list_collection_names(filter={"name": self.collection_name})
+        if not existing:
+            await self.db.create_collection(
+                self.collection_name,
+                timeseries={
+                    "timeField": "timestamp",
+                    "metaField": "project_id",
+                    "granularity": self.granularity,
+                },
+            )
+            logger.info(f"[STORAGE] Created time-series collection '{self.collection_name}'")
+        await self.collection.create_index([("project_id", 1), ("timestamp", 1)])
+        # Time-series collections cannot have unique indexes: insert_many looks the ids up instead
+        await self._ensure_id_indexes(unique=False)
+
+    async def insert_many(self, docs):
+        if not docs:
+            return []
+        encoded = [self._encode(dict(d)) for d in docs]
+        seen = set()
+        for key in self.id_keys:
+            ids = [d[key] for d in encoded if key in d]
+            if ids:
+                cursor = self.collection.find({key: {"$in": ids}}, {"_id": 0, key: 1})
+                seen.update([(key, d[key]) async for d in cursor])
+        new = []
+        for doc, enc in zip(docs, encoded):
+            key = next((k for k in self.id_keys if k in enc), None)
+            if key is not None:
+                if (key, enc[key]) in seen:
+                    continue
+                seen.add((key, enc[key]))
+            new.append((doc, enc))
+        if new:
+            await self.collection.insert_many([enc for _, enc in new], ordered=False)
+        return [doc for doc, _ in new]
+
+    def _encode(self, doc):
+        doc['timestamp'] = to_datetime(doc['timestamp'])
+        return doc
+
+    def _decode(self, doc):
+        doc['timestamp'] = to_iso(doc['timestamp'])
+        return doc
+
+    def _time_filter(self, start, end):
+        cond = {"$gte": start}
+        if end is not None:
+            cond["$lt"] = end
+        return cond
+
+
+class MongoDictionaryStore(DictionaryStore):
+    def __init__(self, db):
+        self.collection = db.dictionaries
+        self.counters = db.dictionary_counters
+
+    async def ensure_schema(self):
+        await self.collection.create_index([("project_id", 1), ("kind", 1), ("value", 1)], unique=True)
+        await self.collection.create_index([("project_id", 1), ("kind", 1), ("vid", 1)], unique=True)
+
+    async def _find(self, project_id, kind, values):
+        cursor = self.collection.find({"project_id": project_id, "kind": kind, "value": {"$in": values}},
+                                      {"_id": 0, "value": 1, "vid": 1})
+        return {d['value']: d['vid'] async for d in cursor}
+
+    async def intern(self, project_id, kind, values):
+        values = list(dict.fromkeys(values))
+        ids = await self._find(project_id, kind, values)
+        missing = [v for v in values if v not in ids]
+        if missing:
+            counter = await self.counters.find_one_and_update(
+                {"_id": f"{project_id}:{kind}"}, {"$inc": {"next": len(missing)}}, upsert=True, return_document=True)
+            first = counter['next'] - len(missing) + 1
+            try:
+                await self.collection.insert_many(
+                    [{"project_id": project_id, "kind": kind, "value": v, "vid": first + i}
+                     for i, v in enumerate(missing)], ordered=False)
+            except Exception as e:
+                # Another worker interned some of them first: its ids win. Anything else is a storage error
+                if duplicate_key_errors(e) is None:
+                    raise
+            ids.update(await self._find(project_id, kind, missing))
+        return ids
+
+    async def lookup(self, project_id, kind, ids):
+        cursor = self.collection.find({"project_id": project_id, "kind": kind, "vid": {"$in": list(ids)}},
+                                      {"_id": 0, "value": 1, "vid": 1})
+        return {d['vid']: d['value'] async for d in cursor}
+
+    async def delete_project(self, project_id):
+        await self.collection.delete_many({"project_id": project_id})
+        await self.counters.delete_many({"_id": {"$regex": f"^{re.escape(project_id)}:"}})
+
+
+class MongoBitmapStore(BitmapStore):
+    def __init__(self, db):
+        self.collection = db.bitmaps
+
+    async def ensure_schema(self):
+        await self.collection.create_index([("project_id", 1), ("kind", 1), ("bucket", 1)], unique=True)
+
+    def _filter(self, project_id, kind, start_bucket, end_bucket):
+        cond = {"$gte": start_bucket}
+        if end_bucket is not None:
+            cond["$lt"] = end_bucket
+        return {"project_id": project_id, "kind": kind, "bucket": cond}
+
+    async def put(self, project_id, kind, bucket, data):
+        await self.collection.update_one({"project_id": project_id, "kind": kind, "bucket": bucket},
+                                         {"$set": {"data": bytes(data)}}, upsert=True)
+
+    async def find_range(self, project_id, kind, start_bucket, end_bucket=None):
+        cursor = self.collection.find(self._filter(project_id, kind, start_bucket, end_bucket),
+                                      {"_id": 0, "bucket": 1, "data": 1}).sort("bucket", 1)
+        return [{"bucket": doc["bucket"], "data": bytes(doc["data"])} async for doc in cursor]
+
+    async def list_buckets(self, project_id, kind, start_bucket, end_bucket=None):
+        cursor = self.collection.find(self._filter(project_id, kind, start_bucket, end_bucket),
+                                      {"_id": 0, "bucket": 1}).sort("bucket", 1)
+        return [doc["bucket"] async for doc in cursor]
+
+    async def delete_project(self, project_id):
+        await self.collection.delete_many({"project_id": project_id})
+
+
+class MongoPropertySchemaStore(PropertySchemaStore):
+    def __init__(self, db):
+        self.collection = db.property_schemas
+
+    async def ensure_schema(self):
+        await self.collection.create_index([("project_id", 1), ("key", 1)], unique=True)
+
+    async def observe(self, project_id, key, types, seen_at):
+        return await self.collection.find_one_and_update(
+            {"project_id": project_id, "key": key},
+            {"$inc": {"count": sum(types.values()), **{f"types.{t}": n for t, n in types.items()}},
+             "$min": {"first_seen": seen_at}, "$max": {"last_seen": seen_at}},
+            projection={"_id": 0}, upsert=True, return_document=True)
+
+    async def update(self, project_id, key, settings):
+        return await self.collection.find_one_and_update(
+            {"project_id": project_id, "key": key}, {"$set": settings},
+            projection={"_id": 0}, upsert=True, return_document=True)
+
+    async def find(self, project_id):
+        return await self.collection.find({"project_id": project_id}, {"_id": 0}).sort("key", 1).to_list(None)
+
+    async def delete_project(self, project_id):
+        await self.collection.delete_many({"project_id": project_id})
+
+
+def create_event_store(db, mode: str = 'standard', collection_name: Optional[str] = None) -> MongoEventStore:
+    if mode == 'standard':
+        return StandardEventStore(db, collection_name or 'events')
+    if mode == 'timeseries':
+        return TimeSeriesEventStore(db, collection_name or 'events_ts')
+    raise ValueError(f"Unknown event storage mode '{mode}' (expected one of {', '.join(STORAGE_MODES)})")
+
+
+class MongoRepository:
+    backend = 'mongo'
+
+    def __init__(self, client, db_name: str, events_mode: str = 'standard',
+                 events_collection: Optional[str] = None):
+        self.client = client
+        self.db = client[db_name]
+        self.tenants = MongoTenantStore(self.db)
+        self.projects = MongoProjectStore(self.db)
+        self.events = create_event_store(self.db, events_mode, events_collection)
+        # Bot traffic routed away from the main event store (bot_policy=route)
+        self.bot_events = StandardEventStore(self.db, 'bot_events')
+        self.rollups = MongoRollupStore(self.db)
+        self.dictionaries = MongoDictionaryStore(self.db)
+        self.bitmaps = MongoBitmapStore(self.db)
+        self.properties = MongoPropertySchemaStore(self.db)
+
+    async def ensure_schema(self):
+        await self.projects.ensure_schema()
+        await self.events.ensure_schema()
+        await self.bot_events.ensure_schema()
+        await self.rollups.ensure_schema()
+        await self.dictionaries.ensure_schema()
+        await self.bitmaps.ensure_schema()
+        await self.properties.ensure_schema()
+
+    def close(self):
+        self.client.close()
+
+
+# ==================== SQLITE BACKEND ====================
+#
+# Documents are kept as JSON next to the few columns used for lookups, and
+# ISO timestamps / rollup buckets are compared as strings exactly like the
+# Mongo backend does. Calls are synchronous: sqlite is in-process and fast
+# enough for the workloads this backend targets.
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tenants (id TEXT PRIMARY KEY, email TEXT UNIQUE, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY, tenant_id TEXT NOT NULL, tracking_code TEXT, doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_projects_tenant ON projects (tenant_id);
+CREATE TABLE IF NOT EXISTS events (project_id TEXT NOT NULL, timestamp TEXT NOT NULL, doc TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_events_project_ts ON events (project_id, timestamp);
+CREATE TABLE IF NOT EXISTS bot_events (project_id TEXT NOT NULL, timestamp TEXT NOT NULL, doc TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_bot_events_project_ts ON bot_events (project_id, timestamp);
+CREATE TABLE IF NOT EXISTS dictionaries (
+    project_id TEXT NOT NULL, kind TEXT NOT NULL, id INTEGER NOT NULL, value TEXT NOT NULL,
+    PRIMARY KEY (project_id, kind, id), UNIQUE (project_id, kind, value)
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    project_id TEXT NOT NULL, bucket TEXT NOT NULL, counters TEXT NOT NULL,
+    PRIMARY KEY (project_id, bucket)
+);
+CREATE TABLE IF NOT EXISTS bitmaps (
+    project_id TEXT NOT NULL, kind TEXT NOT NULL, bucket TEXT NOT NULL, data BLOB NOT NULL,
+    PRIMARY KEY (project_id, kind, bucket)
+);
+CREATE TABLE IF NOT EXISTS property_schemas (
+    project_id TEXT NOT NULL, key TEXT NOT NULL, doc TEXT NOT NULL,
+    PRIMARY KEY (project_id, key)
+);
+"""
+
+
+def _json_path(path: str) -> str:
+    """'properties.plan' -> '$."properties"."plan"' (json_extract path; callers validate the segments)."""
+    return '$' + ''.join(f'."{part}"' for part in path.split('.'))
+
+
+def _dumps(doc: Dict[str, Any]) -> str:
+    return json.dumps(doc, default=to_iso, separators=(',', ':'))
+
+
+class SQLiteTenantStore(TenantStore):
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def insert(self, doc):
+        self.conn.execute("INSERT INTO tenants (id, email, doc) VALUES (?, ?, ?)",
+                          (doc['id'], doc['email'], _dumps(doc)))
+
+    async def find_by_email(self, email):
+        row = self.conn.execute("SELECT doc FROM tenants WHERE email = ?", (email,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class SQLiteProjectStore(ProjectStore):
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def insert(self, doc):
+        self.conn.execute("INSERT INTO projects (id, tenant_id, tracking_code, doc) VALUES (?, ?, ?, ?)",
+                          (doc['id'], doc['tenant_id'], doc.get('tracking_code'), _dumps(doc)))
+
+    async def find(self, project_id, tenant_id=None):
+        if tenant_id is None:
+            row = self.conn.execute("SELECT doc FROM projects WHERE id = ?", (project_id,)).fetchone()
+        else:
+            row = self.conn.execute("SELECT doc FROM projects WHERE id = ? AND tenant_id = ?",
+                                    (project_id, tenant_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def find_by_tracking_code(self, project_id, tracking_code):
+        row = self.conn.execute("SELECT doc FROM projects WHERE id = ? AND tracking_code = ?",
+                                (project_id, tracking_code)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def list_for_tenant(self, tenant_id, limit=100, after=None):
+        rows = self.conn.execute("SELECT doc FROM projects WHERE tenant_id = ? AND id > ? ORDER BY id LIMIT ?",
+                                 (tenant_id, after if after is not None else '', limit))
+        return [json.loads(r[0]) for r in rows]
+
+    async def list_ids(self):
+        return [r[0] for r in self.conn.execute("SELECT id FROM projects")]
+
+    async def delete(self, project_id, tenant_id):
+        cur = self.conn.execute("DELETE FROM projects WHERE id = ? AND tenant_id = ?", (project_id, tenant_id))
+        return cur.rowcount
+
+
+class SQLiteEventStore(EventStore):
+    mode = 'standard'
+
+    def __init__(self, conn, path: str, table: str = 'events'):
+        self.conn = conn
+        self.path = path
+        self.collection_name = table
+
+    async def ensure_schema(self):
+        for key in self.id_keys:
+            try:
+                self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{self.collection_name}_id_{key} "
+                                  f"ON {self.collection_name} (json_extract(doc, '$.{key}'))")
+            except sqlite3.IntegrityError as e:
+                logger.error(f"[STORAGE] ✗ Unique index on {self.collection_name}.{key} failed: {e}")
+
+    async def insert(self, doc):
+        await self.insert_many([doc])
+
+    async def insert_many(self, docs):
+        new = []
+        with self.conn:
+            for doc in docs:
+                row = dict(doc)
+                row['timestamp'] = to_iso(row['timestamp'])
+                cursor = self.conn.execute(
+                    f"INSERT OR IGNORE INTO {self.collection_name} (project_id, timestamp, doc) VALUES (?, ?, ?)",
+                    (row['project_id'], row['timestamp'], _dumps(row)))
+                if cursor.rowcount:
+                    new.append(doc)
+        return new
+
+    async def find_range(self, project_id, start, end=None, limit=10000, include_bots=False):
+        sql = f"SELECT doc FROM {self.collection_name} WHERE project_id = ? AND timestamp >= ?"
+        params = [project_id, start.isoformat()]
+        if end is not None:
+            sql += " AND timestamp < ?"
+            params.append(end.isoformat())
+        if not include_bots:
+            sql += " AND json_extract(doc, '$.is_bot') IS NOT 1"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [json.loads(r[0]) for r in self.conn.execute(sql, params)]
+
+    async def find_range_many(self, project_ids, start, end=None, limit=None):
+        project_ids = list(project_ids)
+        sql = (f"SELECT doc FROM {self.collection_name} WHERE project_id IN ({','.join('?' * len(project_ids))}) "
+               f"AND timestamp >= ?")
+        params = [*project_ids, start.isoformat()]
+        if end is not None:
+            sql += " AND timestamp < ?"
+            params.append(end.isoformat())
+        sql += " AND json_extract(doc, '$.is_bot') IS NOT 1"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [json.loads(r[0]) for r in self.conn.execute(sql, params)]
+
+    async def scan_sessions(self, project_id, start, end=None, batch_size=5000, session_field='session_id'):
+        sql = (f"SELECT doc FROM {self.collection_name} WHERE project_id = ? AND timestamp >= ?"
+               f"{' AND timestamp < ?' if end is not None else ''} AND json_extract(doc, '$.is_bot') IS NOT 1 "
+               f"ORDER BY json_extract(doc, '$.{session_field}'), timestamp")
+        params = [project_id, start.isoformat()] + ([end.isoformat()] if end is not None else [])
+        cursor = self.conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [json.loads(r[0]) for r in rows]
+
+    async def aggregate_properties(self, project_id, start, end=None, group_by=None, sum_of=None, where=None):
+        group = f"json_extract(doc, '{_json_path(group_by)}')" if group_by else "NULL"
+        total = f"json_extract(doc, '{_json_path(sum_of)}')" if sum_of else "0"
+        sql = (f"SELECT {group}, COUNT(*), TOTAL({total}) FROM {self.collection_name} "
+               f"WHERE project_id = ? AND timestamp >= ?")
+        params = [project_id, start.isoformat()]
+        if end is not None:
+            sql += " AND timestamp < ?"
+            params.append(end.isoformat())
+        sql += " AND json_extract(doc, '$.is_bot') IS NOT 1"
+        for field, value in (where or {}).items():
+            sql += f" AND json_extract(doc, '{_json_path(field)}') = ?"
+            params.append(value)
+        if group_by:
+            sql += f" AND {group} IS NOT NULL"
+        if sum_of:
+            sql += f" AND json_type(doc, '{_json_path(sum_of)}') IN ('integer', 'real')"
+        if group_by:
+            sql += " GROUP BY 1"
+        rows = self.conn.execute(sql, params).fetchall()
+        return [{"value": value, "events": events, "sum": int(total) if total == int(total) else total}
+                for value, events, total in rows if events]
+
+    async def ensure_field_index(self, path):
+        expr = f"json_extract(doc, '{_json_path(path)}')"
+        with self.conn:
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{self.collection_name}_field:{path}" '
+                              f'ON {self.collection_name} (project_id, {expr}, timestamp) WHERE {expr} IS NOT NULL')
+
+    async def list_field_indexes(self):
+        prefix = f"idx_{self.collection_name}_field:"
+        rows = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?",
+                                 (self.collection_name,))
+        return [name[len(prefix):] for (name,) in rows if name.startswith(prefix)]
+
+    async def delete_project(self, project_id):
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {self.collection_name} WHERE project_id = ?", (project_id,))
+
+    async def storage_stats(self):
+        count = self.conn.execute(f"SELECT COUNT(*) FROM {self.collection_name}").fetchone()[0]
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        return {
+            "mode": "sqlite",
+            "collection": self.path,
+            "count": count,
+            "size": None,
+            "storage_size": page_size * page_count,
+            "index_size": None,
+        }
+
+
+class SQLiteRollupStore(RollupStore):
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def increment(self, project_id, bucket, counters):
+        if not counters:
+            return
+        with self.conn:
+            row = self.conn.execute("SELECT counters FROM rollups WHERE project_id = ? AND bucket = ?",
+                                    (project_id, bucket)).fetchone()
+            current = json.loads(row[0]) if row else {}
+            for k, v in counters.items():
+                current[k] = current.get(k, 0) + v
+            self.conn.execute("INSERT OR REPLACE INTO rollups (project_id, bucket, counters) VALUES (?, ?, ?)",
+                              (project_id, bucket, _dumps(current)))
+
+    async def find_range(self, project_id, start_bucket, end_bucket=None):
+        sql = "SELECT bucket, counters FROM rollups WHERE project_id = ? AND bucket >= ?"
+        params = [project_id, start_bucket]
+        if end_bucket is not None:
+            sql += " AND bucket < ?"
+            params.append(end_bucket)
+        sql += " ORDER BY bucket"
+        return [{"project_id": project_id, "bucket": b, "counters": json.loads(c)}
+                for b, c in self.conn.execute(sql, params)]
+
+    async def delete_project(self, project_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM rollups WHERE project_id = ?", (project_id,))
+
+
+class SQLiteDictionaryStore(DictionaryStore):
+    # Bound parameters per IN (...) query, below sqlite's variable limit
+    CHUNK = 500
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _select(self, project_id, kind, column, keys):
+        out = {}
+        other = 'id' if column == 'value' else 'value'
+        for i in range(0, len(keys), self.CHUNK):
+            chunk = keys[i:i + self.CHUNK]
+            sql = (f"SELECT {column}, {other} FROM dictionaries WHERE project_id = ? AND kind = ? "
+                   f"AND {column} IN ({','.join('?' * len(chunk))})")
+            out.update(self.conn.execute(sql, [project_id, kind, *chunk]).fetchall())
+        return out
+
+    async def intern(self, project_id, kind, values):
+        values = list(dict.fromkeys(values))
+        ids = self._select(project_id, kind, 'value', values)
+        missing = [v for v in values if v not in ids]
+        if missing:
+            # IMMEDIATE: other processes sharing the file cannot allocate the same ids meanwhile
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                next_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM dictionaries "
+                                            "WHERE project_id = ? AND kind = ?", (project_id, kind)).fetchone()[0]
+                self.conn.executemany("INSERT OR IGNORE INTO dictionaries (project_id, kind, id, value) VALUES (?, ?, ?, ?)",
+                                      [(project_id, kind, next_id + i, v) for i, v in enumerate(missing)])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            ids.update(self._select(project_id, kind, 'value', missing))
+        return ids
+
+    async def lookup(self, project_id, kind, ids):
+        return self._select(project_id, kind, 'id', list(ids))
+
+    async def delete_project(self, project_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM dictionaries WHERE project_id = ?", (project_id,))
+
+
+class SQLiteBitmapStore(BitmapStore):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _select(self, columns, project_id, kind, start_bucket, end_bucket):
+        sql = f"SELECT {columns} FROM bitmaps WHERE project_id = ? AND kind = ? AND bucket >= ?"
+        params = [project_id, kind, start_bucket]
+        if end_bucket is not None:
+            sql += " AND bucket < ?"
+            params.append(end_bucket)
+        return self.conn.execute(sql + " ORDER BY bucket", params)
+
+    async def put(self, project_id, kind, bucket, data):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO bitmaps (project_id, kind, bucket, data) VALUES (?, ?, ?, ?)",
+                              (project_id, kind, bucket, bytes(data)))
+
+    async def find_range(self, project_id, kind, start_bucket, end_bucket=None):
+        return [{"bucket": b, "data": bytes(d)}
+                for b, d in self._select("bucket, data", project_id, kind, start_bucket, end_bucket)]
+
+    async def list_buckets(self, project_id, kind, start_bucket, end_bucket=None):
+        return [b for (b,) in self._select("bucket", project_id, kind, start_bucket, end_bucket)]
+
+    async def delete_project(self, project_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM bitmaps WHERE project_id = ?", (project_id,))
+
+
+class SQLitePropertySchemaStore(PropertySchemaStore):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _get(self, project_id, key):
+        row = self.conn.execute("SELECT doc FROM property_schemas WHERE project_id = ? AND key = ?",
+                                (project_id, key)).fetchone()
+        return json.loads(row[0]) if row else {"project_id": project_id, "key": key}
+
+    def _put(self, doc):
+        self.conn.execute("INSERT OR REPLACE INTO property_schemas (project_id, key, doc) VALUES (?, ?, ?)",
+                          (doc['project_id'], doc['key'], _dumps(doc)))
+
+    async def observe(self, project_id, key, types, seen_at):
+        with self.conn:
+            doc = self._get(project_id, key)
+            doc['count'] = doc.get('count', 0) + sum(types.values())
+            doc_types = doc.setdefault('types', {})
+            for t, n in types.items():
+                doc_types[t] = doc_types.get(t, 0) + n
+            doc['first_seen'] = min(doc.get('first_seen') or seen_at, seen_at)
+            doc['last_seen'] = max(doc.get('last_seen') or seen_at, seen_at)
+            self._put(doc)
+        return doc
+
+    async def update(self, project_id, key, settings):
+        with self.conn:
+            doc = {**self._get(project_id, key), **settings}
+            self._put(doc)
+        return doc
+
+    async def find(self, project_id):
+        rows = self.conn.execute("SELECT doc FROM property_schemas WHERE project_id = ? ORDER BY key", (project_id,))
+        return [json.loads(r[0]) for r in rows]
+
+    async def delete_project(self, project_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM property_schemas WHERE project_id = ?", (project_id,))
+
+
+class SQLiteRepository:
+    backend = 'sqlite'
+
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        # timeout: several worker processes may share one database file
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        if path != ':memory:':
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SQLITE_SCHEMA)
+        self.tenants = SQLiteTenantStore(self.conn)
+        self.projects = SQLiteProjectStore(self.conn)
+        self.events = SQLiteEventStore(self.conn, path)
+        self.bot_events = SQLiteEventStore(self.conn, path, 'bot_events')
+        self.rollups = SQLiteRollupStore(self.conn)
+        self.dictionaries = SQLiteDictionaryStore(self.conn)
+        self.bitmaps = SQLiteBitmapStore(self.conn)
+        self.properties = SQLitePropertySchemaStore(self.conn)
+
+    async def ensure_schema(self):
+        await self.events.ensure_schema()
+        await self.bot_events.ensure_schema()
+
+    def close(self):
+        self.conn.close()
+
+
+def create_repository(backend: str = 'mongo', **options):
+    """
+    Build the repository for the configured backend.
+
+    mongo options:  mongo_url, db_name, events_mode, events_collection, event_listeners (PyMongo monitoring)
+    sqlite options: sqlite_path
+    all backends:   events_encoding ('full' or 'compact', see compact.py)
+    """
+    if backend == 'mongo':
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(options['mongo_url'], event_listeners=options.get('event_listeners') or [])
+        repo = MongoRepository(client, options['db_name'], options.get('events_mode') or 'standard',
+                               options.get('events_collection'))
+    elif backend == 'sqlite':
+        repo = SQLiteRepository(options.get('sqlite_path') or ':memory:')
+    else:
+        raise ValueError(f"Unknown storage backend '{backend}' (expected one of {', '.join(STORAGE_BACKENDS)})")
+    encoding = options.get('events_encoding') or 'full'
+    if encoding not in EVENT_ENCODINGS:
+        raise ValueError(f"Unknown event encoding '{encoding}' (expected one of {', '.join(EVENT_ENCODINGS)})")
+    if encoding == 'compact':
+        from compact import CompactEventStore
+        repo.events = CompactEventStore(repo.events, repo.dictionaries)
+    return repo
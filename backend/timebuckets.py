@@ -0,0 +1,278 @@
+"""
+Calendar-aligned date ranges.
+
+Analytics ranges are given as `start` / `end` (or "the last `days` days"),
+a timezone (the project's, or `tz`) and a granularity (hour, day, week,
+month). They are snapped to whole calendar buckets in that timezone, so two
+requests for "the last 7 days" made minutes apart share six completed days
+and differ only in the open one:
+
+  - a completed bucket never changes once `settle` has passed and no event
+    acked before its end is still waiting to be stored (enrichment queue,
+    write-ahead log backlog), so its count tables are cached forever
+    (`BucketCache`)
+  - only the open bucket, and the matching partial bucket of the comparison
+    period, are aggregated on every request
+
+Weeks start on Monday. Buckets are iterated in local calendar time and
+converted to UTC, so days are 23 or 25 hours long across DST changes;
+hour buckets are UTC hours labelled in local time.
+"""
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from aggregation import merge_many
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+MAX_BUCKETS = 1000
+
+
+class Bucket(NamedTuple):
+    label: str
+    start: datetime  # UTC
+    end: datetime  # UTC, exclusive
+
+
+def resolve_timezone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone '{name}'")
+
+
+def _floor(local: datetime, granularity: str) -> datetime:
+    """Start of the bucket containing a local wall-clock time (naive)."""
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    day = local.date()
+    if granularity == 'week':
+        day -= timedelta(days=day.weekday())
+    elif granularity == 'month':
+        day = day.replace(day=1)
+    return datetime.combine(day, time.min)
+
+
+def _step(local: datetime, granularity: str, n: int = 1) -> datetime:
+    if granularity == 'hour':
+        return local + timedelta(hours=n)
+    if granularity == 'day':
+        return local + timedelta(days=n)
+    if granularity == 'week':
+        return local + timedelta(weeks=n)
+    month = local.year * 12 + local.month - 1 + n
+    return local.replace(year=month // 12, month=month % 12 + 1)
+
+
+def _label(local: datetime, granularity: str) -> str:
+    if granularity == 'hour':
+        return local.strftime('%Y-%m-%dT%H:00')
+    if granularity == 'month':
+        return local.strftime('%Y-%m')
+    return local.date().isoformat()
+
+
+def _parse(value: str, tz: ZoneInfo) -> datetime:
+    """ISO date or datetime, in `tz` unless it carries an offset; returns a naive local time."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}' (expected YYYY-MM-DD or an ISO-8601 datetime)")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(tz).replace(tzinfo=None)
+    return parsed
+
+
+class TimeRange:
+    """Whole buckets from `first` (local bucket start) covering up to `end` (UTC, exclusive)."""
+
+    def __init__(self, first: datetime, count: int, end: datetime, tz: ZoneInfo, granularity: str):
+        self.tz = tz
+        self.granularity = granularity
+        self.buckets = self._buckets(first, count)
+        self.start = self.buckets[0].start
+        # Requested end, never later than the end of the last bucket
+        self.end = min(end, self.buckets[-1].end)
+        # Ends at the time of the request ("last N days"), so `end` moves on with every request
+        self.open = False
+
+    def _buckets(self, first: datetime, count: int) -> List[Bucket]:
+        if self.granularity == 'hour':
+            # UTC hours: local wall-clock hours repeat / vanish across DST changes
+            start = first.replace(tzinfo=self.tz).astimezone(timezone.utc)
+            return [Bucket(_label((start + timedelta(hours=i)).astimezone(self.tz), 'hour'),
+                           start + timedelta(hours=i), start + timedelta(hours=i + 1)) for i in range(count)]
+        buckets = []
+        local = first
+        for _ in range(count):
+            following = _step(local, self.granularity)
+            buckets.append(Bucket(_label(local, self.granularity),
+                                  local.replace(tzinfo=self.tz).astimezone(timezone.utc),
+                                  following.replace(tzinfo=self.tz).astimezone(timezone.utc)))
+            local = following
+        return buckets
+
+    @property
+    def first_local(self) -> datetime:
+        return self.buckets[0].start.astimezone(self.tz).replace(tzinfo=None)
+
+    @property
+    def days(self) -> int:
+        return max(1, round((self.buckets[-1].end - self.start).total_seconds() / 86400))
+
+    def previous(self) -> 'TimeRange':
+        """
+        The same number of buckets just before this range; when this range
+        ends inside its last bucket, the previous one ends at the same offset.
+        """
+        count = len(self.buckets)
+        first = _floor(self.first_local, self.granularity)
+        prev = TimeRange(_step(first, self.granularity, -count), count,
+                         datetime.max.replace(tzinfo=timezone.utc), self.tz, self.granularity)
+        prev.end = min(prev.buckets[-1].end, prev.buckets[-1].start + (self.end - self.buckets[-1].start))
+        return prev
+
+    def key(self) -> tuple:
+        # An open range is keyed by its last bucket: a key with the exact end would never repeat
+        end = f"open:{self.buckets[-1].label}" if self.open else self.end.isoformat()
+        return (self.start.isoformat(), end, str(self.tz), self.granularity)
+
+    def label_of(self, timestamp: Any) -> str:
+        """Bucket label of an event timestamp (ISO string or datetime)."""
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return _label(_floor(timestamp.astimezone(self.tz).replace(tzinfo=None), self.granularity), self.granularity)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "start": self.start.astimezone(self.tz).isoformat(),
+            "end": self.end.astimezone(self.tz).isoformat(),
+            "timezone": str(self.tz),
+            "granularity": self.granularity,
+        }
+
+
+def resolve_range(start: Optional[str] = None, end: Optional[str] = None, days: int = 7,
+                  tz: Optional[str] = None, granularity: str = 'day', now: Optional[datetime] = None) -> TimeRange:
+    """
+    Snap a requested range to calendar buckets in `tz`.
+
+    `start` / `end` are ISO dates or datetimes; a date `end` is inclusive
+    (the whole day). Without `start` the range is the last `days` days,
+    today included. The range never extends past now.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    zone = resolve_timezone(tz)
+    now = now or datetime.now(timezone.utc)
+    local_now = now.astimezone(zone).replace(tzinfo=None)
+
+    if end is None:
+        local_end = local_now
+    else:
+        local_end = _parse(end, zone)
+        if len(end) == 10:
+            local_end += timedelta(days=1)
+        local_end = min(local_end, local_now)
+    if start is None:
+        if days < 1:
+            raise ValueError("days must be at least 1")
+        last_day = (local_end - timedelta(microseconds=1)).date()
+        local_start = datetime.combine(last_day - timedelta(days=days - 1), time.min)
+    else:
+        local_start = _parse(start, zone)
+    if local_start >= local_end:
+        raise ValueError("start must be before end (and not in the future)")
+
+    first = _floor(local_start, granularity)
+    end_utc = local_end.replace(tzinfo=zone).astimezone(timezone.utc)
+    if granularity == 'hour':
+        elapsed = end_utc - first.replace(tzinfo=zone).astimezone(timezone.utc)
+        count = -(-int(elapsed.total_seconds()) // 3600)
+    else:
+        count = 0
+        local = first
+        while local < local_end and count <= MAX_BUCKETS:
+            local = _step(local, granularity)
+            count += 1
+    if count > MAX_BUCKETS:
+        raise ValueError(f"A range can span at most {MAX_BUCKETS} {granularity} buckets")
+    time_range = TimeRange(first, count, end_utc, zone, granularity)
+    time_range.open = local_end == local_now
+    return time_range
+
+
+class CalendarCounts:
+    """
+    Count tables over a TimeRange, per bucket: settled buckets come from
+    the BucketCache, the rest from `compute(project_ids, start, end,
+    totals_only)`, which returns {project_id: counts} for several projects at
+    once so tenant-wide views cost one query per uncached bucket.
+    """
+
+    def __init__(self, compute: Callable[..., Awaitable[Dict[str, Dict[str, Any]]]], cache,
+                 settle: timedelta = timedelta(minutes=5),
+                 pending_since: Optional[Callable[[], Optional[datetime]]] = None):
+        self.compute = compute
+        self.cache = cache
+        self.settle = settle
+        # Timestamp of the oldest acked event not stored yet (None when nothing is pending)
+        self.pending_since = pending_since
+
+    def settled_before(self, now: Optional[datetime] = None) -> datetime:
+        """Buckets ending at or before this instant can no longer receive events."""
+        cutoff = (now or datetime.now(timezone.utc)) - self.settle
+        pending = self.pending_since() if self.pending_since is not None else None
+        return min(cutoff, pending) if pending is not None else cutoff
+
+    def is_sealed(self, time_range: TimeRange, now: Optional[datetime] = None) -> bool:
+        """Whether every bucket of the range is settled, i.e. its results can never change."""
+        return time_range.end <= self.settled_before(now)
+
+    async def bucket_counts(self, project_ids: List[str], bucket: Bucket, end: datetime, settled: datetime,
+                            totals_only: bool = False) -> Dict[str, Dict[str, Any]]:
+        if bucket.end > end:
+            return await self.compute(project_ids, bucket.start, end, totals_only=totals_only)
+        if bucket.end > settled:
+            return await self.compute(project_ids, bucket.start, bucket.end, totals_only=totals_only)
+        out = {}
+        for project_id in project_ids:
+            cached = await self.cache.get(project_id, bucket.start, bucket.end)
+            if cached is not None:
+                out[project_id] = cached
+        missing = [project_id for project_id in project_ids if project_id not in out]
+        if missing:
+            # Full tables even for totals_only callers: the entries serve every later request
+            computed = await self.compute(missing, bucket.start, bucket.end, totals_only=False)
+            for project_id in missing:
+                await self.cache.set(project_id, bucket.start, bucket.end, computed[project_id])
+            out.update(computed)
+        return out
+
+    async def counts_many(self, project_ids: List[str], time_range: TimeRange, totals_only: bool = False,
+                          now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+        """{project_id: merged count tables}, with `daily` keyed by bucket label (the traffic series)."""
+        settled = self.settled_before(now)
+        tables: Dict[str, List[Dict[str, Any]]] = {project_id: [] for project_id in project_ids}
+        series: Dict[str, Dict[str, int]] = {project_id: {} for project_id in project_ids}
+        for bucket in time_range.buckets:
+            counts = {}
+            if bucket.start < time_range.end and project_ids:
+                counts = await self.bucket_counts(project_ids, bucket, time_range.end, settled, totals_only)
+            for project_id in project_ids:
+                table = counts.get(project_id)
+                if table is not None:
+                    tables[project_id].append(table)
+                total = table['total_events'] if table is not None else 0
+                series[project_id][bucket.label] = series[project_id].get(bucket.label, 0) + total
+        out = {}
+        for project_id in project_ids:
+            out[project_id] = merge_many(tables[project_id])
+            out[project_id]['daily'] = series[project_id]
+        return out
+
+    async def counts(self, project_id: str, time_range: TimeRange, totals_only: bool = False,
+                     now: Optional[datetime] = None) -> Dict[str, Any]:
+        return (await self.counts_many([project_id], time_range, totals_only, now))[project_id]
@@ -0,0 +1,64 @@
+"""
+Page URL canonicalization.
+
+The same page reached with tracking parameters, a fragment, a trailing
+slash or an upper-case host would otherwise be counted as several pages.
+`UrlCanonicalizer` maps all of them to one canonical URL at ingest:
+
+  - scheme and host lower-cased, default ports (:80 / :443) removed
+  - tracking parameters removed (utm_*, gclid, fbclid, ... configurable,
+    a trailing '*' matches a prefix), remaining parameters sorted
+  - fragment removed, trailing slash removed (except for the root path)
+
+Configured with URL_CANONICALIZE, URL_STRIP_PARAMS, URL_KEEP_QUERY and
+URL_KEEP_FRAGMENT.
+"""
+from typing import Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_STRIP_PARAMS = (
+    'utm_*', 'gclid', 'gbraid', 'wbraid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'twclid', 'ttclid',
+    'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi', 'mkt_tok', 'oly_anon_id', 'oly_enc_id',
+    'vero_id', 'rb_clickid', 's_cid',
+)
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+class UrlCanonicalizer:
+    def __init__(self, strip_params: Iterable[str] = DEFAULT_STRIP_PARAMS, keep_query: bool = True,
+                 keep_fragment: bool = False, strip_trailing_slash: bool = True):
+        patterns = [p.strip().lower() for p in strip_params if p.strip()]
+        self.strip_exact = frozenset(p for p in patterns if not p.endswith('*'))
+        self.strip_prefixes = tuple(p[:-1] for p in patterns if p.endswith('*'))
+        self.keep_query = keep_query
+        self.keep_fragment = keep_fragment
+        self.strip_trailing_slash = strip_trailing_slash
+
+    def _stripped(self, param: str) -> bool:
+        param = param.lower()
+        return param in self.strip_exact or param.startswith(self.strip_prefixes)
+
+    def __call__(self, url: Optional[str]) -> Optional[str]:
+        if not url:
+            return url
+        try:
+            parts = urlsplit(url.strip())
+            port = parts.port
+        except ValueError:
+            return url
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc.lower()
+        if port is not None and DEFAULT_PORTS.get(scheme) == str(port):
+            netloc = netloc.rsplit(':', 1)[0]
+
+        path = parts.path or ('/' if netloc else '')
+        if self.strip_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+
+        query = ''
+        if self.keep_query and parts.query:
+            params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not self._stripped(k)]
+            query = urlencode(sorted(params))
+
+        fragment = parts.fragment if self.keep_fragment else ''
+        return urlunsplit((scheme, netloc, path, query, fragment))
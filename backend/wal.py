@@ -0,0 +1,411 @@
+"""
+Local write-ahead log for ingestion.
+
+`track_event` appends raw events to an append-only log on local disk and
+acknowledges them once they are durable, so a slow or unavailable database
+never shows up as tracking latency (or lost events). Appends are group
+committed: every append waiting within the same flush is written and
+fsync'd together.
+
+The log is split into numbered segment files (`<seq>.wal`, one JSON record
+per line). A `WalShipper` drains it in order into the event store, retrying
+with exponential backoff while the database is unavailable, and records its
+progress in `checkpoint.json`; fully shipped segments are deleted. Segments
+left behind by a previous run are replayed from the checkpoint on startup.
+
+Delivery is at-least-once: a batch that fails after a partial write is
+shipped again.
+
+Every worker process keeps its own log in a `worker-<n>` subdirectory of
+the configured directory, held with an exclusive lock (`lock`) for as long
+as the process runs. On start a worker claims the first free subdirectory
+(or creates one) and takes over every other unlocked one, i.e. the logs of
+workers that are gone, by moving their unshipped segments into its own log.
+Segments written directly into the configured directory by releases that
+used a single shared log are taken over the same way.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from storage import to_iso
+
+logger = logging.getLogger(__name__)
+
+Position = Tuple[int, int]  # (segment sequence number, byte offset)
+
+
+WORKER_PREFIX = 'worker-'
+
+
+def _segments_in(directory: Path) -> List[int]:
+    return sorted(int(p.stem) for p in directory.glob('*.wal') if p.stem.isdigit())
+
+
+def _try_lock(directory: Path):
+    """Exclusive lock on `directory/lock`, or None when another process holds it (or the directory is gone)."""
+    path = directory / 'lock'
+    try:
+        f = open(path, 'a')
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # A lock file unlinked by a worker taking the directory over is not the directory's lock anymore
+        if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+            return f
+    except (BlockingIOError, FileNotFoundError):
+        pass
+    f.close()
+    return None
+
+
+class WriteAheadLog:
+    def __init__(self, root: Path, segment_bytes: int = 64 * 1024 * 1024,
+                 flush_interval: float = 0.005, fsync: bool = True):
+        self.root = Path(root)
+        # This process's own log, claimed on start
+        self.directory: Optional[Path] = None
+        self._lock = None
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.checkpoint: Position = (0, 0)
+        self._pending: List[Tuple[bytes, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._file = None
+        self._active_seq = 0
+        self._active_size = 0
+        self.appended = 0
+        self.flushes = 0
+
+    # ---------- files ----------
+
+    def _path(self, seq: int) -> Path:
+        return self.directory / f"{seq:012d}.wal"
+
+    def segments(self) -> List[int]:
+        return _segments_in(self.directory) if self.directory is not None else []
+
+    def _load_checkpoint(self, directory: Path) -> Position:
+        try:
+            data = json.loads((directory / 'checkpoint.json').read_text())
+            return int(data['segment']), int(data['offset'])
+        except FileNotFoundError:
+            return 0, 0
+        except Exception as e:
+            logger.error(f"[WAL] ✗ Unreadable checkpoint, replaying everything on disk: {e}")
+            return 0, 0
+
+    def _save_checkpoint(self, position: Position):
+        tmp = self.directory / 'checkpoint.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({"segment": position[0], "offset": position[1]}, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, self.directory / 'checkpoint.json')
+
+    def _open_segment(self, seq: int):
+        if self._file is not None:
+            self._file.close()
+        self._active_seq = seq
+        self._file = open(self._path(seq), 'ab')
+        self._active_size = self._file.tell()
+
+    # ---------- ownership ----------
+
+    def _worker_dirs(self) -> List[Path]:
+        return sorted((p for p in self.root.glob(f'{WORKER_PREFIX}*') if p.name[len(WORKER_PREFIX):].isdigit()),
+                      key=lambda p: int(p.name[len(WORKER_PREFIX):]))
+
+    def _claim(self):
+        """Lock the first free worker directory, or a new one."""
+        while True:
+            dirs = self._worker_dirs()
+            for directory in dirs:
+                lock = _try_lock(directory)
+                if lock is not None:
+                    self.directory, self._lock = directory, lock
+                    return
+            number = int(dirs[-1].name[len(WORKER_PREFIX):]) + 1 if dirs else 0
+            try:
+                (self.root / f'{WORKER_PREFIX}{number}').mkdir()
+            except FileExistsError:
+                pass  # Another worker starting at the same time took the number; look again
+
+    def _take_over(self, orphan: Path, next_seq: int) -> int:
+        """Move the unshipped segments of a log nobody holds into this one; returns the next free sequence number."""
+        lock = _try_lock(orphan)
+        if lock is None:
+            return next_seq
+        try:
+            seq, offset = self._load_checkpoint(orphan)
+            moved = 0
+            for segment in _segments_in(orphan):
+                source = orphan / f"{segment:012d}.wal"
+                if segment > seq or (segment == seq and offset == 0):
+                    os.replace(source, self._path(next_seq))
+                elif segment == seq:
+                    # Partly shipped: keep only what follows the checkpoint
+                    with open(source, 'rb') as src, open(self._path(next_seq), 'wb') as dst:
+                        src.seek(offset)
+                        shutil.copyfileobj(src, dst)
+                        dst.flush()
+                        if self.fsync:
+                            os.fsync(dst.fileno())
+                    source.unlink()
+                else:
+                    source.unlink()
+                    continue
+                next_seq += 1
+                moved += 1
+            (orphan / 'checkpoint.json').unlink(missing_ok=True)
+            if moved:
+                logger.info(f"[WAL] Took over {moved} unshipped segment(s) from {orphan}")
+            if orphan != self.root:
+                (orphan / 'lock').unlink(missing_ok=True)
+                try:
+                    orphan.rmdir()
+                except OSError:
+                    pass
+        finally:
+            lock.close()
+        return next_seq
+
+    # ---------- lifecycle ----------
+
+    async def start(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._claim()
+        self.checkpoint = self._load_checkpoint(self.directory)
+        existing = self.segments()
+        next_seq = max(existing[-1] if existing else 0, self.checkpoint[0]) + 1
+        # Logs of workers that are gone (and a shared log from older releases) are shipped by this one
+        for orphan in [self.root] + [d for d in self._worker_dirs() if d != self.directory]:
+            next_seq = self._take_over(orphan, next_seq)
+        # Always write into a fresh segment; whatever is on disk is sealed and only read from now on
+        self._open_segment(next_seq)
+        backlog = [seq for seq in self.segments() if seq >= self.checkpoint[0] and seq != self._active_seq]
+        if backlog:
+            logger.info(f"[WAL] Replaying {len(backlog)} unshipped segment(s) from {self.directory}")
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        if self._pending:
+            self._write([line for line, _ in self._pending])
+            self._resolve(self._pending, None)
+            self._pending = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    # ---------- writing ----------
+
+    async def append(self, record: Dict[str, Any]):
+        """Append one record and return once it is on disk."""
+        line = (json.dumps({"t": time.time(), "r": record}, default=to_iso, separators=(',', ':')) + '\n').encode()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((line, future))
+        self._wakeup.set()
+        await future
+
+    def _write(self, lines: List[bytes]):
+        data = b''.join(lines)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._active_size += len(data)
+        if self._active_size >= self.segment_bytes:
+            self._open_segment(self._active_seq + 1)
+
+    @staticmethod
+    def _resolve(batch, error: Optional[Exception]):
+        for _, future in batch:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            # Let concurrent appends pile up so they share one fsync
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if not batch:
+                continue
+            try:
+                await loop.run_in_executor(None, self._write, [line for line, _ in batch])
+                self.appended += len(batch)
+                self.flushes += 1
+                self._resolve(batch, None)
+            except Exception as e:
+                logger.error(f"[WAL] ✗ Write failed: {e}")
+                self._resolve(batch, e)
+
+    # ---------- reading ----------
+
+    def read(self, position: Position, max_records: int) -> Tuple[List[Tuple[float, Dict[str, Any]]], Position]:
+        """Up to `max_records` durable (timestamp, record) pairs after `position`, and the position after them."""
+        records: List[Tuple[float, Dict[str, Any]]] = []
+        seq, offset = position
+        for segment in self.segments():
+            if segment < seq:
+                continue
+            if segment > seq:
+                seq, offset = segment, 0
+            active = segment == self._active_seq
+            limit = self._active_size if active else None
+            with open(self._path(segment), 'rb') as f:
+                f.seek(offset)
+                while len(records) < max_records and (limit is None or offset < limit):
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        if line and not active:
+                            logger.warning(f"[WAL] ⚠ Skipping torn record at end of segment {segment}")
+                        break
+                    offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                        records.append((entry['t'], entry['r']))
+                    except Exception:
+                        logger.warning(f"[WAL] ⚠ Skipping corrupt record in segment {segment} at offset {offset}")
+            if len(records) >= max_records or active:
+                break
+        return records, (seq, offset)
+
+    def commit(self, position: Position):
+        """Record that everything before `position` is shipped and delete finished segments."""
+        self._save_checkpoint(position)
+        self.checkpoint = position
+        for segment in self.segments():
+            if segment < position[0] and segment != self._active_seq:
+                self._path(segment).unlink(missing_ok=True)
+
+    # ---------- monitoring ----------
+
+    def stats(self) -> Dict[str, Any]:
+        seq, offset = self.checkpoint
+        disk_bytes = unshipped = 0
+        count = 0
+        for segment in self.segments():
+            size = self._path(segment).stat().st_size
+            disk_bytes += size
+            count += 1
+            if segment > seq:
+                unshipped += size
+            elif segment == seq:
+                unshipped += max(0, size - offset)
+        return {
+            "segments": count,
+            "disk_bytes": disk_bytes,
+            "unshipped_bytes": unshipped,
+            "appended": self.appended,
+            "flushes": self.flushes,
+        }
+
+
+class WalShipper:
+    """Drains the log into `sink` in order, retrying failed batches with exponential backoff."""
+
+    def __init__(self, wal: WriteAheadLog, sink: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+                 batch_size: int = 1000, poll_interval: float = 0.05,
+                 min_backoff: float = 0.5, max_backoff: float = 30.0,
+                 lag_warning_seconds: float = 60.0, disk_warning_bytes: int = 1024 * 1024 * 1024):
+        self.wal = wal
+        self.sink = sink
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.lag_warning_seconds = lag_warning_seconds
+        self.disk_warning_bytes = disk_warning_bytes
+        self.shipped = 0
+        self.failures = 0
+        self.oldest_unshipped: Optional[float] = None
+        self._warned_at = 0.0
+
+    def lag_seconds(self) -> float:
+        return time.time() - self.oldest_unshipped if self.oldest_unshipped else 0.0
+
+    async def ship_once(self) -> int:
+        """Ship one batch; returns the number of records shipped (raises if the sink fails)."""
+        loop = asyncio.get_running_loop()
+        records, position = await loop.run_in_executor(None, self.wal.read, self.wal.checkpoint, self.batch_size)
+        if not records:
+            self.oldest_unshipped = None
+            if position != self.wal.checkpoint:
+                await loop.run_in_executor(None, self.wal.commit, position)
+            return 0
+        self.oldest_unshipped = records[0][0]
+        await self.sink([record for _, record in records])
+        await loop.run_in_executor(None, self.wal.commit, position)
+        self.shipped += len(records)
+        return len(records)
+
+    def _check_health(self):
+        now = time.time()
+        if now - self._warned_at < 60:
+            return
+        lag = self.lag_seconds()
+        disk = self.wal.stats()["disk_bytes"]
+        if lag > self.lag_warning_seconds or disk > self.disk_warning_bytes:
+            logger.warning(f"[WAL] ⚠ Shipping is behind: lag {lag:.0f}s, {disk} bytes on disk")
+            self._warned_at = now
+
+    async def run(self):
+        backoff = self.min_backoff
+        while True:
+            try:
+                shipped = await self.ship_once()
+                backoff = self.min_backoff
+                if shipped < self.batch_size:
+                    await asyncio.sleep(self.poll_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"[WAL] ✗ Shipping failed, retrying in {backoff:.1f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            self._check_health()
+
+    async def drain(self, timeout: float = 10.0):
+        """Ship what is left (used on shutdown); stops at the first failure or after `timeout`."""
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline and await self.ship_once():
+                pass
+        except Exception as e:
+            logger.error(f"[WAL] ✗ Unshipped events stay on disk until the next start: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.wal.stats(),
+            "shipped": self.shipped,
+            "failures": self.failures,
+            "lag_seconds": round(self.lag_seconds(), 3),
+        }
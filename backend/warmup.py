@@ -0,0 +1,100 @@
+"""
+Startup warm-up and readiness.
+
+Importing `server` only builds objects; anything slow (storage schema and
+index checks, opening the GeoIP database and the IP range index) is a
+warm-up step run in the background once the application has started, so
+the port is bound and /api/health/live answers within the import time.
+/api/health/ready answers 200 only when every step has finished, so a
+load balancer or orchestrator routes traffic to a worker once it is warm
+rather than once it has imported. Work that depends on the steps (storing
+tracked events: unique id indexes, GeoIP lookups) checks `ready` or awaits
+`wait()` itself, since traffic can arrive before the orchestrator looks.
+
+Steps run concurrently. A step that raises is retried with backoff (storage
+may come up after the API); steps for optional data (no GeoIP database
+installed) should return a detail such as 'unavailable' instead of raising.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Heavy optional dependencies only needed by some configurations or at warm-up: `import server` must not load them
+LAZY_MODULES = ['geoip2', 'pyarrow', 'boto3', 'botocore', 'google.genai', 'google.generativeai', 'huggingface_hub',
+                'litellm', 'openai']
+
+
+class WarmUp:
+    def __init__(self, retry_seconds: float = 5.0, max_retry_seconds: float = 60.0):
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._steps: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self.status: Dict[str, Dict[str, Any]] = {}
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, run: Callable[[], Awaitable[Any]]):
+        """Register a step; `run` may return a short detail (e.g. 'unavailable') for the readiness report."""
+        self._steps.append((name, run))
+        self.status[name] = {"status": "pending"}
+
+    def start(self):
+        self.started = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def wait(self):
+        """Return once every step has finished."""
+        await asyncio.shield(self._task)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        await asyncio.gather(*(self._step(*step) for step in self._steps))
+        self.finished = time.monotonic()
+        logger.info(f"✓ Warm-up finished in {self.finished - self.started:.2f}s")
+
+    async def _step(self, name: str, run: Callable[[], Awaitable[Any]]):
+        entry = self.status[name]
+        delay = self.retry_seconds
+        while True:
+            entry["status"] = 'running'
+            t0 = time.perf_counter()
+            try:
+                detail = await run()
+            except Exception as e:
+                entry["seconds"] = round(time.perf_counter() - t0, 3)
+                entry["error"] = str(e)
+                entry["attempts"] = entry.get("attempts", 0) + 1
+                entry["status"] = 'retrying'
+                logger.error(f"✗ Warm-up step {name} failed: {e} (retrying in {delay:g}s)")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_seconds)
+                continue
+            entry["seconds"] = round(time.perf_counter() - t0, 3)
+            entry.pop("error", None)
+            if detail is not None:
+                entry["detail"] = detail
+            entry["status"] = 'done'
+            return
+
+    @property
+    def ready(self) -> bool:
+        return self.finished is not None
+
+    def report(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "status": "ready" if self.ready else "warming_up",
+            "seconds": round(((self.finished or now) - self.started), 3) if self.started is not None else None,
+            "steps": self.status,
+        }
@@ -1,6 +1,10 @@
 import requests
+import os
+import socket
 import sys
+import threading
 from datetime import datetime
+from pathlib import Path
 import time
 
 class AnalyticsPlatformTester:
@@ -333,12 +337,34 @@ class AnalyticsPlatformTester:
         print("\n" + "="*60)
         return len(self.failed_tests) == 0
 
+def start_local_server():
+    """Run server.py in-process on the embedded sqlite backend (no MongoDB needed)"""
+    os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+    os.environ.setdefault('SQLITE_PATH', ':memory:')
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    import uvicorn
+    import server
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    local_server = uvicorn.Server(uvicorn.Config(server.app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=local_server.run, daemon=True).start()
+    while not local_server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/api"
+
 def main():
     print("="*60)
     print("🚀 SignalVista Analytics Platform - Backend API Tests")
     print("="*60)
     
-    base_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000/api"
+    # Usage: python backend_test.py [BASE_URL | --local]
+    if len(sys.argv) > 1 and sys.argv[1] == '--local':
+        base_url = start_local_server()
+    else:
+        base_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000/api"
     print(f"📍 Base URL: {base_url}\n")
     
     tester = AnalyticsPlatformTester(base_url)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Retention matrix latency: sealed visitor bitmaps vs a raw event scan.
+
+Loads synthetic events (visitors drawn from a fixed pool so they return
+across weeks) into a scratch sqlite database and computes a weekly
+retention matrix two ways:
+
+  - bitmaps: `CohortEngine.retention` after the completed days have been
+    sealed (what the API does); the one-off sealing time is reported too
+  - raw scan baseline: load the whole range and build per-week visitor
+    sets from the events on every query
+
+Checks both give the same matrix.
+
+    python benchmarks/bench_cohorts.py --events 300000 --visitors 40000 --weeks 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from cohorts import CohortEngine, visitor_key  # noqa: E402
+from compact import DictionaryCache  # noqa: E402
+from storage import create_repository  # noqa: E402
+from synthetic import generate_events  # noqa: E402
+
+
+async def raw_scan(repo, project_id, weeks, now):
+    today = now.date()
+    first = today - timedelta(days=today.weekday() + 7 * (weeks - 1))
+    start = datetime.combine(first, datetime.min.time(), tzinfo=timezone.utc)
+    active = [set() for _ in range(weeks)]
+    seen = set()
+    for e in await repo.events.find_range(project_id, start - timedelta(days=180), limit=None):
+        key = visitor_key(e)
+        if not key:
+            continue
+        day = datetime.fromisoformat(e['timestamp']).date()
+        if day < first:
+            seen.add(key)
+        elif day <= today:
+            active[(day - first).days // 7].add(key)
+    retained = []
+    for p in range(weeks):
+        cohort = active[p] - seen
+        seen |= active[p]
+        retained.append([len(cohort)] + [len(cohort & active[q]) for q in range(p + 1, weeks)])
+    return retained
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=300000)
+    parser.add_argument('--visitors', type=int, default=40000)
+    parser.add_argument('--weeks', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    project_id = 'bench-project'
+    now = datetime.now(timezone.utc)
+    rng = random.Random(41)
+    pool = [f"{rng.getrandbits(64):016x}" for _ in range(args.visitors)]
+    with tempfile.TemporaryDirectory(prefix='bench-cohorts-') as workdir:
+        repo = create_repository('sqlite', sqlite_path=os.path.join(workdir, 'cohorts.db'))
+        await repo.ensure_schema()
+        batch = []
+        for event in generate_events(args.events, project_id=project_id, days=7 * args.weeks, seed=41, end=now):
+            event['ip_hash'] = pool[int(rng.paretovariate(1.2)) % len(pool)]
+            batch.append(event)
+            if len(batch) == 5000:
+                await repo.events.insert_many(batch)
+                batch = []
+        await repo.events.insert_many(batch)
+
+        engine = CohortEngine(repo, DictionaryCache(repo.dictionaries))
+        t0 = time.perf_counter()
+        sealed = await engine.seal_project(project_id, now)
+        seal_seconds = time.perf_counter() - t0
+
+        timings = {"bitmaps": [], "raw_scan": []}
+        for _ in range(args.queries):
+            t0 = time.perf_counter()
+            matrix = await engine.retention(project_id, 'week', args.weeks, now)
+            timings["bitmaps"].append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            baseline = await raw_scan(repo, project_id, args.weeks, now)
+            timings["raw_scan"].append(time.perf_counter() - t0)
+        repo.close()
+
+    runs = {name: {"median_ms": round(sorted(ts)[len(ts) // 2] * 1000, 1)} for name, ts in timings.items()}
+    for name, run in runs.items():
+        print(f"{name}: median {run['median_ms']} ms", file=sys.stderr)
+    results = {
+        "events": args.events,
+        "visitors": args.visitors,
+        "weeks": args.weeks,
+        "sealed_days": sealed,
+        "seal_seconds": round(seal_seconds, 2),
+        "identical": [c["retained"] for c in matrix["cohorts"]] == baseline,
+        "runs": runs,
+        "average_retention": matrix["average_retention"],
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Compare the 'full' and 'compact' event encodings.
+
+Loads the same synthetic events with each encoding and reports stored bytes
+per event and the time to scan a 30-day window and aggregate it (the
+overview path). Runs on scratch sqlite files by default, or against MongoDB
+with --mongo-url.
+
+    python benchmarks/bench_event_encoding.py --events 100000
+    python benchmarks/bench_event_encoding.py --events 100000 --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from aggregation import aggregate_events  # noqa: E402
+from storage import EVENT_ENCODINGS, create_repository  # noqa: E402
+from synthetic import generate_events  # noqa: E402
+
+
+def open_repo(args, encoding, workdir):
+    if args.mongo_url:
+        return create_repository('mongo', mongo_url=args.mongo_url, db_name=f"{args.db}_{encoding}",
+                                 events_encoding=encoding)
+    return create_repository('sqlite', sqlite_path=os.path.join(workdir, f"{encoding}.db"), events_encoding=encoding)
+
+
+async def stored_bytes(repo):
+    if repo.backend == 'sqlite':
+        conn = repo.conn
+        doc_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(doc)), 0) FROM events").fetchone()[0]
+        dict_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM dictionaries").fetchone()[0]
+        return {"documents": doc_bytes, "dictionaries": dict_bytes}
+    stats = await repo.events.storage_stats()
+    dict_stats = await repo.db.command("collStats", "dictionaries")
+    return {"documents": stats.get("size"), "dictionaries": dict_stats.get("size", 0),
+            "storage_size": stats.get("storage_size")}
+
+
+async def bench_encoding(args, encoding, events, workdir):
+    repo = open_repo(args, encoding, workdir)
+    if args.mongo_url:
+        await repo.client.drop_database(repo.db.name)
+    await repo.ensure_schema()
+
+    t0 = time.perf_counter()
+    for i in range(0, len(events), 5000):
+        await repo.events.insert_many(events[i:i + 5000])
+    load_seconds = time.perf_counter() - t0
+
+    start = datetime.now(timezone.utc) - timedelta(days=30)
+    scans = []
+    for _ in range(args.repeats):
+        # A fresh store each time: the dictionary cache starts cold, as after a restart
+        repo_cold = open_repo(args, encoding, workdir)
+        t0 = time.perf_counter()
+        docs = await repo_cold.events.find_range(args.project, start, limit=None)
+        aggregate_events(docs)
+        scans.append((time.perf_counter() - t0) * 1000)
+        repo_cold.close()
+
+    size = await stored_bytes(repo)
+    if args.mongo_url:
+        await repo.client.drop_database(repo.db.name)
+    repo.close()
+    return {
+        "encoding": encoding,
+        "load_seconds": round(load_seconds, 2),
+        "bytes_per_event": round((size["documents"] + size["dictionaries"]) / len(events), 1),
+        "stored_bytes": size,
+        "scan_30d_p50_ms": round(statistics.median(scans), 1),
+        "scan_30d_min_ms": round(min(scans), 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--project', default='bench-project')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--mongo-url', default=None)
+    parser.add_argument('--db', default='analytics_bench_encoding')
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    events = list(generate_events(args.events, project_id=args.project, days=90, seed=38))
+    results = {"events": len(events), "backend": 'mongo' if args.mongo_url else 'sqlite', "encodings": []}
+    with tempfile.TemporaryDirectory(prefix='bench-encoding-') as workdir:
+        for encoding in EVENT_ENCODINGS:
+            print(f"Benchmarking {encoding}...", file=sys.stderr)
+            results["encodings"].append(await bench_encoding(args, encoding, events, workdir))
+
+    full, compact = results["encodings"]
+    results["size_ratio"] = round(compact["bytes_per_event"] / full["bytes_per_event"], 3)
+    results["scan_ratio"] = round(compact["scan_30d_p50_ms"] / full["scan_30d_p50_ms"], 3)
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Compare the 'standard' and 'timeseries' event storage modes.
+
+Loads the same synthetic events into both layouts in a scratch database and
+reports range-query latency (the overview query shape) and disk usage.
+Requires a MongoDB server that supports time-series collections (5.0+).
+
+    python benchmarks/bench_event_storage.py --mongo-url mongodb://localhost:27017 --events 100000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from storage import STORAGE_MODES, create_event_store  # noqa: E402
+from synthetic import generate_events  # noqa: E402
+
+
+async def bench_mode(db, mode, events, projects, windows, repeats):
+    store = create_event_store(db, mode, f"bench_events_{mode}")
+    await store.collection.drop()
+    await store.ensure_schema()
+
+    t0 = time.perf_counter()
+    for i in range(0, len(events), 5000):
+        await store.insert_many(events[i:i + 5000])
+    load_seconds = time.perf_counter() - t0
+
+    now = datetime.now(timezone.utc)
+    latencies = {}
+    for days in windows:
+        samples = []
+        for r in range(repeats):
+            project_id = projects[r % len(projects)]
+            t0 = time.perf_counter()
+            await store.find_range(project_id, now - timedelta(days=days), limit=None)
+            samples.append((time.perf_counter() - t0) * 1000)
+        latencies[f"{days}d"] = {
+            "p50_ms": round(statistics.median(samples), 2),
+            "max_ms": round(max(samples), 2),
+        }
+
+    stats = await store.storage_stats()
+    await store.collection.drop()
+    return {
+        "mode": mode,
+        "load_seconds": round(load_seconds, 2),
+        "query_latency": latencies,
+        "storage": stats,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017')
+    parser.add_argument('--db', default='analytics_bench')
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--projects', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    projects = [f"bench-project-{i}" for i in range(args.projects)]
+    per_project = args.events // args.projects
+    events = []
+    for i, project_id in enumerate(projects):
+        events.extend(generate_events(per_project, project_id=project_id, days=90, seed=i))
+
+    client = AsyncIOMotorClient(args.mongo_url)
+    db = client[args.db]
+    results = {"events": len(events), "projects": args.projects, "modes": []}
+    try:
+        for mode in STORAGE_MODES:
+            print(f"Benchmarking {mode}...", file=sys.stderr)
+            results["modes"].append(await bench_mode(db, mode, events, projects, (7, 30, 90), args.repeats))
+    finally:
+        client.close()
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
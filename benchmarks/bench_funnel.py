@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Funnel engine throughput and memory.
+
+Loads synthetic events into a scratch sqlite database and runs a
+'/pricing -> /signup -> signup_click' funnel two ways:
+
+  - streamed: `EventStore.scan_sessions` batches through the funnel state
+    machine (what the API does)
+  - in-memory baseline: load the whole range, group events per session in
+    a dict, sort each session and run the same state machine
+
+Reports wall time, events/s and the peak Python heap of each (tracemalloc),
+and checks both give the same result.
+
+    python benchmarks/bench_funnel.py --events 200000 --sessions 50000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from funnels import Funnel, StepPredicate  # noqa: E402
+from storage import create_repository  # noqa: E402
+from synthetic import generate_events  # noqa: E402
+
+
+def make_funnel(window_seconds):
+    return Funnel([
+        StepPredicate(page='/pricing', event_type='pageview'),
+        StepPredicate(page='/signup', event_type='pageview'),
+        StepPredicate(event_type='custom', event_name='signup_click'),
+    ], window_seconds)
+
+
+async def streamed(repo, project_id, start, window, batch_size):
+    return await make_funnel(window).run(repo.events.scan_sessions(project_id, start, batch_size=batch_size))
+
+
+async def in_memory(repo, project_id, start, window):
+    events = await repo.events.find_range(project_id, start, limit=None)
+    sessions = {}
+    for e in events:
+        sessions.setdefault(e['session_id'], []).append(e)
+    ordered = []
+    for sid in sorted(sessions):
+        ordered.extend(sorted(sessions[sid], key=lambda e: e['timestamp']))
+
+    async def one_batch():
+        yield ordered
+    return await make_funnel(window).run(one_batch())
+
+
+async def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = await fn()
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--sessions', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--window-hours', type=float, default=24)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    project_id = 'bench-project'
+    with tempfile.TemporaryDirectory(prefix='bench-funnel-') as workdir:
+        repo = create_repository('sqlite', sqlite_path=os.path.join(workdir, 'funnel.db'))
+        events = generate_events(args.events, project_id=project_id, days=args.days, seed=40,
+                                 sessions=args.sessions)
+        batch = []
+        for event in events:
+            batch.append(event)
+            if len(batch) == 5000:
+                await repo.events.insert_many(batch)
+                batch = []
+        await repo.events.insert_many(batch)
+
+        start = datetime.now(timezone.utc) - timedelta(days=args.days + 1)
+        window = args.window_hours * 3600
+        runs = {}
+        for name, fn in (('streamed', lambda: streamed(repo, project_id, start, window, args.batch_size)),
+                         ('in_memory', lambda: in_memory(repo, project_id, start, window))):
+            result, seconds, peak = await measure(fn)
+            runs[name] = {
+                "seconds": round(seconds, 2),
+                "events_per_second": round(result["events_scanned"] / seconds),
+                "peak_heap_mb": round(peak / 1e6, 1),
+                "result": result,
+            }
+            print(f"{name}: {seconds:.2f}s, {runs[name]['events_per_second']} events/s, "
+                  f"peak heap {runs[name]['peak_heap_mb']} MB", file=sys.stderr)
+        repo.close()
+
+    results = {
+        "events": args.events,
+        "sessions": args.sessions,
+        "identical": runs['streamed']['result'] == runs['in_memory']['result'],
+        "runs": runs,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
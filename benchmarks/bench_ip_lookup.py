@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+IP -> country lookup latency of the offline range index.
+
+Builds an index of random ranges the size of the RIR data (or opens a real
+one with --index), then measures:
+
+  - open: mmap the file (what each API / enrichment worker does at start)
+  - lookup_v4 / lookup_v6: `IpRangeIndex.lookup` per address
+  - enrich_batch: events per second through the enrichment stage with the
+    index installed and no GeoIP database
+  - geoip2: the GeoLite2 reader, when --geoip points at a database
+
+Lookups are checked against a linear scan of the ranges for a sample.
+
+    python benchmarks/bench_ip_lookup.py --v4-ranges 200000 --v6-ranges 100000
+"""
+import argparse
+import ipaddress
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from enrichment import enrich_batch, open_geoip_reader, set_geoip_reader, set_ip_index  # noqa: E402
+from iprange import IpRangeIndex, build_index  # noqa: E402
+
+COUNTRIES = ['US', 'CN', 'JP', 'DE', 'GB', 'FR', 'KR', 'BR', 'IN', 'CA', 'IT', 'AU', 'NL', 'RU', 'ES',
+             'SE', 'PL', 'MX', 'ZA', 'AR', 'NG', 'EG', 'ID', 'TR', 'VN']
+
+
+def random_ranges(rng, version, count):
+    bits = 32 if version == 4 else 128
+    starts = sorted(rng.sample(range(0, 2 ** bits, 2 ** (bits - 32)), count * 2))
+    # Every other interval is allocated, leaving gaps of unknown space
+    return [(version, starts[i], starts[i + 1] - 1, rng.choice(COUNTRIES)) for i in range(0, len(starts), 2)]
+
+
+def expected_country(ranges, value):
+    for _, first, last, country in ranges:
+        if first <= value <= last:
+            return country
+    return None
+
+
+def time_per_call(fn, items):
+    t0 = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - t0) / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--v4-ranges', type=int, default=200000)
+    parser.add_argument('--v6-ranges', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--index', default=None, help="Benchmark an existing ip_ranges.bin instead")
+    parser.add_argument('--geoip', default=None, help="GeoLite2-Country.mmdb to compare against")
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(45)
+    v4 = v6 = []
+    with tempfile.TemporaryDirectory(prefix='bench-ip-') as workdir:
+        path = args.index
+        if path is None:
+            v4 = random_ranges(rng, 4, args.v4_ranges)
+            v6 = random_ranges(rng, 6, args.v6_ranges)
+            path = os.path.join(workdir, 'ip_ranges.bin')
+            t0 = time.perf_counter()
+            Path(path).write_bytes(build_index(v4 + v6))
+            build_seconds = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        index = IpRangeIndex.open(path)
+        open_ms = (time.perf_counter() - t0) * 1000
+
+        v4_ips = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(args.lookups)]
+        v6_ips = [str(ipaddress.IPv6Address((rng.getrandbits(32) << 96) | rng.getrandbits(96)))
+                  for _ in range(args.lookups)]
+        runs = {
+            "lookup_v4": {"us_per_lookup": round(time_per_call(index.lookup, v4_ips) * 1e6, 2)},
+            "lookup_v6": {"us_per_lookup": round(time_per_call(index.lookup, v6_ips) * 1e6, 2)},
+        }
+
+        mismatches = None
+        if v4:
+            sample = rng.sample(v4_ips, 300)
+            mismatches = sum(index.country(ip) != expected_country(v4, int(ipaddress.IPv4Address(ip)))
+                             for ip in sample)
+            sample = rng.sample(v6_ips, 300)
+            mismatches += sum(index.country(ip) != expected_country(v6, int(ipaddress.IPv6Address(ip)))
+                              for ip in sample)
+
+        set_geoip_reader(None)
+        set_ip_index(index)
+        events = [{"project_id": "bench", "_client_ip": ip, "_anonymize_ip": True, "user_agent": "Mozilla/5.0"}
+                  for ip in v4_ips[:50000]]
+        t0 = time.perf_counter()
+        for i in range(0, len(events), 500):
+            enrich_batch(events[i:i + 500])
+        runs["enrich_batch"] = {"events_per_second": round(len(events) / (time.perf_counter() - t0))}
+        set_ip_index(None)
+
+        if args.geoip:
+            reader = open_geoip_reader(args.geoip)
+            if reader is not None:
+                def geoip_lookup(ip):
+                    try:
+                        return reader.country(ip)
+                    except Exception:
+                        return None
+                runs["geoip2"] = {"us_per_lookup": round(time_per_call(geoip_lookup, v4_ips) * 1e6, 2)}
+                reader.close()
+        stats = {**index.stats(), "bytes": os.path.getsize(path)}
+        index.close()
+
+    for name, run in runs.items():
+        print(f"{name}: {run}", file=sys.stderr)
+    results = {
+        "index": stats,
+        "open_ms": round(open_ms, 3),
+        "lookups": args.lookups,
+        "mismatches": mismatches,
+        "runs": runs,
+    }
+    if args.index is None:
+        results["build_seconds"] = round(build_seconds, 2)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
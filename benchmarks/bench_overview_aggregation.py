@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Compare the pure-Python overview aggregation loop with the vectorized
+NumPy path on synthetic events (no database involved).
+
+    python benchmarks/bench_overview_aggregation.py --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from aggregation import aggregate_events, build_overview, empty_counts  # noqa: E402
+from columnar import aggregate_columnar  # noqa: E402
+from synthetic import generate_events  # noqa: E402
+
+AGGREGATORS = {
+    'python': aggregate_events,
+    'numpy': aggregate_columnar,
+}
+
+
+def best_of(fn, events, repeats):
+    best = None
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn(events)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        events = list(generate_events(size, days=90, seed=size))
+        row = {"events": size}
+        overviews = {}
+        for name, fn in AGGREGATORS.items():
+            seconds, counts = best_of(fn, events, args.repeats)
+            row[f"{name}_ms"] = round(seconds * 1000, 1)
+            overviews[name] = build_overview(counts, empty_counts())
+        row["speedup"] = round(row["python_ms"] / row["numpy_ms"], 2) if row["numpy_ms"] else None
+        row["identical"] = overviews['python'] == overviews['numpy']
+        print(f"{size:>10} events: python {row['python_ms']} ms, numpy {row['numpy_ms']} ms "
+              f"(x{row['speedup']}, identical={row['identical']})", file=sys.stderr)
+        results.append(row)
+
+    output = json.dumps({"benchmark": "overview_aggregation", "results": results}, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
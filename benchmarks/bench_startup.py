@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Cold start budget: time to import `server`, and time until a worker is ready.
+
+Measures, each in a fresh interpreter:
+
+  - import: `import server` (median of --runs), plus the slowest modules it
+    imports (from `python -X importtime`)
+  - live / ready: seconds from launching `uvicorn server:app` until
+    /api/health/live answers and until /api/health/ready reports the
+    warm-up (storage schema / index checks, GeoIP and IP range data) done,
+    with the duration of each warm-up step
+
+and fails (exit 1) when the import or ready time is over its budget, or
+when importing `server` loads a module that must stay lazy (--lazy: heavy
+optional dependencies only needed by some configurations or at warm-up).
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --import-budget-ms 800 --ready-budget-ms 3000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from loadtest_workers import free_port  # noqa: E402
+from warmup import LAZY_MODULES  # noqa: E402
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import server
+seconds = time.perf_counter() - t0
+print(json.dumps({"seconds": seconds, "modules": [m for m in sys.argv[1:] if m in sys.modules]}))
+"""
+
+
+def import_once(env, lazy):
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', CHILD, *lazy], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if out.returncode != 0:
+        raise RuntimeError(f"import server failed:\n{out.stderr[-2000:]}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = wall
+    return result
+
+
+def import_breakdown(env, top):
+    """Slowest modules imported by `server` (cumulative microseconds, first import only)."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import server'], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Modules imported directly by server are indented one level below it
+        if cumulative.strip().isdigit() and name.startswith('   ') and not name.startswith('     '):
+            rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "ms": round(us / 1000, 1)} for us, name in rows[:top]]
+
+
+def time_to_ready(env, timeout):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}/api"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    live = None
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                if live is None and httpx.get(f"{base}/health/live", timeout=1).status_code == 200:
+                    live = time.perf_counter() - t0
+                if live is not None:
+                    r = httpx.get(f"{base}/health/ready", timeout=1)
+                    if r.status_code == 200:
+                        return {"live_seconds": round(live, 3), "ready_seconds": round(time.perf_counter() - t0, 3),
+                                "warm_up": r.json()}
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    raise RuntimeError(f"server not ready after {timeout}s (live: {live})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="Fresh-interpreter imports to time")
+    parser.add_argument('--backend', choices=['sqlite', 'mongo'], default='sqlite')
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017')
+    parser.add_argument('--import-budget-ms', type=float, default=1500, help="Median `import server` time allowed")
+    parser.add_argument('--ready-budget-ms', type=float, default=5000, help="Launch to /api/health/ready allowed")
+    parser.add_argument('--lazy', nargs='*', default=LAZY_MODULES, help="Modules `import server` must not load")
+    parser.add_argument('--top', type=int, default=15, help="Slowest imports to report")
+    parser.add_argument('--skip-server', action='store_true', help="Only time the import")
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-startup-')
+    env = dict(os.environ, STORAGE_BACKEND=args.backend, SQLITE_PATH=os.path.join(workdir, 'analytics.db'))
+    if args.backend == 'mongo':
+        env.update(MONGODB_URI=args.mongo_url, DB_NAME=f"bench_startup_{os.getpid()}")
+
+    # First run compiles bytecode; it is reported but not part of the median
+    first = import_once(env, args.lazy)
+    runs = [import_once(env, args.lazy) for _ in range(args.runs)]
+    results = {
+        "import": {
+            "first_ms": round(first["seconds"] * 1000, 1),
+            "median_ms": round(statistics.median(r["seconds"] for r in runs) * 1000, 1),
+            "max_ms": round(max(r["seconds"] for r in runs) * 1000, 1),
+            "process_median_ms": round(statistics.median(r["process_seconds"] for r in runs) * 1000, 1),
+            "lazy_modules_loaded": sorted(set(first["modules"]).union(*(r["modules"] for r in runs))),
+            "slowest": import_breakdown(env, args.top),
+        },
+    }
+    print(f"import server: median {results['import']['median_ms']} ms", file=sys.stderr)
+    if not args.skip_server:
+        try:
+            results["server"] = time_to_ready(env, timeout=max(60, args.ready_budget_ms / 1000 * 4))
+        finally:
+            if args.backend == 'mongo':
+                from pymongo import MongoClient
+                with MongoClient(args.mongo_url) as client:
+                    client.drop_database(env['DB_NAME'])
+        print(f"live after {results['server']['live_seconds']}s, ready after {results['server']['ready_seconds']}s",
+              file=sys.stderr)
+
+    failures = []
+    if results["import"]["median_ms"] > args.import_budget_ms:
+        failures.append(f"import median {results['import']['median_ms']} ms > budget {args.import_budget_ms} ms")
+    if "server" in results and results["server"]["ready_seconds"] * 1000 > args.ready_budget_ms:
+        failures.append(f"ready after {results['server']['ready_seconds'] * 1000:.0f} ms > budget {args.ready_budget_ms} ms")
+    for module in results["import"]["lazy_modules_loaded"]:
+        failures.append(f"import server loads {module}")
+    results["budget"] = {"import_ms": args.import_budget_ms, "ready_ms": args.ready_budget_ms, "failures": failures}
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+    for line in failures:
+        print(f"OVER BUDGET {line}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("Within startup budget", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
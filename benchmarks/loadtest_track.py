@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Open-loop load test of /api/track against one server worker, with an SLO.
+
+Starts `server.py` (one uvicorn worker, embedded sqlite store) and replays
+synthetic tracking traffic (`generate_traffic` payloads spread over
+--projects projects) at each --rates step for --duration seconds. Requests
+are sent on a fixed schedule whatever the server does (open loop), and
+latency is measured from the scheduled send time, so a server falling
+behind shows up as growing latency instead of a slower client (no
+coordinated omission). At most --concurrency requests are in flight per
+client process; requests waiting for a slot keep their clock running.
+
+Per step: achieved throughput, p50/p95/p99/p99.9 latency, error rate, and
+the enrichment queue depth / events stored per second read from
+/api/health/ingest (acked is not stored: a growing queue means the worker
+cannot keep up even while latency looks fine). The saturation curve ends
+with the highest rate whose p99 and error rate are within the SLO.
+
+--batch-sizes runs the whole curve once per server ENRICHMENT_BATCH_SIZE
+(events enriched and written per bulk write); --clients splits the load
+over several client processes when one cannot generate it.
+
+    python benchmarks/loadtest_track.py --rates 200 500 1000 2000 4000 --slo-p99-ms 50
+    python benchmarks/loadtest_track.py --batch-sizes 100 500 2000 --projects 50 --clients 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from loadtest_workers import free_port, percentile, start_server  # noqa: E402
+from run_suite import setup_tenant  # noqa: E402
+from synthetic import generate_traffic, tracking_payload  # noqa: E402
+
+
+async def open_loop(base_url, payloads, rate, concurrency, arrivals, seed):
+    """Send `payloads` at `rate` per second; returns (latencies ms from schedule, errors, status counts)."""
+    rng = random.Random(seed)
+    latencies = []
+    statuses = {}
+    slots = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        async def send(payload, scheduled):
+            async with slots:
+                try:
+                    r = await client.post('/track', json=payload)
+                    status = str(r.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+            latencies.append((time.perf_counter() - scheduled) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        tasks = []
+        start = time.perf_counter()
+        scheduled = start
+        for payload in payloads:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(payload, scheduled)))
+            scheduled += rng.expovariate(rate) if arrivals == 'poisson' else 1 / rate
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+def client_shard(base_url, payloads, rate, concurrency, arrivals, seed):
+    return asyncio.run(open_loop(base_url, payloads, rate, concurrency, arrivals, seed))
+
+
+async def ingest_health(base_url):
+    async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+        # The server inherits this environment, METRICS_TOKEN included
+        token = os.environ.get('METRICS_TOKEN')
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        return (await client.get('/health/ingest', headers=headers)).json()['enrichment']
+
+
+def run_step(base_url, projects, rate, args, pool, step):
+    count = max(1, int(rate * args.duration))
+    codes = {p['id']: p['tracking_code'] for p in projects}
+    shards = [[] for _ in range(args.clients)]
+    events = generate_traffic(count, projects=list(codes), days=1, seed=args.seed + step)
+    for i, event in enumerate(events):
+        shards[i % args.clients].append(tracking_payload(event, codes[event['project_id']]))
+
+    before = asyncio.run(ingest_health(base_url))
+    futures = [pool.submit(client_shard, base_url, shard, rate / args.clients, args.concurrency, args.arrivals,
+                           args.seed + step * 1000 + i) for i, shard in enumerate(shards)]
+    latencies, statuses, elapsed = [], {}, 0.0
+    for future in futures:
+        shard_latencies, shard_statuses, shard_elapsed = future.result()
+        latencies.extend(shard_latencies)
+        for status, n in shard_statuses.items():
+            statuses[status] = statuses.get(status, 0) + n
+        elapsed = max(elapsed, shard_elapsed)
+    after = asyncio.run(ingest_health(base_url))
+
+    latencies.sort()
+    errors = sum(n for status, n in statuses.items() if not status.startswith('2'))
+    return {
+        "target_rps": rate,
+        "achieved_rps": round(len(latencies) / elapsed, 1),
+        "requests": len(latencies),
+        "error_rate": round(errors / len(latencies), 4),
+        "statuses": statuses,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "p999_ms": round(percentile(latencies, 99.9), 2),
+        "max_ms": round(latencies[-1], 2),
+        "stored_per_second": round((after['enriched'] - before['enriched']) / elapsed, 1),
+        "queued_after": after['queued'],
+    }
+
+
+def within_slo(step, args):
+    return step["p99_ms"] <= args.slo_p99_ms and step["error_rate"] <= args.slo_error_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', type=float, nargs='+', default=[100, 250, 500, 1000, 2000, 4000])
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per rate step")
+    parser.add_argument('--concurrency', type=int, default=256, help="Max in-flight requests per client process")
+    parser.add_argument('--clients', type=int, default=1, help="Client processes sharing the load")
+    parser.add_argument('--projects', type=int, default=5)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[500], help="Server ENRICHMENT_BATCH_SIZE values")
+    parser.add_argument('--enrichment-mode', choices=['inline', 'thread', 'process'], default='thread')
+    parser.add_argument('--arrivals', choices=['uniform', 'poisson'], default='poisson')
+    parser.add_argument('--slo-p99-ms', type=float, default=50)
+    parser.add_argument('--slo-error-rate', type=float, default=0.001)
+    parser.add_argument('--stop-after-breach', type=int, default=2, help="Stop a curve after this many steps over the SLO")
+    parser.add_argument('--seed', type=int, default=49)
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    results = {"slo": {"p99_ms": args.slo_p99_ms, "error_rate": args.slo_error_rate},
+               "duration": args.duration, "concurrency": args.concurrency, "clients": args.clients,
+               "projects": args.projects, "arrivals": args.arrivals, "enrichment_mode": args.enrichment_mode,
+               "cpu_count": os.cpu_count(), "curves": []}
+    with ProcessPoolExecutor(args.clients) as pool:
+        for batch_size in args.batch_sizes:
+            workdir = tempfile.mkdtemp(prefix='loadtest-track-')
+            # Synthetic clients would trip the ingest rate limits and the bot rate heuristic
+            env = dict(os.environ, STORAGE_BACKEND='sqlite', SQLITE_PATH=os.path.join(workdir, 'analytics.db'),
+                       ENRICHMENT_MODE=args.enrichment_mode, ENRICHMENT_BATCH_SIZE=str(batch_size),
+                       RATE_LIMIT_PROJECT_RPS='0', RATE_LIMIT_IP_RPS='0', BOT_POLICY='allow',
+                       COHORT_SEAL_INTERVAL='0')
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}/api"
+            proc = start_server(1, port, env)
+            steps = []
+            try:
+                _, projects = asyncio.run(_setup(base_url, args.projects))
+                breaches = 0
+                for i, rate in enumerate(args.rates):
+                    step = run_step(base_url, projects, rate, args, pool, i)
+                    step["within_slo"] = within_slo(step, args)
+                    steps.append(step)
+                    print(f"batch={batch_size} rate={rate:>7}: {step['achieved_rps']} req/s, p99 {step['p99_ms']} ms, "
+                          f"p99.9 {step['p999_ms']} ms, errors {step['error_rate']:.2%}, "
+                          f"stored {step['stored_per_second']}/s, queued {step['queued_after']}"
+                          f"{'' if step['within_slo'] else '  (over SLO)'}", file=sys.stderr)
+                    breaches += not step["within_slo"]
+                    if breaches >= args.stop_after_breach:
+                        break
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            passing = [s["target_rps"] for s in steps if s["within_slo"]]
+            results["curves"].append({"batch_size": batch_size, "steps": steps,
+                                      "max_rps_within_slo": max(passing) if passing else None})
+
+    for curve in results["curves"]:
+        print(f"batch={curve['batch_size']}: max rate within SLO {curve['max_rps_within_slo']} req/s", file=sys.stderr)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+async def _setup(base_url, projects):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        return await setup_tenant(client, projects)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Throughput scaling with the number of worker processes.
+
+Starts `uvicorn server:app --workers N` on the embedded sqlite backend for
+each N, drives it with a closed-loop async client and reports requests/s and
+latency percentiles per worker count. The default endpoint (overview with the
+result cache disabled) is CPU-bound, so throughput should grow with cores.
+
+    python benchmarks/loadtest_workers.py --workers 1 2 4 --events 20000 --duration 15
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from storage import SQLiteRepository  # noqa: E402
+from synthetic import generate_events  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def start_server(workers, port, env):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/health/ready", timeout=1).status_code == 200:
+                # give every worker a moment to finish booting
+                time.sleep(1 + 0.5 * workers)
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+async def seed(base_url, db_path, events):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        r = await client.post('/auth/register', json={"name": "Load", "email": "load@example.com", "password": "load"})
+        token = r.json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        project = (await client.post('/projects', json={"name": "Load", "domain": "example.com"}, headers=headers)).json()
+
+    repo = SQLiteRepository(db_path)
+    docs = list(generate_events(events, project_id=project['id'], days=7, seed=7))
+    for i in range(0, len(docs), 5000):
+        await repo.events.insert_many(docs[i:i + 5000])
+    repo.close()
+    return token, project
+
+
+async def drive(base_url, request_args, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.request(*request_args[0], **request_args[1])
+                    if r.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 1) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--endpoint', choices=['overview', 'track'], default='overview')
+    parser.add_argument('--events', type=int, default=20000, help="Events seeded for the overview endpoint")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--shared-state-url', default=None, help="e.g. redis://localhost:6379/0")
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    db_path = os.path.join(workdir, 'analytics.db')
+    # One client hammering one project: ingest rate limits and the bot rate heuristic would reject it
+    env = dict(os.environ, STORAGE_BACKEND='sqlite', SQLITE_PATH=db_path, RESPONSE_CACHE_ENTRIES='0',
+               ANALYTICS_ENGINE='events', RATE_LIMIT_PROJECT_RPS='0', RATE_LIMIT_IP_RPS='0', BOT_POLICY='allow')
+    if args.shared_state_url:
+        env['SHARED_STATE_URL'] = args.shared_state_url
+
+    results = {"endpoint": args.endpoint, "events": args.events, "concurrency": args.concurrency,
+               "cpu_count": os.cpu_count(), "runs": []}
+    token = project = None
+    for workers in args.workers:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}/api"
+        proc = start_server(workers, port, env)
+        try:
+            if token is None:
+                token, project = asyncio.run(seed(base_url, db_path, args.events))
+            if args.endpoint == 'overview':
+                request_args = (('GET', f"/analytics/{project['id']}/overview?days=7"),
+                                {"headers": {'Authorization': f'Bearer {token}'}})
+            else:
+                request_args = (('POST', '/track'), {"json": {
+                    "project_id": project['id'], "tracking_code": project['tracking_code'],
+                    "session_id": "load-session", "event_type": "pageview",
+                    "page_url": "https://example.com/", "consent_given": True,
+                }})
+            run = asyncio.run(drive(base_url, request_args, args.concurrency, args.duration))
+            run["workers"] = workers
+            results["runs"].append(run)
+            print(f"workers={workers}: {run['rps']} req/s, p50 {run['p50_ms']} ms, p99 {run['p99_ms']} ms, "
+                  f"errors {run['errors']}", file=sys.stderr)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    base = results["runs"][0]["rps"] if results["runs"] else 0
+    for run in results["runs"]:
+        run["scaling"] = round(run["rps"] / base, 2) if base else None
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""
+Reproducible end-to-end benchmark suite.
+
+Seeds a fresh store with `generate_traffic` events (several projects,
+sessions, returning visitors; fixed seed), starts `server.py` on it and
+measures, all in one JSON document:
+
+  - generate:     synthetic events per second (the harness's own cost)
+  - ingest_store: bulk event writes per second into the store
+  - track:        /api/track requests per second and latency percentiles
+  - overview_7d, overview_30d, overview_hourly, tenant_overview, export_30d,
+    nlq_*:        latency percentiles (first request reported separately)
+  - memory:       peak / final RSS of the server process, peak RSS of the
+                  harness
+
+Backends: the embedded sqlite store (default, no setup) or a local mongod
+(--backend mongo; a scratch database is created and dropped). The server
+runs as a separate process like in production, so an in-process mock such
+as mongomock cannot stand in for mongod; sqlite is the dependency-free
+option. Response and bucket caches are off unless --cache, so latencies
+are those of computing results.
+
+    python benchmarks/run_suite.py --events 100000 --output results.json
+    python benchmarks/run_suite.py --events 100000 --baseline results.json   # exits 1 on regressions
+
+With --baseline, latency percentiles (p50/p95/p99, lower is better) and
+*_per_second metrics (higher is better) are compared against the same ones
+in the baseline file and the run fails when any is worse by more than
+--tolerance. First-request and max latencies are reported, not compared.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from loadtest_workers import free_port, percentile, start_server  # noqa: E402
+from storage import create_repository  # noqa: E402
+from synthetic import batches, generate_traffic, stored, tracking_payload  # noqa: E402
+
+COMPARED_PERCENTILES = ('p50_ms', 'p95_ms', 'p99_ms')
+
+NLQ_QUESTIONS = {
+    "nlq_pageviews": "How many pageviews did we get?",
+    "nlq_top_pages": "What are the top pages?",
+    "nlq_countries": "Which countries do visitors come from?",
+}
+
+
+def summarize(latencies_ms):
+    ordered = sorted(latencies_ms)
+    return {
+        "requests": len(ordered),
+        "p50_ms": round(percentile(ordered, 50), 2),
+        "p95_ms": round(percentile(ordered, 95), 2),
+        "p99_ms": round(percentile(ordered, 99), 2),
+        "max_ms": round(ordered[-1], 2),
+    }
+
+
+def process_memory(pid):
+    """Current and peak resident set size of a process in MiB (Linux /proc)."""
+    out = {}
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                key = 'rss_mib' if line.startswith('VmRSS') else 'peak_rss_mib'
+                out[key] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return out
+
+
+async def setup_tenant(client, projects):
+    r = await client.post('/auth/register', json={"name": "Bench", "email": "bench@example.com", "password": "bench"})
+    token = r.json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    created = []
+    for i in range(projects):
+        r = await client.post('/projects', json={"name": f"Bench {i}", "domain": "example.com"}, headers=headers)
+        created.append(r.json())
+    return headers, created
+
+
+async def seed(repo, project_ids, args, end):
+    """Bulk-write the synthetic events; returns (generate seconds, store seconds)."""
+    generate = store = 0.0
+    events = generate_traffic(args.events, projects=project_ids, days=args.days, seed=args.seed, end=end)
+    while True:
+        t0 = time.perf_counter()
+        batch = next(batches(events, args.batch_size), None)
+        generate += time.perf_counter() - t0
+        if batch is None:
+            return generate, store
+        docs = [stored(e) for e in batch]
+        t0 = time.perf_counter()
+        await repo.events.insert_many(docs)
+        store += time.perf_counter() - t0
+
+
+async def timed(client, method, url, **kwargs):
+    t0 = time.perf_counter()
+    r = await client.request(method, url, **kwargs)
+    elapsed = (time.perf_counter() - t0) * 1000
+    r.raise_for_status()
+    return elapsed
+
+
+async def latency(client, method, url, queries, **kwargs):
+    first = await timed(client, method, url, **kwargs)
+    runs = [await timed(client, method, url, **kwargs) for _ in range(queries)]
+    return {"first_ms": round(first, 2), **summarize(runs)}
+
+
+async def track(client, project, args, end):
+    payloads = [tracking_payload(e, project['tracking_code'])
+                for e in generate_traffic(args.track_requests, projects=(project['id'],), days=1,
+                                          seed=args.seed + 1, end=end)]
+    queue = iter(payloads)
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for payload in queue:
+            t0 = time.perf_counter()
+            try:
+                r = await client.post('/track', json=payload)
+                if r.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - t0
+    return {"requests_per_second": round(len(latencies) / elapsed, 1), "errors": errors, **summarize(latencies)}
+
+
+async def run(args, base_url, repo, server_pid):
+    results = {}
+    end = datetime.now(timezone.utc)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        headers, projects = await setup_tenant(client, args.projects)
+        project_ids = [p['id'] for p in projects]
+
+        generate_s, store_s = await seed(repo, project_ids, args, end)
+        results["generate"] = {"events_per_second": round(args.events / generate_s)}
+        results["ingest_store"] = {"events_per_second": round(args.events / store_s)}
+        print(f"seeded {args.events} events: generate {results['generate']['events_per_second']}/s, "
+              f"store {results['ingest_store']['events_per_second']}/s", file=sys.stderr)
+
+        main = project_ids[0]
+        scenarios = {
+            "overview_7d": ('GET', f"/analytics/{main}/overview?days=7"),
+            "overview_30d": ('GET', f"/analytics/{main}/overview?days=30"),
+            "overview_hourly": ('GET', f"/analytics/{main}/overview?days=2&granularity=hour"),
+            "tenant_overview": ('GET', "/tenant/overview?days=30"),
+            "export_30d": ('GET', f"/analytics/{main}/export?days=30"),
+        }
+        for name, (method, url) in scenarios.items():
+            results[name] = await latency(client, method, url, args.queries, headers=headers)
+            print(f"{name}: {results[name]}", file=sys.stderr)
+        for name, question in NLQ_QUESTIONS.items():
+            results[name] = await latency(client, 'POST', '/nlq', args.queries, headers=headers,
+                                          json={"project_id": main, "question": question, "date_range": "30d"})
+            print(f"{name}: {results[name]}", file=sys.stderr)
+
+        if args.track_requests:
+            results["track"] = await track(client, projects[0], args, end)
+            print(f"track: {results['track']}", file=sys.stderr)
+
+    results["memory"] = {"server": process_memory(server_pid),
+                         "harness_peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if args.backend == 'mongo':
+        await repo.client.drop_database(args.db_name)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Metrics worse than the baseline by more than `tolerance` (a fraction)."""
+    regressions = []
+    for name, metrics in results.items():
+        for key, value in metrics.items():
+            old = baseline.get(name, {}).get(key)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if key in COMPARED_PERCENTILES and value > old * (1 + tolerance):
+                regressions.append(f"{name}.{key}: {old} -> {value}")
+            elif key.endswith('_per_second') and value < old * (1 - tolerance):
+                regressions.append(f"{name}.{key}: {old} -> {value}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100000, help="Synthetic events to seed (10k to 100M)")
+    parser.add_argument('--projects', type=int, default=3)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=48)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=20, help="Timed requests per latency scenario")
+    parser.add_argument('--track-requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--backend', choices=['sqlite', 'mongo'], default='sqlite')
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017')
+    parser.add_argument('--encoding', choices=['full', 'compact'], default='full')
+    parser.add_argument('--cache', action='store_true', help="Keep the response and bucket caches on")
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    parser.add_argument('--baseline', default=None, help="Compare against a previous --output file")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-suite-')
+    # One client tracking at full speed: rate limits and the bot rate heuristic would reject it
+    env = dict(os.environ, STORAGE_BACKEND=args.backend, EVENTS_ENCODING=args.encoding, ANALYTICS_ENGINE='events',
+               RATE_LIMIT_PROJECT_RPS='0', RATE_LIMIT_IP_RPS='0', BOT_POLICY='allow', COHORT_SEAL_INTERVAL='0')
+    if not args.cache:
+        env.update(RESPONSE_CACHE_ENTRIES='0', BUCKET_CACHE_ENTRIES='0')
+    args.db_name = db_name = f"bench_suite_{os.getpid()}"
+    if args.backend == 'sqlite':
+        env['SQLITE_PATH'] = os.path.join(workdir, 'analytics.db')
+        repo = create_repository('sqlite', sqlite_path=env['SQLITE_PATH'], events_encoding=args.encoding)
+    else:
+        env.update(MONGODB_URI=args.mongo_url, DB_NAME=db_name)
+        repo = create_repository('mongo', mongo_url=args.mongo_url, db_name=db_name, events_encoding=args.encoding)
+
+    port = free_port()
+    proc = start_server(1, port, env)
+    try:
+        results = asyncio.run(run(args, f"http://127.0.0.1:{port}/api", repo, proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        repo.close()
+
+    document = {
+        "suite": "analytics",
+        "config": {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'db_name')},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(),
+                        "commit": subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                                 text=True, cwd=BACKEND_DIR).stdout.strip() or None},
+        "results": results,
+    }
+    output = json.dumps(document, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get("config", {}).get("events") != args.events:
+            print("⚠ baseline was run with a different --events", file=sys.stderr)
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Deterministic synthetic event generator shared by the benchmarks.
+
+Events are produced in the stored document shape (see backend/storage.py):
+ISO-8601 `timestamp` strings, hashed IPs, resolved country/continent.
+The same seed always yields the same event stream.
+
+  - generate_events: independent events, uniform in time (aggregation and
+    storage micro-benchmarks)
+  - generate_traffic: visits as they happen on real sites, for suite and
+    load runs from 10k to 100M events in constant memory: returning
+    visitors with a fixed device, country and IP, sessions of a few pages
+    following links from a landing page, daily traffic peaks, campaign
+    tagged URLs, custom events with properties, several projects
+  - tracking_payload: the /api/track request body for a generated event
+"""
+import math
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36 Edg/120.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPad; CPU OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+]
+USER_AGENT_WEIGHTS = [40, 12, 8, 8, 14, 12, 4, 2]
+
+REFERRERS = [
+    None,
+    "https://www.google.com/",
+    "https://mail.google.com/",
+    "https://www.bing.com/",
+    "https://t.co/abc123",
+    "https://www.facebook.com/",
+    "https://www.linkedin.com/feed/",
+    "https://news.ycombinator.com/",
+    "https://duckduckgo.com/",
+]
+REFERRER_WEIGHTS = [45, 20, 5, 4, 6, 6, 4, 6, 4]
+
+PAGES = ["/", "/pricing", "/signup", "/login", "/docs", "/blog", "/about", "/contact"] + [
+    f"/blog/post-{i}" for i in range(40)
+] + [f"/docs/page-{i}" for i in range(40)]
+
+GEO = [
+    ("US", "North America", 30), ("CA", "North America", 5), ("GB", "Europe", 8), ("DE", "Europe", 8),
+    ("FR", "Europe", 5), ("IN", "Asia", 12), ("JP", "Asia", 5), ("CN", "Asia", 5),
+    ("BR", "South America", 6), ("AR", "South America", 2), ("NG", "Africa", 3), ("ZA", "Africa", 2),
+    ("AU", "Oceania", 4), ("XX", None, 5),
+]
+
+EVENT_TYPES = ["pageview", "click", "custom"]
+EVENT_TYPE_WEIGHTS = [70, 20, 10]
+
+
+def _zipf_weights(n, s=1.1):
+    return [1.0 / ((i + 1) ** s) for i in range(n)]
+
+
+def generate_events(count, project_id="bench-project", days=30, seed=42, sessions=None, end=None):
+    """Yield `count` event documents spread uniformly over the last `days` days."""
+    rng = random.Random(seed)
+    end = end or datetime.now(timezone.utc)
+    start = end - timedelta(days=days)
+    span = (end - start).total_seconds()
+    sessions = sessions or max(1, count // 6)
+    page_weights = _zipf_weights(len(PAGES))
+    geo_weights = [g[2] for g in GEO]
+
+    session_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(min(sessions, 100000))]
+
+    for _ in range(count):
+        country, continent, _w = rng.choices(GEO, geo_weights)[0]
+        event_type = rng.choices(EVENT_TYPES, EVENT_TYPE_WEIGHTS)[0]
+        page = rng.choices(PAGES, page_weights)[0]
+        ts = start + timedelta(seconds=rng.random() * span)
+        yield {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "project_id": project_id,
+            "session_id": session_ids[rng.randrange(len(session_ids))],
+            "event_type": event_type,
+            "event_name": "signup_click" if event_type == "custom" else None,
+            "page_url": f"https://example.com{page}",
+            "page_title": page.strip('/').title() or "Home",
+            "referrer": rng.choices(REFERRERS, REFERRER_WEIGHTS)[0],
+            "user_agent": rng.choices(USER_AGENTS, USER_AGENT_WEIGHTS)[0],
+            "country": country,
+            "continent": continent,
+            "ip_hash": f"{rng.getrandbits(64):016x}",
+            "properties": None,
+            "timestamp": ts.isoformat(),
+        }
+
+
+# Hour-of-day traffic shape (UTC), peaking in the afternoon
+HOUR_WEIGHTS = [2, 1.5, 1, 1, 1, 1.5, 2.5, 4, 5.5, 6.5, 7, 7.5, 7.5, 7.5, 7.5, 7, 6.5, 6, 6, 6, 5.5, 5, 4, 3]
+
+CAMPAIGNS = [None] * 8 + ["?utm_source=newsletter&utm_medium=email", "?utm_source=twitter&utm_campaign=launch",
+                          "?gclid=Cj0KCQ", "?ref=producthunt"]
+
+CUSTOM_EVENTS = [
+    ("signup_click", lambda rng: {"plan": rng.choice(["free", "pro", "team"])}),
+    ("purchase", lambda rng: {"revenue": round(rng.lognormvariate(3.5, 0.8), 2),
+                              "plan": rng.choice(["pro", "team"]), "currency": "USD"}),
+    ("video_play", lambda rng: {"video_id": f"v{rng.randrange(50)}", "seconds": rng.randrange(1, 600)}),
+    ("search", lambda rng: {"results": rng.randrange(0, 40)}),
+]
+CUSTOM_EVENT_WEIGHTS = [40, 10, 30, 20]
+
+
+def _synthetic_ip(rng, index):
+    # Documentation / benchmarking ranges, spread over IPv4 and IPv6
+    if index % 5 == 0:
+        return f"2001:db8:{rng.getrandbits(16):x}:{rng.getrandbits(16):x}::{rng.getrandbits(16):x}"
+    return f"198.{18 + rng.getrandbits(1)}.{rng.getrandbits(8)}.{rng.getrandbits(8)}"
+
+
+def generate_traffic(count, projects=("bench-project",), days=30, seed=42, end=None, visitors=None,
+                     pages_per_session=4.0):
+    """
+    Yield `count` events grouped in sessions, in the stored document shape
+    plus `_client_ip` (the visitor's address, for tracking payloads).
+
+    Visitor popularity is Zipf-like, so some come back often; projects get
+    traffic in proportion 1, 1/2, 1/3...; sessions last `pages_per_session`
+    events on average (geometric), a few seconds to minutes apart.
+    """
+    rng = random.Random(seed)
+    end = end or datetime.now(timezone.utc)
+    first_day = (end - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    visitors = visitors or max(1, count // 12)
+    # Cumulative weights: rng.choices does not re-add them on every call
+    page_cum = list(accumulate(_zipf_weights(len(PAGES))))
+    geo_cum = list(accumulate(g[2] for g in GEO))
+    project_cum = list(accumulate(1 / (i + 1) for i in range(len(projects))))
+    hour_cum = list(accumulate(HOUR_WEIGHTS))
+    referrer_cum = list(accumulate(REFERRER_WEIGHTS))
+    ua_cum = list(accumulate(USER_AGENT_WEIGHTS))
+    custom_cum = list(accumulate(CUSTOM_EVENT_WEIGHTS))
+    custom_names = [name for name, _ in CUSTOM_EVENTS]
+    custom_props = dict(CUSTOM_EVENTS)
+    continue_p = 1 - 1 / max(1.0, pages_per_session)
+    visitor_cache = {}
+
+    def visitor(v):
+        # Derived from the visitor number alone, so a visitor looks the same on every visit
+        info = visitor_cache.get(v)
+        if info is None:
+            vr = random.Random(seed * 1000003 + v)
+            country, continent, _ = vr.choices(GEO, cum_weights=geo_cum)[0]
+            info = (vr.choices(USER_AGENTS, cum_weights=ua_cum)[0], country, continent,
+                    _synthetic_ip(vr, v), f"{vr.getrandbits(64):016x}")
+            if len(visitor_cache) >= 100000:
+                visitor_cache.pop(next(iter(visitor_cache)))
+            visitor_cache[v] = info
+        return info
+
+    produced = 0
+    while produced < count:
+        if rng.random() < 0.4:
+            v = min(visitors - 1, int((rng.paretovariate(1.16) - 1) * 25))
+        else:
+            v = rng.randrange(visitors)
+        user_agent, country, continent, ip, ip_hash = visitor(v)
+        project_id = rng.choices(projects, cum_weights=project_cum)[0]
+        session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        day = first_day + timedelta(days=rng.randrange(days))
+        ts = day + timedelta(hours=rng.choices(range(24), cum_weights=hour_cum)[0], seconds=rng.random() * 3600)
+        page = rng.choices(PAGES, cum_weights=page_cum)[0]
+        referrer = rng.choices(REFERRERS, cum_weights=referrer_cum)[0]
+        campaign = rng.choice(CAMPAIGNS)
+        while produced < count and ts < end:
+            if rng.random() < 0.25:
+                event_type, event_name = ("click", None) if rng.random() < 0.6 else (
+                    "custom", rng.choices(custom_names, cum_weights=custom_cum)[0])
+            else:
+                event_type, event_name = "pageview", None
+            url = f"https://example.com{page}{campaign or ''}"
+            yield {
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "project_id": project_id,
+                "session_id": session_id,
+                "event_type": event_type,
+                "event_name": event_name,
+                "page_url": url,
+                "page_title": page.strip('/').title() or "Home",
+                "referrer": referrer,
+                "user_agent": user_agent,
+                "country": country,
+                "continent": continent,
+                "ip_hash": ip_hash,
+                "properties": custom_props[event_name](rng) if event_name else None,
+                "timestamp": ts.isoformat(),
+                "_client_ip": ip,
+            }
+            produced += 1
+            if rng.random() >= continue_p:
+                break
+            ts += timedelta(seconds=-math.log(1 - rng.random()) * 40)
+            if event_type == "pageview":
+                # Following a link: internal referrer, new page, campaign parameters dropped
+                referrer, campaign = url, None
+                page = rng.choices(PAGES, cum_weights=page_cum)[0]
+
+
+def stored(event):
+    """A generate_traffic event as it is stored (without the client IP)."""
+    doc = dict(event)
+    doc.pop('_client_ip', None)
+    return doc
+
+
+def tracking_payload(event, tracking_code):
+    """The /api/track body that would have produced a generated event."""
+    return {
+        "project_id": event["project_id"],
+        "tracking_code": tracking_code,
+        "session_id": event["session_id"],
+        "event_type": event["event_type"],
+        "event_name": event["event_name"],
+        "page_url": event["page_url"],
+        "page_title": event["page_title"],
+        "referrer": event["referrer"],
+        "user_agent": event["user_agent"],
+        "ip_address": event.get("_client_ip"),
+        "properties": event["properties"],
+        "consent_given": True,
+    }
+
+
+def batches(events, size):
+    """Lists of up to `size` items from an iterator."""
+    events = iter(events)
+    while True:
+        batch = list(islice(events, size))
+        if not batch:
+            return
+        yield batch
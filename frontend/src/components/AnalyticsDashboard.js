@@ -13,12 +13,22 @@ export default function AnalyticsDashboard({ projectId }) {
   const [searchTerm, setSearchTerm] = useState('');
   const [hoveredContinent, setHoveredContinent] = useState(null);
   const [tooltipPos, setTooltipPos] = useState({ x: 0, y: 0 });
+  const [liveStats, setLiveStats] = useState(null);
   const mapRef = useRef(null);
 
   useEffect(() => {
     fetchAnalytics();
   }, [projectId, dateRange]);
 
+  // Live visitors stream (Server-Sent Events); EventSource cannot send headers, so pass the token as a query param
+  useEffect(() => {
+    const token = localStorage.getItem('token');
+    if (!token || typeof EventSource === 'undefined') return;
+    const source = new EventSource(`${axios.defaults.baseURL}/analytics/${projectId}/live?token=${encodeURIComponent(token)}`);
+    source.addEventListener('live', (e) => setLiveStats(JSON.parse(e.data)));
+    return () => source.close();
+  }, [projectId]);
+
   const fetchAnalytics = async () => {
     try {
       const response = await axios.get(`/analytics/${projectId}/overview?days=${dateRange}`);
@@ -116,6 +126,12 @@ export default function AnalyticsDashboard({ projectId }) {
         <div>
           <h1 className="text-3xl font-bold text-slate-900 mb-2">Analytics Dashboard</h1>
           <p className="text-slate-600">Track your website performance and visitor insights</p>
+          {liveStats && (
+            <p className="text-sm text-green-700 mt-1 flex items-center gap-2" data-testid="live-visitors">
+              <span className="w-2 h-2 bg-green-500 rounded-full animate-pulse" />
+              {liveStats.active_sessions} active now · {liveStats.pageviews} pageviews in the last {Math.round(liveStats.window_seconds / 60)} min
+            </p>
+          )}
         </div>
         <div className="flex gap-3">
           <select
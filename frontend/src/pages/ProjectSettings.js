@@ -48,24 +48,34 @@ export default function ProjectSettings({ user, onLogout }) {
       sessionStorage.setItem('df_session', sessionId);
     }
     
-    // Track function
-    window.SignalVista.track = function(eventType, eventData) {
+    // Send an event; a server still warming up answers 503, so retry a few times
+    function send(body, attempt) {
       fetch(window.SignalVista.apiUrl + '/track', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          project_id: window.SignalVista.projectId,
-          tracking_code: window.SignalVista.trackingCode,
-          session_id: sessionId,
-          event_type: eventType,
-          page_url: window.location.href,
-          page_title: document.title,
-          referrer: document.referrer,
-          user_agent: navigator.userAgent,
-          consent_given: true,
-          ...eventData
-        })
-      });
+        body: body
+      }).then(function(response) {
+        if (response.status === 503 && attempt < 3) {
+          var seconds = parseInt(response.headers.get('Retry-After'), 10) || 1;
+          setTimeout(function() { send(body, attempt + 1); }, seconds * 1000);
+        }
+      }).catch(function() {});
+    }
+    
+    // Track function
+    window.SignalVista.track = function(eventType, eventData) {
+      send(JSON.stringify({
+        project_id: window.SignalVista.projectId,
+        tracking_code: window.SignalVista.trackingCode,
+        session_id: sessionId,
+        event_type: eventType,
+        page_url: window.location.href,
+        page_title: document.title,
+        referrer: document.referrer,
+        user_agent: navigator.userAgent,
+        consent_given: true,
+        ...eventData
+      }), 0);
     };
     
     // Auto-track pageview
@@ -1,97 +1,78 @@
 #!/usr/bin/env python
 """
-Migration script to add continent data to existing events in MongoDB
+Re-derive the continent of stored events from their country.
+
+Events geolocated before the offline IP range index existed got a made-up
+continent (a digit sum of the IP) and, without a GeoIP database, a country
+guessed from the first octet. Raw IPs are never stored, so countries cannot
+be looked up again, but continents can be made consistent with them: one
+bulk update per country, unknown countries ('XX') get no continent.
+
+Usage:
+    python migrate_continents.py --dry-run
+    python migrate_continents.py --mode timeseries --encoding compact
+
+Updating non-meta fields of a time-series collection needs MongoDB 7.0+.
 """
+import argparse
 import asyncio
 import os
+import sys
+from pathlib import Path
+
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
-from pathlib import Path
 
 ROOT_DIR = Path(__file__).parent / 'backend'
 load_dotenv(ROOT_DIR / '.env')
+sys.path.insert(0, str(ROOT_DIR))
 
-CONTINENTS_FALLBACK = ['North America', 'Europe', 'Asia', 'South America', 'Africa', 'Oceania']
+from compact import SHORT_KEYS  # noqa: E402
+from iprange import continent_of  # noqa: E402
+from storage import STORAGE_MODES, create_event_store  # noqa: E402
 
-async def migrate_continents():
-    """Add continent data to events based on IP address"""
-    mongo_url = os.environ.get('MONGO_URL')
+
+async def migrate_continents(mode='standard', collection=None, encoding='full', dry_run=False):
+    """Set `continent` from `country` on every event whose continent does not match it."""
+    mongo_url = os.environ.get('MONGODB_URI')
     db_name = os.environ.get('DB_NAME')
-    
+
     if not mongo_url or not db_name:
-        print("❌ Missing MONGO_URL or DB_NAME in environment")
+        print("❌ Missing MONGODB_URI or DB_NAME in environment")
         return
-    
+
     client = AsyncIOMotorClient(mongo_url)
-    db = client[db_name]
-    
+    store = create_event_store(client[db_name], mode, collection)
+    country_field, continent_field = 'country', 'continent'
+    if encoding == 'compact':
+        country_field, continent_field = SHORT_KEYS['country'], SHORT_KEYS['continent']
+
     try:
-        # Find all events without continent data
-        events_collection = db['events']
-        
-        # Count events without continent
-        events_without_continent = await events_collection.count_documents({
-            "$or": [
-                {"continent": {"$exists": False}},
-                {"continent": None},
-                {"continent": ""}
-            ]
-        })
-        
-        print(f"📊 Found {events_without_continent} events without continent data")
-        
-        if events_without_continent == 0:
-            print("✅ All events already have continent data!")
-            return
-        
-        # Update events with continent data based on IP hash
-        cursor = events_collection.find({
-            "$or": [
-                {"continent": {"$exists": False}},
-                {"continent": None},
-                {"continent": ""}
-            ]
-        })
-        
-        updated_count = 0
-        async for event in cursor:
-            ip_address = event.get('ip_hash')
-            
-            if ip_address:
-                # Use IP hash to determine continent consistently
-                ip_int = sum(int(c) for c in ip_address if c.isdigit()) if ip_address else 0
-                continent = CONTINENTS_FALLBACK[ip_int % len(CONTINENTS_FALLBACK)]
+        countries = await store.collection.distinct(country_field)
+        print(f"📊 {len(countries)} countries in '{store.collection_name}'")
+        updated = 0
+        for country in countries:
+            continent = continent_of(country)
+            query = {country_field: country, continent_field: {"$ne": continent}}
+            if dry_run:
+                count = await store.collection.count_documents(query)
             else:
-                # Default continent if no IP info
-                continent = 'North America'
-            
-            await events_collection.update_one(
-                {"_id": event["_id"]},
-                {"$set": {"continent": continent}}
-            )
-            updated_count += 1
-            
-            if updated_count % 100 == 0:
-                print(f"   Updated {updated_count} events...")
-        
-        print(f"✅ Successfully updated {updated_count} events with continent data!")
-        
-        # Verify the update
-        remaining = await events_collection.count_documents({
-            "$or": [
-                {"continent": {"$exists": False}},
-                {"continent": None},
-                {"continent": ""}
-            ]
-        })
-        print(f"📊 Remaining events without continent: {remaining}")
-        
+                count = (await store.collection.update_many(query, {"$set": {continent_field: continent}})).modified_count
+            if count:
+                print(f"   {country}: {count} events -> {continent or 'no continent'}")
+            updated += count
+        print(f"✅ {'Would update' if dry_run else 'Updated'} {updated} events")
     except Exception as e:
         print(f"❌ Error during migration: {e}")
     finally:
         client.close()
 
+
 if __name__ == "__main__":
-    print("🚀 Starting continent data migration...")
-    asyncio.run(migrate_continents())
-    print("✨ Migration complete!")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=STORAGE_MODES, default=os.environ.get('EVENTS_STORAGE_MODE', 'standard'))
+    parser.add_argument('--collection', default=os.environ.get('EVENTS_COLLECTION') or None)
+    parser.add_argument('--encoding', choices=('full', 'compact'), default=os.environ.get('EVENTS_ENCODING', 'full'))
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    asyncio.run(migrate_continents(args.mode, args.collection, args.encoding, args.dry_run))
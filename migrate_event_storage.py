@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Migrate events between storage modes (regular collection <-> time-series collection).
+
+Usage:
+    python migrate_event_storage.py --to timeseries
+    python migrate_event_storage.py --to standard --drop-source
+
+Time-series collections cannot be renamed, so each mode owns its own
+collection ('events' / 'events_ts' by default). After migrating, set
+EVENTS_STORAGE_MODE in backend/.env to the target mode and restart the API.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent / 'backend'
+load_dotenv(ROOT_DIR / '.env')
+sys.path.insert(0, str(ROOT_DIR))
+
+from storage import STORAGE_MODES, create_event_store  # noqa: E402
+
+
+async def migrate_event_storage(source_mode, target_mode, source_collection=None, target_collection=None,
+                                batch_size=1000, drop_source=False):
+    """Copy every event from the source store into the target store in batches."""
+    mongo_url = os.environ.get('MONGODB_URI')
+    db_name = os.environ.get('DB_NAME')
+
+    if not mongo_url or not db_name:
+        print("❌ Missing MONGODB_URI or DB_NAME in environment")
+        return
+
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+
+    source = create_event_store(db, source_mode, source_collection)
+    target = create_event_store(db, target_mode, target_collection)
+    if source.collection_name == target.collection_name:
+        print("❌ Source and target collections are the same")
+        client.close()
+        return
+
+    try:
+        await target.ensure_schema()
+        total = await source.collection.count_documents({})
+        print(f"📊 {total} events in '{source.collection_name}' ({source.mode}) -> "
+              f"'{target.collection_name}' ({target.mode})")
+
+        copied = 0
+        batch = []
+        async for doc in source.collection.find({}, {"_id": 0}):
+            batch.append(source._decode(doc))
+            if len(batch) >= batch_size:
+                await target.insert_many(batch)
+                copied += len(batch)
+                batch = []
+                print(f"   Copied {copied}/{total} events...")
+        if batch:
+            await target.insert_many(batch)
+            copied += len(batch)
+
+        print(f"✅ Copied {copied} events")
+
+        if drop_source:
+            await source.collection.drop()
+            print(f"🗑  Dropped '{source.collection_name}'")
+
+        print(f"👉 Set EVENTS_STORAGE_MODE={target.mode} (and EVENTS_COLLECTION={target.collection_name}) "
+              f"in backend/.env and restart the API")
+
+    except Exception as e:
+        print(f"❌ Error during migration: {e}")
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate events between storage modes")
+    parser.add_argument('--to', dest='target_mode', choices=STORAGE_MODES, required=True)
+    parser.add_argument('--source-collection', default=None)
+    parser.add_argument('--target-collection', default=None)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--drop-source', action='store_true', help="Drop the source collection afterwards")
+    args = parser.parse_args()
+
+    source_mode = 'standard' if args.target_mode == 'timeseries' else 'timeseries'
+    print(f"🚀 Migrating events: {source_mode} -> {args.target_mode}")
+    asyncio.run(migrate_event_storage(
+        source_mode,
+        args.target_mode,
+        source_collection=args.source_collection,
+        target_collection=args.target_collection,
+        batch_size=args.batch_size,
+        drop_source=args.drop_source,
+    ))
+    print("✨ Migration complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other as top-level modules (the server runs from backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """The `server` module, configured at import for a throwaway sqlite database."""
+    pytest.importorskip('fastapi')
+    workdir = tmp_path_factory.mktemp('server')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('STORAGE_BACKEND', 'sqlite')
+        mp.setenv('SQLITE_PATH', str(workdir / 'analytics.db'))
+        mp.setenv('ENRICHMENT_MODE', 'inline')
+        mp.setenv('GEOIP_DB_PATH', str(workdir / 'GeoLite2-Country.mmdb'))
+        mp.setenv('IP_RANGES_PATH', str(workdir / 'ip_ranges.bin'))
+        mp.setenv('PROFILE_DIR', str(workdir / 'profiles'))
+        import server
+    return server
+
+
+@pytest.fixture(scope='session')
+def client(server):
+    """Test client of the app, once its warm-up has finished."""
+    from fastapi.testclient import TestClient
+    with TestClient(server.app) as client:
+        deadline = time.monotonic() + 30
+        while client.get('/api/health/ready').status_code != 200:
+            assert time.monotonic() < deadline, client.get('/api/health/ready').json()
+            time.sleep(0.02)
+        yield client
+
+
+@pytest.fixture
+def auth(client):
+    """Authorization header of a newly registered tenant."""
+    email = f"tenant-{time.monotonic_ns()}@example.com"
+    token = client.post('/api/auth/register', json={"name": "Test", "email": email, "password": "secret123"}).json()
+    return {"Authorization": f"Bearer {token['token']}"}
@@ -0,0 +1,91 @@
+"""
+cohorts.Bitmap against Python sets: set algebra, counts and serialization,
+with containers on both sides of ARRAY_MAX (sorted array / bitset) and
+values spread across 16-bit container boundaries.
+"""
+import random
+from array import array
+
+import pytest
+
+from cohorts import ARRAY_MAX, Bitmap
+
+rng = random.Random(20240501)
+
+
+def values_in(high, count):
+    base = high << 16
+    return set(base + low for low in rng.sample(range(1 << 16), count))
+
+
+# Per-container sizes: empty, small, ARRAY_MAX - 1 / ARRAY_MAX (array), ARRAY_MAX + 1 / large (bitset)
+SIZES = [0, 1, 100, ARRAY_MAX - 1, ARRAY_MAX, ARRAY_MAX + 1, 20000]
+
+
+def random_set(highs=(0, 1, 7, 0xFFFF)):
+    out = set()
+    for high in highs:
+        out |= values_in(high, rng.choice(SIZES))
+    return out
+
+
+CASES = [
+    (set(), set()),
+    ({0, 0xFFFF, 0x10000, 0x1FFFF, 0xFFFFFFFF}, {0xFFFF, 0x10000, 0xFFFFFFFF}),
+    (values_in(0, ARRAY_MAX), values_in(0, ARRAY_MAX)),
+    (values_in(0, ARRAY_MAX + 1), values_in(0, 50)),
+    (values_in(0, 30000), values_in(0, 30000)),
+    (set(range(1 << 16)), values_in(0, ARRAY_MAX + 1)),
+    (values_in(3, ARRAY_MAX - 10) | values_in(4, 10), values_in(3, 20) | values_in(5, ARRAY_MAX + 10)),
+] + [(random_set(), random_set()) for _ in range(8)]
+
+
+def check_containers(bitmap):
+    """Containers are canonical: none empty, arrays sorted and at most ARRAY_MAX, bitsets above it."""
+    for c in bitmap.containers.values():
+        if isinstance(c, array):
+            assert 0 < len(c) <= ARRAY_MAX
+            assert list(c) == sorted(set(c))
+        else:
+            assert c.bit_count() > ARRAY_MAX
+
+
+@pytest.mark.parametrize('a, b', CASES)
+def test_matches_sets(a, b):
+    x, y = Bitmap(a), Bitmap(b)
+    for bitmap, expected in ((x, a), (y, b), (x & y, a & b), (x | y, a | b), (x - y, a - b), (y - x, b - a)):
+        check_containers(bitmap)
+        assert len(bitmap) == len(expected)
+        assert list(bitmap) == sorted(expected)
+        assert bitmap == Bitmap(expected)
+    assert x.intersection_count(y) == len(a & b)
+    assert y.intersection_count(x) == len(a & b)
+
+
+@pytest.mark.parametrize('a, b', CASES)
+def test_serialization_round_trip(a, b):
+    for bitmap in (Bitmap(a), Bitmap(a) | Bitmap(b), Bitmap(a) - Bitmap(b)):
+        restored = Bitmap.from_bytes(bitmap.to_bytes())
+        assert restored == bitmap
+        assert list(restored) == list(bitmap)
+
+
+def test_container_switch_at_array_max():
+    assert isinstance(Bitmap(range(ARRAY_MAX)).containers[0], array)
+    assert isinstance(Bitmap(range(ARRAY_MAX + 1)).containers[0], int)
+    # Removing one value from a bitset container at ARRAY_MAX + 1 turns it back into an array
+    shrunk = Bitmap(range(ARRAY_MAX + 1)) - Bitmap([0])
+    assert isinstance(shrunk.containers[0], array)
+    assert shrunk == Bitmap(range(1, ARRAY_MAX + 1))
+
+
+def test_contains():
+    values = values_in(0, ARRAY_MAX + 1) | values_in(2, 10)
+    bitmap = Bitmap(values)
+    for value in list(values)[:200] + [0x10000, 0x20000 - 1, 0x30000]:
+        assert (value in bitmap) == (value in values)
+
+
+def test_from_bytes_rejects_other_data():
+    with pytest.raises(ValueError):
+        Bitmap.from_bytes(b'XXXX\x00\x00\x00\x00')
@@ -0,0 +1,28 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from cohorts import VISITOR_KIND, CohortEngine
+from compact import DictionaryCache
+from storage import SQLiteRepository
+
+
+def test_days_with_pending_events_are_not_sealed(tmp_path):
+    now = datetime(2024, 5, 10, 12, tzinfo=timezone.utc)
+    pending = [now - timedelta(days=3)]
+
+    async def run():
+        repo = SQLiteRepository(str(tmp_path / 'analytics.db'))
+        await repo.ensure_schema()
+        engine = CohortEngine(repo, DictionaryCache(repo.dictionaries), retention_days=10,
+                              pending_since=lambda: pending[0])
+        await engine.seal_project('p1', now)
+        # An event acked on May 7 is still in the write-ahead log: May 7 onwards stays open
+        sealed = await repo.bitmaps.list_buckets('p1', VISITOR_KIND, '2024-04-01', '2024-06-01')
+        assert max(sealed) == '2024-05-06'
+
+        pending[0] = None
+        await engine.seal_project('p1', now)
+        sealed = await repo.bitmaps.list_buckets('p1', VISITOR_KIND, '2024-04-01', '2024-06-01')
+        assert max(sealed) == '2024-05-09'
+
+    asyncio.run(run())
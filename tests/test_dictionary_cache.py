@@ -0,0 +1,51 @@
+"""
+DictionaryCache under concurrency: a lookup that awaits the store while
+another one fills the same dictionary past max_values must still return
+every value it asked for.
+"""
+import asyncio
+
+from compact import DictionaryCache
+from storage import DictionaryStore
+
+
+class SlowDictionaryStore(DictionaryStore):
+    def __init__(self):
+        self.ids = {}
+
+    async def intern(self, project_id, kind, values):
+        await asyncio.sleep(0)
+        return {v: self.ids.setdefault(v, len(self.ids) + 1) for v in values}
+
+    async def lookup(self, project_id, kind, ids):
+        await asyncio.sleep(0)
+        by_id = {vid: v for v, vid in self.ids.items()}
+        return {i: by_id[i] for i in ids if i in by_id}
+
+
+def test_concurrent_lookups_survive_eviction():
+    async def run():
+        store = SlowDictionaryStore()
+        cache = DictionaryCache(store, max_values=8)
+        batches = [[f"/page/{b}/{i}" for i in range(6)] for b in range(20)]
+        results = await asyncio.gather(*(cache.ids('p1', 'page', values) for values in batches))
+        for values, ids in zip(batches, results):
+            assert ids == {v: store.ids[v] for v in values}
+
+        wanted = [list(range(1 + 6 * b, 7 + 6 * b)) for b in range(20)]
+        results = await asyncio.gather(*(cache.values('p1', 'page', vids) for vids in wanted))
+        by_id = {vid: v for v, vid in store.ids.items()}
+        for vids, values in zip(wanted, results):
+            assert values == {i: by_id[i] for i in vids}
+
+    asyncio.run(run())
+
+
+def test_results_are_not_the_cached_dicts():
+    async def run():
+        cache = DictionaryCache(SlowDictionaryStore(), max_values=2)
+        first = await cache.ids('p1', 'page', ['/a', '/b', '/c'])
+        await cache.ids('p1', 'page', ['/d'])
+        assert set(first) == {'/a', '/b', '/c'}
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+"""
+MongoDictionaryStore.intern against an in-memory stand-in for the Motor
+collections: a concurrent worker's duplicate key is resolved to its id,
+any other insert failure is raised instead of being swallowed.
+"""
+import asyncio
+
+import pytest
+
+from storage import DUPLICATE_KEY, MongoDictionaryStore
+
+
+class BulkWriteError(Exception):
+    def __init__(self, details):
+        super().__init__("batch op errors occurred")
+        self.details = details
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class Dictionaries:
+    def __init__(self, fail=None, raced=()):
+        self.docs = []
+        self.fail = fail
+        # Values another worker interns between our lookup and our insert
+        self.raced = list(raced)
+
+    def find(self, query, projection):
+        return Cursor([{"value": d["value"], "vid": d["vid"]} for d in self.docs
+                       if d["project_id"] == query["project_id"] and d["kind"] == query["kind"]
+                       and d["value"] in query["value"]["$in"]])
+
+    async def insert_many(self, docs, ordered=True):
+        if self.fail is not None:
+            raise self.fail
+        for value in self.raced:
+            self.docs.append({"project_id": docs[0]["project_id"], "kind": docs[0]["kind"], "value": value, "vid": 999})
+        errors = []
+        for i, doc in enumerate(docs):
+            if any(d["value"] == doc["value"] for d in self.docs):
+                errors.append({"index": i, "code": DUPLICATE_KEY})
+            else:
+                self.docs.append(doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+class Counters:
+    def __init__(self):
+        self.next = 0
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=False):
+        self.next += update["$inc"]["next"]
+        return {"next": self.next}
+
+
+def store(dictionaries):
+    s = MongoDictionaryStore.__new__(MongoDictionaryStore)
+    s.collection = dictionaries
+    s.counters = Counters()
+    return s
+
+
+def test_duplicate_from_a_concurrent_worker_resolves_to_its_id():
+    ids = asyncio.run(store(Dictionaries(raced=['/b'])).intern('p1', 'page', ['/a', '/b']))
+    assert ids == {'/a': 1, '/b': 999}
+
+
+def test_other_insert_failures_are_raised():
+    with pytest.raises(TimeoutError):
+        asyncio.run(store(Dictionaries(fail=TimeoutError("timed out"))).intern('p1', 'page', ['/a']))
+    mixed = BulkWriteError({"writeErrors": [{"index": 0, "code": DUPLICATE_KEY}, {"index": 1, "code": 121}]})
+    with pytest.raises(BulkWriteError):
+        asyncio.run(store(Dictionaries(fail=mixed)).intern('p1', 'page', ['/a', '/b']))
@@ -0,0 +1,13 @@
+def test_open_range_overview_is_revalidated(client, auth):
+    project = client.post('/api/projects', json={"name": "Site", "domain": "site.example.com"}, headers=auth).json()
+    url = f"/api/analytics/{project['id']}/overview?days=7"
+
+    first = client.get(url, headers=auth)
+    assert first.status_code == 200
+    second = client.get(url, headers=auth)
+    assert second.status_code == 200
+    # "Last 7 days" ends now, yet back-to-back requests share a cache entry and an ETag
+    assert second.headers['etag'] == first.headers['etag']
+
+    revalidated = client.get(url, headers={**auth, "If-None-Match": first.headers['etag']})
+    assert revalidated.status_code == 304
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timezone
+
+from cache import ProjectDirectory
+from shared_state import InMemorySharedState
+from storage import SQLiteRepository
+
+
+async def tenant_with_projects(tmp_path, count):
+    repo = SQLiteRepository(str(tmp_path / 'analytics.db'))
+    await repo.ensure_schema()
+    for i in range(count):
+        await repo.projects.insert({"id": f"proj-{i:03d}", "tenant_id": "t1", "name": f"Site {i}",
+                                    "domain": f"site{i}.example.com", "created_at": datetime.now(timezone.utc)})
+    await repo.projects.insert({"id": "other", "tenant_id": "t2", "name": "Other", "domain": "other.example.com",
+                                "created_at": datetime.now(timezone.utc)})
+    return repo
+
+
+async def collect(directory, tenant_id):
+    return [[p['id'] for p in page] async for page in directory.pages(tenant_id)]
+
+
+def test_pages_cover_every_project_past_the_cap(tmp_path):
+    async def run():
+        repo = await tenant_with_projects(tmp_path, 8)
+        directory = ProjectDirectory(repo.projects, InMemorySharedState(), max_projects=3)
+        pages = await collect(directory, 't1')
+        assert [len(page) for page in pages] == [3, 3, 2]
+        assert [pid for page in pages for pid in page] == [f"proj-{i:03d}" for i in range(8)]
+        # Projects beyond the cached page are still found by the ownership check
+        assert (await directory.find('proj-007', 't1'))['id'] == 'proj-007'
+        assert await directory.find('other', 't1') is None
+
+    asyncio.run(run())
+
+
+def test_pages_stop_at_an_exact_multiple_of_the_cap(tmp_path):
+    async def run():
+        repo = await tenant_with_projects(tmp_path, 6)
+        directory = ProjectDirectory(repo.projects, InMemorySharedState(), max_projects=3)
+        assert [len(page) for page in await collect(directory, 't1')] == [3, 3]
+        assert await collect(directory, 'nobody') == []
+
+    asyncio.run(run())
+
+
+def test_workers_without_shared_state_see_each_others_changes(tmp_path):
+    async def run():
+        repo = await tenant_with_projects(tmp_path, 2)
+        # Two worker processes, each with its own in-memory state
+        a = ProjectDirectory(repo.projects, InMemorySharedState(), workers=2)
+        b = ProjectDirectory(repo.projects, InMemorySharedState(), workers=2)
+        assert len(await b.list('t1')) == 2
+        assert await b.find('proj-000', 't1') is not None
+
+        await repo.projects.insert({"id": "proj-new", "tenant_id": "t1", "name": "New", "domain": "new.example.com",
+                                    "created_at": datetime.now(timezone.utc)})
+        await repo.projects.delete('proj-000', 't1')
+        await a.invalidate('t1')
+        assert (await b.find('proj-new', 't1'))['id'] == 'proj-new'
+        assert await b.find('proj-000', 't1') is None
+        assert [p['id'] for p in await b.list('t1')] == ['proj-001', 'proj-new']
+
+    asyncio.run(run())
+
+
+def test_single_worker_serves_from_the_cache(tmp_path):
+    async def run():
+        repo = await tenant_with_projects(tmp_path, 2)
+        directory = ProjectDirectory(repo.projects, InMemorySharedState())
+        await directory.list('t1')
+        await directory.find('proj-001', 't1')
+        assert directory.stats()["hits"] == 1 and directory.stats()["misses"] == 1
+
+    asyncio.run(run())
@@ -0,0 +1,23 @@
+from ratelimit import IngestRateLimiter, TokenBucketLimiter
+
+
+def test_override_rate_of_zero_is_unlimited():
+    limiter = TokenBucketLimiter(10, 5, overrides={'vip': (0, 5)})
+    assert all(limiter.check('vip', now=100.0) == 0 for _ in range(1000))
+    assert sum(limiter.check('other', now=100.0) > 0 for _ in range(10)) == 5
+
+
+def test_overrides_apply_when_the_default_is_unlimited():
+    limiter = TokenBucketLimiter(0, 0, overrides={'noisy': (1, 2)})
+    assert limiter.enabled
+    assert [limiter.check('noisy', now=100.0) for _ in range(3)] == [0, 0, 1.0]
+    assert all(limiter.check('other', now=100.0) == 0 for _ in range(100))
+
+
+def test_ingest_limiter_skips_disabled_limits():
+    limits = IngestRateLimiter(project=TokenBucketLimiter(0, 0, overrides={'p2': (1, 1)}),
+                               ip=TokenBucketLimiter(0, 0))
+    assert not limits.ip.enabled
+    assert all(limits.check('p1', 'ip') is None for _ in range(50))
+    assert limits.check('p2', 'ip') is None
+    assert limits.check('p2', 'ip') == ('project', 1)
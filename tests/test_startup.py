@@ -0,0 +1,54 @@
+"""
+Cold start budget: `import server` in a fresh interpreter stays under
+STARTUP_IMPORT_BUDGET_MS (median) and loads none of warmup.LAZY_MODULES.
+The time until a worker is ready is measured by benchmarks/bench_startup.py.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from warmup import LAZY_MODULES
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+IMPORT_BUDGET_MS = float(os.environ.get('STARTUP_IMPORT_BUDGET_MS', '1500'))
+RUNS = 5
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import server
+seconds = time.perf_counter() - t0
+print(json.dumps({"seconds": seconds, "modules": [m for m in sys.argv[1:] if m in sys.modules]}))
+"""
+
+
+def import_server(env):
+    out = subprocess.run([sys.executable, '-c', CHILD, *LAZY_MODULES], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True)
+    assert out.returncode == 0, f"import server failed:\n{out.stderr[-2000:]}"
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope='module')
+def imports(tmp_path_factory):
+    pytest.importorskip('fastapi')
+    workdir = tmp_path_factory.mktemp('startup')
+    env = dict(os.environ, STORAGE_BACKEND='sqlite', SQLITE_PATH=str(workdir / 'analytics.db'))
+    # First run compiles bytecode; it is checked for lazy modules but not timed
+    first = import_server(env)
+    return [first] + [import_server(env) for _ in range(RUNS)]
+
+
+def test_import_within_budget(imports):
+    median_ms = statistics.median(r["seconds"] for r in imports[1:]) * 1000
+    assert median_ms <= IMPORT_BUDGET_MS, f"import server median {median_ms:.0f} ms > budget {IMPORT_BUDGET_MS:g} ms"
+
+
+def test_import_keeps_heavy_modules_lazy(imports):
+    loaded = sorted(set().union(*(r["modules"] for r in imports)))
+    assert loaded == [], f"import server loads {', '.join(loaded)}"
@@ -0,0 +1,16 @@
+def track(client, project, **fields):
+    return client.post('/api/track', json={"project_id": project['id'], "tracking_code": project['tracking_code'],
+                                           "session_id": "s1", "event_type": "pageview", "consent_given": True,
+                                           "page_url": "https://site.example.com/", **fields})
+
+
+def test_track_answers_503_until_warm_up_has_finished(client, server, auth, monkeypatch):
+    project = client.post('/api/projects', json={"name": "Site", "domain": "site.example.com"}, headers=auth).json()
+    with monkeypatch.context() as mp:
+        mp.setattr(server.warm_up, 'finished', None)
+        response = track(client, project)
+        assert response.status_code == 503
+        assert response.headers['retry-after'] == str(server.TRACK_WARMUP_RETRY_AFTER)
+        assert server.repo.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 0
+
+    assert track(client, project).status_code == 200
@@ -0,0 +1,85 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+from compact import CompactEventStore
+from storage import SQLiteRepository
+from wal import WalShipper, WriteAheadLog
+
+
+class ShipperKilled(Exception):
+    pass
+
+
+def make_events(count, project_id='p1'):
+    now = datetime.now(timezone.utc).isoformat()
+    return [{"id": str(uuid.uuid4()), "project_id": project_id, "session_id": f"s{i % 7}", "event_type": "pageview",
+             "page_url": f"https://example.com/{i % 5}", "timestamp": now} for i in range(count)]
+
+
+async def replay_after_kill(tmp_path, repo):
+    await repo.ensure_schema()
+    wal = WriteAheadLog(tmp_path / 'wal', fsync=False)
+    await wal.start()
+    events = make_events(50)
+    for event in events:
+        await wal.append(event)
+
+    async def store_then_die(records):
+        await repo.events.insert_many(records)
+        raise ShipperKilled()
+
+    # The batch is written, then the shipper dies before the checkpoint is committed
+    try:
+        await WalShipper(wal, store_then_die, batch_size=20).ship_once()
+    except ShipperKilled:
+        pass
+    await wal.close()
+
+    # Next start replays the log from the last checkpoint, including the batch already stored
+    wal = WriteAheadLog(tmp_path / 'wal', fsync=False)
+    await wal.start()
+    new_per_batch = []
+
+    async def store(records):
+        new_per_batch.append(len(await repo.events.insert_many(records)))
+
+    shipper = WalShipper(wal, store, batch_size=20)
+    while await shipper.ship_once():
+        pass
+    await wal.close()
+    return events, new_per_batch
+
+
+def test_replay_after_kill_does_not_duplicate(tmp_path):
+    repo = SQLiteRepository(str(tmp_path / 'analytics.db'))
+    events, new_per_batch = asyncio.run(replay_after_kill(tmp_path, repo))
+    stored = repo.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    assert stored == len(events)
+    # The replayed first batch inserted nothing, so nothing downstream is counted twice
+    assert new_per_batch == [0, 20, 10]
+
+
+def test_replay_after_kill_does_not_duplicate_compact(tmp_path):
+    repo = SQLiteRepository(str(tmp_path / 'analytics.db'))
+    repo.events = CompactEventStore(repo.events, repo.dictionaries)
+    events, new_per_batch = asyncio.run(replay_after_kill(tmp_path, repo))
+    stored = repo.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    assert stored == len(events)
+    assert new_per_batch == [0, 20, 10]
+
+
+def test_insert_many_skips_duplicates_within_and_across_batches(tmp_path):
+    repo = SQLiteRepository(str(tmp_path / 'analytics.db'))
+    events = make_events(3)
+
+    async def run():
+        await repo.ensure_schema()
+        first = await repo.events.insert_many(events[:2])
+        second = await repo.events.insert_many(events + [events[2]])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == events[:2]
+    assert second == [events[2]]
+    assert repo.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 3
@@ -0,0 +1,84 @@
+"""
+One write-ahead log per worker: concurrent workers sharing INGEST_WAL_DIR
+never write into or delete each other's segments, and a worker starting
+later ships the logs of workers that are gone.
+"""
+import asyncio
+import json
+
+from wal import WalShipper, WriteAheadLog
+
+
+def record(worker, i):
+    return {"id": f"{worker}-{i}"}
+
+
+async def ship_all(wal):
+    shipped = []
+
+    async def sink(records):
+        shipped.extend(r['id'] for r in records)
+
+    shipper = WalShipper(wal, sink, batch_size=7)
+    while await shipper.ship_once():
+        pass
+    return shipped
+
+
+def test_workers_get_their_own_directories(tmp_path):
+    async def run():
+        a, b = WriteAheadLog(tmp_path, fsync=False), WriteAheadLog(tmp_path, fsync=False)
+        await a.start()
+        await b.start()
+        assert a.directory != b.directory
+        for i in range(20):
+            await a.append(record('a', i))
+            await b.append(record('b', i))
+        # Each shipper reads only its own worker's log, and leaves the other's segments alone
+        assert await ship_all(a) == [f"a-{i}" for i in range(20)]
+        assert await ship_all(b) == [f"b-{i}" for i in range(20)]
+        await a.close()
+        await b.close()
+
+    asyncio.run(run())
+
+
+def test_restarted_worker_takes_over_logs_of_workers_that_are_gone(tmp_path):
+    async def run():
+        a, b = WriteAheadLog(tmp_path, fsync=False), WriteAheadLog(tmp_path, fsync=False)
+        await a.start()
+        await b.start()
+        for i in range(20):
+            await a.append(record('a', i))
+            await b.append(record('b', i))
+        # `a` shipped part of its log before both workers went away
+        shipper = WalShipper(a, lambda records: asyncio.sleep(0), batch_size=5)
+        await shipper.ship_once()
+        await a.close()
+        await b.close()
+
+        c = WriteAheadLog(tmp_path, fsync=False)
+        await c.start()
+        shipped = await ship_all(c)
+        await c.close()
+        return shipped
+
+    shipped = asyncio.run(run())
+    assert sorted(shipped) == sorted([f"a-{i}" for i in range(5, 20)] + [f"b-{i}" for i in range(20)])
+    assert len([p for p in tmp_path.iterdir() if p.name.startswith('worker-')]) == 1
+
+
+def test_takes_over_a_log_shared_by_an_older_release(tmp_path):
+    lines = [json.dumps({"t": 0, "r": record('old', i)}) + '\n' for i in range(10)]
+    (tmp_path / f"{1:012d}.wal").write_text(''.join(lines))
+    (tmp_path / 'checkpoint.json').write_text(json.dumps({"segment": 1, "offset": len(''.join(lines[:4]))}))
+
+    async def run():
+        wal = WriteAheadLog(tmp_path, fsync=False)
+        await wal.start()
+        shipped = await ship_all(wal)
+        await wal.close()
+        return shipped
+
+    assert asyncio.run(run()) == [f"old-{i}" for i in range(4, 10)]
+    assert not list(tmp_path.glob('*.wal'))